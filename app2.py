@@ -1,20 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import pandas as pd
+import numpy as np
 import datetime
 import math
-import requests
 import polyline
 import time
 from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session, flash
 import io
 import os
 import re
-import json
 import uuid
+import copy
 from dotenv import load_dotenv
 from functools import lru_cache
 from sqlalchemy import text
+from tarifas import (
+    CacheTarifas, TabelaTarifas, calcular_adicionais, calcular_custos_linhas,
+    calcular_fretes_base, custos_por_linha
+)
+from rotas import TopK, buscar_rotas_combinadas, estatisticas_busca
+from geocodificacao import GeocodificadorIBGE, chave_municipio
+from cache_geografico import NEGATIVO, CacheGeografico, chave_coordenadas
+from latencia import OrcamentoLatencia, SingleFlight, criar_pool_rede, criar_sessao_http, executar_etapas
+from matriz_distancias import MatrizDistancias, haversine_km
+from provedores_rota import CadeiaProvedores, ProvedorHaversine, ProvedorOpenRoute, ProvedorOSRM
+from pedagios import VALOR_POR_KM_ESTIMADO, MotorPedagio, completar_com_estimativa, estimativa_por_distancia
+from tabela_dedicado import CacheTabelaDedicado, tabela_padrao
+from cache_cotacoes import CacheCotacoes, chave_cotacao
+from cache_distribuido import AUSENTE, CacheDoisNiveis, criar_cliente_redis
+from formulas import CACHE_FORMULAS, FORMULAS_ORIGINAIS, FormulaInvalida, executar_bloco, validar_formula
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -60,7 +75,8 @@ POSTGRESQL_AVAILABLE = False
 
 try:
     print("[DATABASE] 🔄 Inicializando banco de dados...")
-    from models import db, Usuario, BaseUnificada, AgenteTransportadora, MemoriaCalculoAgente, Agente, TipoCalculoFrete, FormulaCalculoFrete, ConfiguracaoAgente, HistoricoCalculo, LogSistema
+    from models import db, Usuario, BaseUnificada, AgenteTransportadora, MemoriaCalculoAgente, Agente, TipoCalculoFrete, FormulaCalculoFrete, ConfiguracaoAgente, HistoricoCalculo, LogSistema, TarifaDedicado, VeiculoDedicado
+    from registro_agentes import CacheRegistroAgentes
     
     # Inicializar o banco
     db.init_app(app)
@@ -77,6 +93,9 @@ try:
         Usuario.criar_usuario_admin_default()
         print("[DATABASE] ✅ Usuário admin criado")
         
+        # Veículos e faixas padrão do frete dedicado
+        TarifaDedicado.criar_tabela_padrao()
+        
         print("[DATABASE] ✅ Sistema inicializado com sucesso")
         
     POSTGRESQL_AVAILABLE = True
@@ -91,9 +110,6 @@ except Exception as e:
 app.config["SESSION_PERMANENT"] = True
 app.config["PERMANENT_SESSION_LIFETIME"] = datetime.timedelta(days=7)
 
-# Cache para municípios
-MUNICIPIOS_CACHE = {}
-
 # ===== FUNÇÕES AUXILIARES LIMPAS =====
 
 def normalizar_cidade_nome(cidade):
@@ -122,49 +138,10 @@ def log_acesso(usuario, acao, ip, detalhes=""):
     except Exception as e:
         print(f"[LOG] Erro: {e}")
 
-# ===== CONSTANTES PARA CÁLCULO DEDICADO =====
-
-def determinar_faixa(distancia):
-    """Determina a faixa de distância para cálculo de custos"""
-    faixas = [
-        (0, 20), (20, 50), (50, 100), (100, 150), (150, 200),
-        (200, 250), (250, 300), (300, 400), (400, 600), (600, 800),
-        (800, 1000), (1000, 1500), (1500, 2000), (2000, 2500),
-        (2500, 3000), (3000, 3500), (3500, 4000), (4000, 4500),
-        (4500, 6000)
-    ]
-    for min_val, max_val in faixas:
-        if min_val < distancia <= max_val:
-            return f"{min_val}-{max_val}"
-    return None
-
-# Tabela fixa de custos para frete dedicado por faixa de distância e tipo de veículo
-TABELA_CUSTOS_DEDICADO = {
-    "0-20": {"FIORINO": 150.0, "VAN": 200.0, "3/4": 250.0, "TOCO": 300.0, "TRUCK": 350.0, "CARRETA": 500.0},
-    "20-50": {"FIORINO": 200.0, "VAN": 250.0, "3/4": 300.0, "TOCO": 400.0, "TRUCK": 500.0, "CARRETA": 700.0},
-    "50-100": {"FIORINO": 300.0, "VAN": 400.0, "3/4": 500.0, "TOCO": 600.0, "TRUCK": 700.0, "CARRETA": 1000.0},
-    "100-150": {"FIORINO": 400.0, "VAN": 500.0, "3/4": 600.0, "TOCO": 800.0, "TRUCK": 1000.0, "CARRETA": 1500.0},
-    "150-200": {"FIORINO": 500.0, "VAN": 600.0, "3/4": 800.0, "TOCO": 1000.0, "TRUCK": 1200.0, "CARRETA": 1800.0},
-    "200-250": {"FIORINO": 600.0, "VAN": 800.0, "3/4": 1000.0, "TOCO": 1200.0, "TRUCK": 1500.0, "CARRETA": 2200.0},
-    "250-300": {"FIORINO": 700.0, "VAN": 900.0, "3/4": 1200.0, "TOCO": 1500.0, "TRUCK": 1800.0, "CARRETA": 2500.0},
-    "300-400": {"FIORINO": 900.0, "VAN": 1200.0, "3/4": 1500.0, "TOCO": 1800.0, "TRUCK": 2200.0, "CARRETA": 3000.0},
-    "400-600": {"FIORINO": 1200.0, "VAN": 1600.0, "3/4": 2000.0, "TOCO": 2500.0, "TRUCK": 3000.0, "CARRETA": 4000.0}
-}
-
-# Valores por km acima de 600km
-DEDICADO_KM_ACIMA_600 = {
-    "FIORINO": 3.0,
-    "VAN": 4.0,
-    "3/4": 4.5,
-    "TOCO": 5.0,
-    "TRUCK": 5.5,
-    "CARRETA": 8.0
-}
-
 # ===== SISTEMA DE CÁLCULO RESTAURADO =====
 
-def carregar_base_unificada():
-    """Carrega base unificada do PostgreSQL"""
+def carregar_base_unificada_do_banco():
+    """Carrega base unificada do PostgreSQL (consulta completa, usada pelo cache de tarifas)"""
     try:
         if not POSTGRESQL_AVAILABLE:
             print("[BASE] ⚠️ PostgreSQL não disponível")
@@ -212,6 +189,133 @@ def carregar_base_unificada():
         print(f"[BASE] ❌ Erro ao carregar PostgreSQL: {e}")
         return None
 
+# Cache compartilhado entre workers/máquinas: L1 em processo + Redis (REDIS_URL) ou substituto em memória
+CLIENTE_REDIS, REDIS_COMPARTILHADO = criar_cliente_redis(
+    os.getenv('REDIS_URL'), max_entradas_local=int(os.getenv('CACHE_L2_LOCAL_MAX', 10000))
+)
+CACHE_COMPARTILHADO = CacheDoisNiveis(
+    CLIENTE_REDIS, REDIS_COMPARTILHADO,
+    max_l1=int(os.getenv('CACHE_L1_MAX', 2000)),
+    ttl_l1=int(os.getenv('CACHE_L1_TTL', 60)),
+    espera_concessao=float(os.getenv('CACHE_ESPERA_CONCESSAO', 10))
+)
+
+# Por quanto tempo um valor obsoleto ainda é servido enquanto uma única thread o recalcula
+CACHE_JANELA_OBSOLETO = float(os.getenv('CACHE_JANELA_OBSOLETO', 30))
+
+# Geração compartilhada da base/agentes: alterações feitas num worker invalidam os demais
+_geracao_dados_vista = CACHE_COMPARTILHADO.geracao('dados')
+_geracao_dados_verificada_em = 0.0
+INTERVALO_SINCRONIA_DADOS = float(os.getenv('INTERVALO_SINCRONIA_DADOS', 1))
+
+def sinalizar_alteracao_dados():
+    """Incrementa a geração compartilhada após uma alteração feita neste processo"""
+    global _geracao_dados_vista
+    geracao = CACHE_COMPARTILHADO.incrementar_geracao('dados')
+    if geracao is not None:
+        _geracao_dados_vista = geracao
+
+def sincronizar_geracao_dados():
+    """
+    Descarta os snapshots locais se outro processo alterou a base ou os agentes
+    (consulta o contador compartilhado no máximo uma vez por INTERVALO_SINCRONIA_DADOS)
+    """
+    global _geracao_dados_vista, _geracao_dados_verificada_em
+    agora = time.time()
+    if agora - _geracao_dados_verificada_em < INTERVALO_SINCRONIA_DADOS:
+        return _geracao_dados_vista
+    _geracao_dados_verificada_em = agora
+    geracao = CACHE_COMPARTILHADO.geracao('dados')
+    if geracao is not None and geracao != _geracao_dados_vista:
+        _geracao_dados_vista = geracao
+        CACHE_TARIFAS.invalidar('alteração em outro processo')
+        if REGISTRO_AGENTES is not None:
+            REGISTRO_AGENTES.invalidar('alteração em outro processo')
+        TABELA_DEDICADO.invalidar('alteração em outro processo')
+    return _geracao_dados_vista
+
+# Snapshot da base unificada mantido em memória por processo
+CACHE_TARIFAS = CacheTarifas(carregar_base_unificada_do_banco, ttl=int(os.getenv('CACHE_TTL', 300)), janela_obsoleto=CACHE_JANELA_OBSOLETO)
+
+def obter_snapshot_tarifas():
+    """Retorna o snapshot de tarifas do processo (carregando a base se necessário)"""
+    sincronizar_geracao_dados()
+    return CACHE_TARIFAS.obter()
+
+def carregar_base_unificada():
+    """Retorna a base unificada a partir do snapshot em memória"""
+    snapshot = obter_snapshot_tarifas()
+    return snapshot.df if snapshot is not None else None
+
+def invalidar_cache_tarifas(motivo=''):
+    """Invalida o snapshot de tarifas após alterações na base"""
+    CACHE_TARIFAS.invalidar(motivo)
+    sinalizar_alteracao_dados()
+
+# Agentes, memórias, configurações e fórmulas carregados de uma vez por processo
+# (None sem banco: registro_agentes depende dos models)
+REGISTRO_AGENTES = CacheRegistroAgentes(ttl=int(os.getenv('CACHE_TTL', 300)), janela_obsoleto=CACHE_JANELA_OBSOLETO) if POSTGRESQL_AVAILABLE else None
+
+def obter_registro_agentes():
+    """Retorna o registro de agentes do processo (None se o banco não estiver disponível)"""
+    if REGISTRO_AGENTES is None:
+        return None
+    sincronizar_geracao_dados()
+    return REGISTRO_AGENTES.obter()
+
+def invalidar_registro_agentes(motivo=''):
+    """Invalida o registro de agentes após alterações no painel admin"""
+    if REGISTRO_AGENTES is not None:
+        REGISTRO_AGENTES.invalidar(motivo)
+    sinalizar_alteracao_dados()
+
+# Tabela do frete dedicado (faixas de distância x veículo), compilada por processo
+TABELA_DEDICADO = CacheTabelaDedicado(ttl=int(os.getenv('CACHE_TTL', 300)), janela_obsoleto=CACHE_JANELA_OBSOLETO)
+TABELA_DEDICADO_PADRAO = tabela_padrao()
+
+def obter_tabela_dedicado():
+    """Retorna a tabela do dedicado do banco (ou a tabela padrão se o banco não estiver disponível)"""
+    if not POSTGRESQL_AVAILABLE:
+        return TABELA_DEDICADO_PADRAO
+    sincronizar_geracao_dados()
+    return TABELA_DEDICADO.obter() or TABELA_DEDICADO_PADRAO
+
+def invalidar_tabela_dedicado(motivo=''):
+    """Invalida a tabela do dedicado após alterações no painel admin"""
+    TABELA_DEDICADO.invalidar(motivo)
+    sinalizar_alteracao_dados()
+
+# Resultados de cotações idênticas (LRU com TTL, marcados com a versão dos dados)
+CACHE_COTACOES = CacheCotacoes(
+    max_entradas=int(os.getenv('COTACOES_CACHE_MAX', 1000)),
+    ttl=int(os.getenv('COTACOES_CACHE_TTL', os.getenv('CACHE_TTL', 300))),
+    janela_obsoleto=float(os.getenv('COTACOES_JANELA_OBSOLETO', CACHE_JANELA_OBSOLETO)),
+    beta=float(os.getenv('COTACOES_BETA_EXPIRACAO', 1.0))
+)
+# Trajetos do dedicado não dependem de tarifas: versão fixa, só o TTL expira
+VERSAO_TRAJETO = 'trajeto'
+
+# Busca por trecho do nome (str.contains) só quando habilitada explicitamente
+BUSCA_LOCALIDADE_SUBSTRING = os.getenv('BUSCA_LOCALIDADE_SUBSTRING', 'false').lower() == 'true'
+
+# Quantidade de rotas combinadas (coleta + transferência + entrega) por cotação
+LIMITE_ROTAS_COMBINADAS = int(os.getenv('LIMITE_ROTAS_COMBINADAS', 10))
+
+def buscar_linhas_localidade(snapshot, coluna, municipio, uf=None):
+    """Retorna os ids das linhas da base cuja coluna corresponde ao município/UF"""
+    return snapshot.indice.buscar(coluna, municipio, uf, permitir_substring=BUSCA_LOCALIDADE_SUBSTRING)
+
+def buscar_linhas_rota(snapshot, origem, uf_origem, destino, uf_destino, linhas_tipo=None):
+    """Retorna os ids das linhas que ligam origem a destino (opcionalmente restritas a um tipo)"""
+    linhas = np.intersect1d(
+        buscar_linhas_localidade(snapshot, 'Origem', origem, uf_origem),
+        buscar_linhas_localidade(snapshot, 'Destino', destino, uf_destino),
+        assume_unique=True
+    )
+    if linhas_tipo is not None:
+        linhas = np.intersect1d(linhas, linhas_tipo, assume_unique=True)
+    return linhas
+
 def popular_banco_com_memorias_originais():
     """Popula o banco de dados com as memórias de cálculo originais - EXECUTAR UMA VEZ"""
     try:
@@ -243,97 +347,7 @@ def popular_banco_com_memorias_originais():
             tipos_ids[tipo_data['nome']] = tipo.id
         
         # 2. Criar fórmulas de cálculo baseadas no código original
-        formulas_originais = [
-            {
-                'nome': 'JEM_DFI_TRANSFERENCIA',
-                'tipo': 'FRACIONADO_TRANSFERENCIA',
-                'formula': '''
-# Lógica original JEM/DFI - transferência padrão
-peso_calculo = float(peso_usado)
-valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
-if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
-    resultado = float(valor_minimo)
-else:
-    faixas_kg = [20, 30, 50, 70, 100, 150, 200, 300, 500]
-    for faixa in faixas_kg:
-        if peso_calculo <= float(faixa):
-            valor_faixa = linha_base.get(str(faixa), 0)
-            if valor_faixa and float(valor_faixa) > 0:
-                resultado = peso_calculo * float(valor_faixa)
-                break
-''',
-                'condicoes': 'fornecedor.contains("JEM") or fornecedor.contains("DFI")',
-                'prioridade': 1
-            },
-            {
-                'nome': 'REUNIDAS_VALOR_FIXO',
-                'tipo': 'FRACIONADO_DIRETO',
-                'formula': '''
-# Lógica original REUNIDAS - valor fixo faixa 200kg
-valor_200 = linha_base.get('200', 0)
-if valor_200 and float(valor_200) > 0:
-    resultado = float(valor_200)  # Valor fixo, não multiplicado
-else:
-    for faixa in [100, 150, 300, 500]:
-        valor_faixa = linha_base.get(str(faixa), 0)
-        if valor_faixa and float(valor_faixa) > 0:
-            resultado = float(valor_faixa)
-            break
-''',
-                'condicoes': 'fornecedor.contains("REUNIDAS")',
-                'prioridade': 1
-            },
-            {
-                'nome': 'PTX_MULTIPLICADO',
-                'tipo': 'FRACIONADO_DIRETO',
-                'formula': '''
-# Lógica original PTX - valor multiplicado pelo peso
-peso_calculo = float(peso_usado)
-valor_por_kg = 0.0
-for key in ['20', '10', '30', '50', '70', '100']:
-    valor_key = linha_base.get(key, 0)
-    if valor_key and float(valor_key) > 0:
-        valor_por_kg = float(valor_key)
-        break
-resultado = peso_calculo * valor_por_kg
-''',
-                'condicoes': 'fornecedor.contains("PTX")',
-                'prioridade': 1
-            },
-            {
-                'nome': 'GRITSCH_DIRETO',
-                'tipo': 'FRACIONADO_DIRETO',
-                'formula': '''
-# Lógica original Gritsch - direto porta-a-porta
-peso_calculo = float(peso_usado)
-valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
-if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
-    resultado = float(valor_minimo)
-else:
-    faixas_kg = [20, 30, 50, 70, 100, 150, 200, 300, 500]
-    for faixa in faixas_kg:
-        if peso_calculo <= float(faixa):
-            valor_faixa = linha_base.get(str(faixa), 0)
-            if valor_faixa and float(valor_faixa) > 0:
-                resultado = peso_calculo * float(valor_faixa)
-                break
-''',
-                'condicoes': 'fornecedor.contains("GRITSCH")',
-                'prioridade': 1
-            },
-            {
-                'nome': 'ROTA_COMPLETA_AUTOMATICA',
-                'tipo': 'FRACIONADO_ROTA_COMPLETA',
-                'formula': '''
-# Sistema automático de combinação de agentes
-# Busca automaticamente: agente_coleta + transferencia + agente_entrega
-# Soma os custos totais de cada etapa
-resultado = custo_coleta_total + custo_transferencia_total + custo_entrega_total
-''',
-                'condicoes': 'peso_cubado <= 1000',
-                'prioridade': 1
-            }
-        ]
+        formulas_originais = FORMULAS_ORIGINAIS
         
         formulas_ids = {}
         for formula_data in formulas_originais:
@@ -352,6 +366,7 @@ resultado = custo_coleta_total + custo_transferencia_total + custo_entrega_total
         print("[SETUP] ✅ Tipos de cálculo e fórmulas configurados")
         
         db.session.commit()
+        invalidar_registro_agentes('setup de memórias')
         print(f"[SETUP] ✅ Sistema de tipos e fórmulas configurado")
         
         print(f"[SETUP] ✅ Sistema base configurado com {len(tipos_calculo)} tipos e {len(formulas_originais)} fórmulas")
@@ -364,102 +379,68 @@ resultado = custo_coleta_total + custo_transferencia_total + custo_entrega_total
 
 
 def carregar_agentes_e_memorias():
-    """Carrega agentes e memórias do banco de dados - VERSÃO LIMPA"""
+    """Retorna os agentes configurados e suas memórias a partir do registro em memória"""
     try:
-        if not POSTGRESQL_AVAILABLE:
+        registro = obter_registro_agentes()
+        if registro is None:
             print("[AGENTES] ⚠️ PostgreSQL não disponível")
             return {}
             
         # Filtrar apenas os agentes que configuramos especificamente
         agentes_configurados = ['PTX', 'Jem/Dfl', 'SOL', 'FILIAL SP', 'GLI']
         
-        # Carregar agentes do banco
-        agentes = AgenteTransportadora.query.filter(
-            AgenteTransportadora.nome.in_(agentes_configurados),
-            AgenteTransportadora.ativo == True
-        ).all()
         agentes_dict = {}
-        
-        for agente in agentes:
-            # Carregar parâmetros de cálculo
-            parametros = agente.get_parametros_calculo()
-            
-            agentes_dict[agente.nome] = {
-                'id': agente.id,
-                'nome': agente.nome,
-                'tipo': agente.tipo_agente,
-                'logica_calculo': agente.logica_calculo,
-                'gris_percentual': agente.gris_percentual,
-                'gris_minimo': agente.gris_minimo,
-                'pedagio_por_bloco': agente.pedagio_por_bloco,
-                'parametros': parametros,
-                'descricao': agente.descricao_logica,
-                'memorias': []
+        for nome in agentes_configurados:
+            agente = registro.agente(nome)
+            if not agente:
+                continue
+            agentes_dict[nome] = {
+                'id': agente['id'],
+                'nome': agente['nome'],
+                'tipo': agente['tipo_agente'],
+                'logica_calculo': agente['logica_calculo'],
+                'gris_percentual': agente['gris_percentual'],
+                'gris_minimo': agente['gris_minimo'],
+                'pedagio_por_bloco': agente['pedagio_por_bloco'],
+                'parametros': agente['parametros'],
+                'descricao': agente['descricao'],
+                'memorias': agente['memorias']
             }
-            
-            # Carregar memórias específicas
-            memorias = MemoriaCalculoAgente.query.filter_by(agente_id=agente.id).all()
-            for memoria in memorias:
-                try:
-                    config = json.loads(memoria.configuracao_memoria) if memoria.configuracao_memoria else {}
-                    agentes_dict[agente.nome]['memorias'].append({
-                        'id': memoria.id,
-                        'tipo_memoria': memoria.tipo_memoria,
-                        'nome_memoria': memoria.nome_memoria,
-                        'condicoes': memoria.condicoes_aplicacao,
-                        'configuracao': config,
-                        'prioridade': memoria.prioridade if hasattr(memoria, 'prioridade') else 1
-                    })
-                except Exception as e:
-                    print(f"[MEMORIA] ⚠️ Erro ao carregar memória {memoria.id}: {e}")
         
-        print(f"[AGENTES] ✅ {len(agentes_dict)} agentes configurados carregados do banco")
         return agentes_dict
         
     except Exception as e:
         print(f"[AGENTES] ❌ Erro ao carregar do banco: {e}")
         return {}
 
-def calcular_rotas_automaticas_banco(origem, uf_origem, destino, uf_destino, peso_cubado, valor_nf, df_base):
+def calcular_rotas_automaticas_banco(origem, uf_origem, destino, uf_destino, peso_cubado, valor_nf, snapshot):
     """Calcula rotas combinadas automaticamente baseado na base de dados (como no código original)"""
     try:
-        # Normalizar nomes como no código original
-        origem_norm = origem.strip().title()
-        destino_norm = destino.strip().title()
+        df_base = snapshot.df
         
-        # Separar tipos da base como no código original
-        df_agentes = df_base[df_base['Tipo'] == 'Agente'].copy()
-        df_transferencias = df_base[df_base['Tipo'] == 'Transferência'].copy()
+        # Separar tipos da base pelo índice do snapshot
+        linhas_agentes = snapshot.indice.linhas_tipo('Agente')
+        linhas_transferencias = snapshot.indice.linhas_tipo('Transferência')
+        df_transferencias = df_base.iloc[linhas_transferencias]
         
-        # Buscar agentes de coleta na origem (como no código original)
-        agentes_coleta = df_agentes[
-            df_agentes['Origem'].str.contains(origem_norm, case=False, na=False)
-        ]
+        # Buscar agentes de coleta na origem
+        # (Base Origem/Base Destino guardam códigos de base como BHZ, SAO e FILIAL,
+        # não a UF; preços de agente valem para o município, então não há busca por estado)
+        linhas_coleta = np.intersect1d(linhas_agentes, buscar_linhas_localidade(snapshot, 'Origem', origem, uf_origem))
         
-        # Buscar agentes de entrega no destino (como no código original)
+        # Buscar agentes de entrega no destino
         # Como os agentes têm Destino=None, vamos buscar agentes que atendem a região do destino
-        agentes_entrega = df_agentes[
-            (df_agentes['Origem'].str.contains(destino_norm, case=False, na=False)) |
-            (df_agentes['Base Destino'].str.contains(destino_norm, case=False, na=False))
-        ]
-        
-        # Buscar agentes por estado também (para melhor cobertura)
-        agentes_coleta_estado = df_agentes[
-            df_agentes['Base Origem'].str.contains(uf_origem, case=False, na=False)
-        ]
-        agentes_entrega_estado = df_agentes[
-            df_agentes['Base Destino'].str.contains(uf_destino, case=False, na=False)
-        ]
+        linhas_entrega = np.intersect1d(linhas_agentes, np.union1d(
+            buscar_linhas_localidade(snapshot, 'Origem', destino, uf_destino),
+            buscar_linhas_localidade(snapshot, 'Base Destino', destino, uf_destino)
+        ))
         
-        # Combinar resultados e REMOVER DUPLICATAS por fornecedor
-        agentes_coleta = pd.concat([agentes_coleta, agentes_coleta_estado]).drop_duplicates(subset=['Fornecedor'])
-        agentes_entrega = pd.concat([agentes_entrega, agentes_entrega_estado]).drop_duplicates(subset=['Fornecedor'])
+        # Listagem sem duplicatas por fornecedor (a busca de rotas usa todas as linhas)
+        agentes_coleta = df_base.iloc[linhas_coleta].drop_duplicates(subset=['Fornecedor'])
+        agentes_entrega = df_base.iloc[linhas_entrega].drop_duplicates(subset=['Fornecedor'])
         
         # Buscar transferências diretas
-        transferencias_diretas = df_transferencias[
-            (df_transferencias['Origem'].str.contains(origem_norm, case=False, na=False)) &
-            (df_transferencias['Destino'].str.contains(destino_norm, case=False, na=False))
-        ]
+        transferencias_diretas = df_base.iloc[buscar_linhas_rota(snapshot, origem, uf_origem, destino, uf_destino, linhas_transferencias)]
         
         print(f"[ROTAS_AUTO] 🔍 Encontrados na base - Coleta: {len(agentes_coleta)}, Transferência: {len(df_transferencias)}, Entrega: {len(agentes_entrega)}, Diretas: {len(transferencias_diretas)}")
         
@@ -469,70 +450,87 @@ def calcular_rotas_automaticas_banco(origem, uf_origem, destino, uf_destino, pes
         if not agentes_entrega.empty:
             print(f"[ROTAS_AUTO] 🚚 Agentes de entrega: {list(agentes_entrega['Fornecedor'].values)}")
         
-        rotas_combinadas = []
+        # K melhores rotas de todas as modalidades; o custo da K-ésima serve de corte
+        rotas_combinadas = TopK(LIMITE_ROTAS_COMBINADAS)
         
         # 1. Rotas diretas (identificação automática pela base) - APENAS AGENTES QUE ATENDEM ORIGEM E DESTINO
-        agentes_diretos = df_agentes[
-            (df_agentes['Origem'].str.contains(origem_norm, case=False, na=False)) &
-            (df_agentes['Destino'].str.contains(destino_norm, case=False, na=False))
-        ]
+        agentes_diretos = df_base.iloc[buscar_linhas_rota(snapshot, origem, uf_origem, destino, uf_destino, linhas_agentes)]
+        
+        # Composição de custo de todas as linhas candidatas calculada em lote
+        linhas_candidatas = np.unique(np.concatenate([
+            agentes_diretos.index, transferencias_diretas.index
+        ]).astype(np.int64))
+        custos = custos_por_linha(calcular_custos_linhas(snapshot.tabela, linhas_candidatas, peso_cubado, valor_nf))
         
         for _, agente in agentes_diretos.iterrows():
-            rota = criar_rota_direta_original(agente, origem, destino, peso_cubado, valor_nf)
+            rota = criar_rota_direta_original(agente, origem, destino, peso_cubado, valor_nf, custos)
             if rota:
-                rotas_combinadas.append(rota)
+                rotas_combinadas.adicionar(rota['custo_total'], rota)
         
         # 2. Transferências diretas (como no original)
         for _, transferencia in transferencias_diretas.iterrows():
-            rota = criar_rota_transferencia_direta_original(transferencia, origem, destino, peso_cubado, valor_nf)
+            rota = criar_rota_transferencia_direta_original(transferencia, origem, destino, peso_cubado, valor_nf, custos)
             if rota:
-                rotas_combinadas.append(rota)
+                rotas_combinadas.adicionar(rota['custo_total'], rota)
         
-        # 3. Rotas combinadas (agente + transferência + agente) - COMO NO ORIGINAL
-        if not agentes_coleta.empty and not agentes_entrega.empty and not df_transferencias.empty:
+        # 3. Rotas combinadas (agente + transferência + agente) pelo grafo de bases
+        # 4. ROTAS PARCIAIS - Quando falta agente de coleta ou entrega
+        busca = buscar_rotas_combinadas(
+            snapshot, peso_cubado, valor_nf,
+            linhas_coleta=linhas_coleta,
+            linhas_entrega=linhas_entrega,
+            linhas_saida_origem=np.intersect1d(
+                linhas_transferencias, buscar_linhas_localidade(snapshot, 'Origem', origem, uf_origem)
+            ) if not len(linhas_coleta) else (),
+            linhas_chegada_destino=np.intersect1d(
+                linhas_transferencias, buscar_linhas_localidade(snapshot, 'Destino', destino, uf_destino)
+            ) if not len(linhas_entrega) else (),
+            k=LIMITE_ROTAS_COMBINADAS,
+            limite=rotas_combinadas.limite()
+        )
+        custos.update(busca['custos'])
+        print(f"[ROTAS_AUTO] ✂️ Busca combinada: {busca['avaliadas']} combinações avaliadas, {busca['podadas']} podadas")
+        
+        if busca['completas']:
             print(f"[ROTAS_AUTO] 🔗 Criando rotas combinadas (coleta + transferência + entrega)...")
+        for combinacao in busca['completas']:
+            agente_col = df_base.loc[combinacao['coleta']]
+            transferencia = df_base.loc[combinacao['transferencia']]
+            agente_ent = df_base.loc[combinacao['entrega']]
             
-            # Limitar para performance (como no original)
-            for _, agente_col in agentes_coleta.head(2).iterrows():
-                for _, transferencia in df_transferencias.head(3).iterrows():
-                    for _, agente_ent in agentes_entrega.head(2).iterrows():
-                        
-                        rota = criar_rota_combinada_original(agente_col, transferencia, agente_ent, origem, destino, peso_cubado, valor_nf)
-                        if rota:
-                            # Adicionar prefixo para identificar como rota combinada
-                            rota['tipo_servico'] = f"COMBINADA: {rota['tipo_servico']}"
-                            rota['descricao'] = f"Rota completa com 3 agentes especializados"
-                            rotas_combinadas.append(rota)
-                            print(f"[ROTAS_AUTO] ✅ Rota combinada criada: {agente_col.get('Fornecedor')} + {transferencia.get('Fornecedor')} + {agente_ent.get('Fornecedor')} = R$ {rota.get('custo_total', 0):.2f}")
-                        else:
-                            print(f"[ROTAS_AUTO] ❌ Falha ao criar rota combinada: {agente_col.get('Fornecedor')} + {transferencia.get('Fornecedor')} + {agente_ent.get('Fornecedor')}")
-        
-        # 4. ROTAS PARCIAIS - Quando falta agente de coleta ou entrega
-        print(f"[ROTAS_AUTO] 🔗 Criando rotas parciais...")
+            rota = criar_rota_combinada_original(agente_col, transferencia, agente_ent, origem, destino, peso_cubado, valor_nf, custos)
+            if rota:
+                # Adicionar prefixo para identificar como rota combinada
+                rota['tipo_servico'] = f"COMBINADA: {rota['tipo_servico']}"
+                rota['descricao'] = f"Rota completa com 3 agentes especializados"
+                rotas_combinadas.adicionar(rota['custo_total'], rota)
+                print(f"[ROTAS_AUTO] ✅ Rota combinada criada: {agente_col.get('Fornecedor')} + {transferencia.get('Fornecedor')} + {agente_ent.get('Fornecedor')} = R$ {rota.get('custo_total', 0):.2f}")
         
         # Rota parcial: Transferência + Entrega (sem coleta)
-        if agentes_coleta.empty and not agentes_entrega.empty and not df_transferencias.empty:
+        if busca['sem_coleta']:
             print(f"[ROTAS_AUTO] ⚠️ Criando rota parcial: Transferência + Entrega (sem agente de coleta)")
-            for _, transferencia in df_transferencias.head(2).iterrows():
-                for _, agente_ent in agentes_entrega.head(2).iterrows():
-                    rota = criar_rota_parcial_transferencia_entrega(transferencia, agente_ent, origem, destino, peso_cubado, valor_nf)
-                    if rota:
-                        rotas_combinadas.append(rota)
+        for combinacao in busca['sem_coleta']:
+            rota = criar_rota_parcial_transferencia_entrega(
+                df_base.loc[combinacao['transferencia']], df_base.loc[combinacao['entrega']],
+                origem, destino, peso_cubado, valor_nf, custos
+            )
+            if rota:
+                rotas_combinadas.adicionar(rota['custo_total'], rota)
         
         # Rota parcial: Coleta + Transferência (sem entrega)
-        if not agentes_coleta.empty and agentes_entrega.empty and not df_transferencias.empty:
+        if busca['sem_entrega']:
             print(f"[ROTAS_AUTO] ⚠️ Criando rota parcial: Coleta + Transferência (sem agente de entrega)")
-            for _, agente_col in agentes_coleta.head(2).iterrows():
-                for _, transferencia in df_transferencias.head(2).iterrows():
-                    rota = criar_rota_parcial_coleta_transferencia(agente_col, transferencia, origem, destino, peso_cubado, valor_nf)
-                    if rota:
-                        rotas_combinadas.append(rota)
+        for combinacao in busca['sem_entrega']:
+            rota = criar_rota_parcial_coleta_transferencia(
+                df_base.loc[combinacao['coleta']], df_base.loc[combinacao['transferencia']],
+                origem, destino, peso_cubado, valor_nf, custos
+            )
+            if rota:
+                rotas_combinadas.adicionar(rota['custo_total'], rota)
         
         # Ordenar por custo total (como no original)
-        rotas_combinadas.sort(key=lambda x: x.get('custo_total', float('inf')))
-        
         print(f"[ROTAS_AUTO] ✅ {len(rotas_combinadas)} rotas automáticas calculadas")
-        return rotas_combinadas[:10]  # Retornar as 10 melhores
+        return rotas_combinadas.ordenados()
         
     except Exception as e:
         print(f"[ROTAS_AUTO] ❌ Erro: {e}")
@@ -548,40 +546,37 @@ def calcular_rota_direta_banco(agente_nome, origem, uf_origem, destino, uf_desti
         
         linha = linhas_agente.iloc[0]
         
-        # Buscar configuração do agente
-        config = ConfiguracaoAgente.query.filter_by(agente_nome=agente_nome, ativa=True).first()
+        # Buscar configuração do agente no registro em memória
+        registro = obter_registro_agentes()
+        config = registro.configuracao(agente_nome) if registro else None
         if not config:
             return None
         
-        valores = config.get_valores_customizados()
-        formulas = config.get_formulas_customizadas()
+        valores = config['valores_customizados']
+        formulas = config['formulas_customizadas']
         
         # Calcular usando fórmula do banco
         if formulas.get('formula_id'):
-            formula = FormulaCalculoFrete.query.get(formulas['formula_id'])
+            formula = registro.formula(formulas['formula_id'])
             if formula:
-                # Executar fórmula
-                exec_globals = {
+                # Executar fórmula (compilada uma vez e mantida no cache)
+                valor_base = executar_bloco(formula['formula'], {
                     'peso_usado': peso_cubado,
                     'valor_nf': valor_nf,
-                    'linha_base': linha.to_dict(),
-                    'resultado': 0
-                }
-                exec(formula.formula, exec_globals)
-                valor_base = exec_globals.get('resultado', 0)
-                
-                # Calcular custos adicionais
-                gris = 0
-                if valor_nf and not valores.get('sem_gris', False):
-                    gris = max((valor_nf * valores.get('gris_percentual', 0) / 100), valores.get('gris_minimo', 0))
-                
-                pedagio = 0
-                if not valores.get('sem_pedagio', False):
-                    pedagio = (peso_cubado / 100) * valores.get('pedagio_100kg', 0)
+                    'linha_base': linha.to_dict()
+                }, chave=('formula', formula['id']))
                 
-                seguro = 0
-                if valor_nf and not valores.get('sem_seguro', False):
-                    seguro = valor_nf * (valores.get('seguro_percentual', 0) / 100)
+                # Calcular custos adicionais (parâmetros da configuração; "sem_*" desliga)
+                adicionais = calcular_adicionais(
+                    peso_cubado, valor_nf,
+                    np.nan if valores.get('sem_gris', False) else valores.get('gris_percentual', 0),
+                    valores.get('gris_minimo', 0),
+                    np.nan if valores.get('sem_pedagio', False) else valores.get('pedagio_100kg', 0),
+                    np.nan if valores.get('sem_seguro', False) else valores.get('seguro_percentual', 0)
+                )
+                gris = float(adicionais['gris'])
+                pedagio = float(adicionais['pedagio'])
+                seguro = float(adicionais['seguro'])
                 
                 total = valor_base + gris + pedagio + seguro
                 
@@ -685,13 +680,13 @@ def calcular_rota_combinada_banco(agente_coleta, agente_transferencia, agente_en
         print(f"[ROTA_COMBINADA] ❌ Erro: {e}")
         return None
 
-def criar_rota_direta_original(agente_linha, origem, destino, peso_cubado, valor_nf):
+def criar_rota_direta_original(agente_linha, origem, destino, peso_cubado, valor_nf, custos=None):
     """Cria rota direta como no código original"""
     try:
         fornecedor = agente_linha.get('Fornecedor', 'N/A')
         
         # Calcular custo usando lógica original do calcular_custo_agente
-        custo_resultado = calcular_custo_agente_original(agente_linha, peso_cubado, valor_nf)
+        custo_resultado = calcular_custo_agente_original(agente_linha, peso_cubado, valor_nf, custos)
         
         if not custo_resultado:
             return None
@@ -734,13 +729,13 @@ def criar_rota_direta_original(agente_linha, origem, destino, peso_cubado, valor
         print(f"[ROTA_DIRETA_ORIG] ❌ Erro: {e}")
         return None
 
-def criar_rota_transferencia_direta_original(transferencia_linha, origem, destino, peso_cubado, valor_nf):
+def criar_rota_transferencia_direta_original(transferencia_linha, origem, destino, peso_cubado, valor_nf, custos=None):
     """Cria rota de transferência direta como no código original"""
     try:
         fornecedor = transferencia_linha.get('Fornecedor', 'N/A')
         
         # Calcular custo usando lógica original
-        custo_resultado = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf)
+        custo_resultado = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf, custos)
         
         if not custo_resultado:
             return None
@@ -785,13 +780,13 @@ def criar_rota_transferencia_direta_original(transferencia_linha, origem, destin
         print(f"[TRANSFERENCIA_ORIG] ❌ Erro: {e}")
         return None
 
-def criar_rota_combinada_original(agente_col, transferencia, agente_ent, origem, destino, peso_cubado, valor_nf):
+def criar_rota_combinada_original(agente_col, transferencia, agente_ent, origem, destino, peso_cubado, valor_nf, custos=None):
     """Cria rota combinada como no código original"""
     try:
         # Calcular cada etapa usando lógica original
-        custo_coleta = calcular_custo_agente_original(agente_col, peso_cubado, valor_nf)
-        custo_transferencia = calcular_custo_agente_original(transferencia, peso_cubado, valor_nf)
-        custo_entrega = calcular_custo_agente_original(agente_ent, peso_cubado, valor_nf)
+        custo_coleta = calcular_custo_agente_original(agente_col, peso_cubado, valor_nf, custos)
+        custo_transferencia = calcular_custo_agente_original(transferencia, peso_cubado, valor_nf, custos)
+        custo_entrega = calcular_custo_agente_original(agente_ent, peso_cubado, valor_nf, custos)
         
         if not all([custo_coleta, custo_transferencia, custo_entrega]):
             return None
@@ -850,89 +845,72 @@ def criar_rota_combinada_original(agente_col, transferencia, agente_ent, origem,
         print(f"[ROTA_COMBINADA_ORIG] ❌ Erro: {e}")
         return None
 
-def calcular_custo_agente_original(linha, peso_cubado, valor_nf):
-    """Calcula custo baseado apenas nos dados da base unificada - SEM LÓGICAS HARDCODED"""
+def calcular_custo_agente_original(linha, peso_cubado, valor_nf, custos=None):
+    """
+    Calcula custo baseado apenas nos dados da base unificada - SEM LÓGICAS HARDCODED
+    
+    Args:
+        custos (dict): Composições já calculadas em lote por linha_id
+            (custos_por_linha); sem ele a linha é calculada sozinha
+    """
     try:
         fornecedor = linha.get('Fornecedor', 'N/A')
         prazo_raw = linha.get('Prazo', 1)
         prazo = int(prazo_raw) if prazo_raw and str(prazo_raw).isdigit() else 1
         
-        # Peso máximo
-        peso_maximo = None
-        if 'PESO MÁXIMO TRANSPORTADO' in linha and pd.notna(linha.get('PESO MÁXIMO TRANSPORTADO')):
-            try:
-                peso_maximo = float(linha.get('PESO MÁXIMO TRANSPORTADO', 0))
-            except:
-                pass
-        
         # Usar apenas lógica de transferência padrão baseada nos dados da base
-        custo_base = calcular_transferencia_padrao(linha, peso_cubado)
+        if custos is None:
+            tabela, linha_id = localizar_linha_tarifa(linha)
+            custos = custos_por_linha(calcular_custos_linhas(tabela, [linha_id], peso_cubado, valor_nf))
+        else:
+            linha_id = linha.name
         
-        if custo_base <= 0:
+        composicao = custos.get(linha_id)
+        if not composicao:
             return None
         
-        # Calcular custos adicionais baseados apenas nos dados da base
-        gris = 0
-        if valor_nf and linha.get('Gris Exc'):
-            gris_perc = float(linha.get('Gris Exc', 0))
-            gris_min = float(linha.get('Gris Min', 0))
-            gris = max((valor_nf * gris_perc / 100), gris_min)
-        
-        pedagio = 0
-        if linha.get('Pedagio (100 Kg)'):
-            pedagio = (peso_cubado / 100) * float(linha.get('Pedagio (100 Kg)', 0))
-        
-        seguro = 0
-        if valor_nf and linha.get('Seguro'):
-            seguro = valor_nf * (float(linha.get('Seguro', 0)) / 100)
-        
-        total = custo_base + gris + pedagio + seguro
-        
         return {
             'fornecedor': fornecedor,
-            'custo_base': custo_base,
-            'gris': gris,
-            'pedagio': pedagio,
-            'seguro': seguro,
-            'total': total,
+            'custo_base': composicao['custo_base'],
+            'gris': composicao['gris'],
+            'pedagio': composicao['pedagio'],
+            'seguro': composicao['seguro'],
+            'total': composicao['total'],
             'prazo': prazo,
-            'peso_maximo': peso_maximo
+            'peso_maximo': composicao['peso_maximo']
         }
         
     except Exception as e:
         print(f"[CUSTO_BASE] ❌ Erro para {linha.get('Fornecedor', 'N/A')}: {e}")
         return None
 
+def localizar_linha_tarifa(linha):
+    """
+    Localiza a linha da base no snapshot de tarifas atual
+    
+    Linhas vindas do DataFrame do snapshot trazem o linha_id no índice. Se a
+    linha não pertence ao snapshot atual (base recarregada no meio da cotação
+    ou dicionário montado fora da base), seus preços são convertidos na hora.
+    
+    Returns:
+        tuple: (TabelaTarifas, linha_id)
+    """
+    snapshot = obter_snapshot_tarifas()
+    linha_id = getattr(linha, 'name', None)
+    if snapshot is not None and isinstance(linha_id, (int, np.integer)) and 0 <= linha_id < len(snapshot):
+        tabela = snapshot.tabela
+        if (tabela.fornecedor[linha_id] == linha.get('Fornecedor') and
+                tabela.origem[linha_id] == linha.get('Origem') and
+                tabela.destino[linha_id] == linha.get('Destino')):
+            return tabela, int(linha_id)
+    
+    return TabelaTarifas(pd.DataFrame([dict(linha)])), 0
+
 def calcular_transferencia_padrao(linha, peso_cubado):
     """Implementa a lógica de transferência padrão do código original"""
     try:
-        peso_calculo = float(peso_cubado)
-        
-        # 1) Valor mínimo até 10kg
-        valor_minimo = linha.get('VALOR MÍNIMO ATÉ 10')
-        if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
-            return float(valor_minimo)
-        
-        # 2) Seleção de faixa por peso
-        faixas_kg = [20, 30, 50, 70, 100, 150, 200, 300, 500]
-        
-        for faixa in faixas_kg:
-            if peso_calculo <= float(faixa):
-                valor_faixa = linha.get(str(faixa), 0)
-                if valor_faixa and float(valor_faixa) > 0:
-                    return peso_calculo * float(valor_faixa)
-        
-        # 3) Acima de 500kg
-        for col_acima in ['Acima 500', 'Acima 1000', 'Acima 2000']:
-            valor_acima = linha.get(col_acima)
-            if valor_acima and float(valor_acima) > 0:
-                return peso_calculo * float(valor_acima)
-        
-        # 4) Fallback: usar valor mínimo se disponível
-        if valor_minimo and float(valor_minimo) > 0:
-            return float(valor_minimo)
-        
-        return 0.0
+        tabela, linha_id = localizar_linha_tarifa(linha)
+        return float(calcular_fretes_base(tabela, [linha_id], float(peso_cubado))[0])
         
     except Exception as e:
         print(f"[TRANSF_PADRAO] ❌ Erro: {e}")
@@ -941,25 +919,33 @@ def calcular_transferencia_padrao(linha, peso_cubado):
 def calcular_com_configuracao_banco(agente_nome, linha_base, peso_cubado, valor_nf):
     """Calcula usando configurações do banco de dados - SEM LÓGICA HARDCODED"""
     try:
-        # Buscar agente no banco
-        agente = AgenteTransportadora.query.filter_by(nome=agente_nome, ativo=True).first()
+        # Buscar agente no registro em memória (sem consulta ao banco por linha)
+        registro = obter_registro_agentes()
+        agente = registro.agente(agente_nome) if registro else None
         if not agente:
             print(f"[AGENTE] ❌ Agente {agente_nome} não encontrado no banco")
             return None
         
-        # Buscar memória de cálculo ativa para este agente
-        memoria = MemoriaCalculoAgente.query.filter_by(
-            agente_id=agente.id, 
-            ativo=True
-        ).order_by(MemoriaCalculoAgente.prioridade.desc()).first()
-        
+        # Memória de cálculo ativa de maior prioridade cujas condições a linha atende
+        dados_calculo = {
+            'peso_usado': peso_cubado,
+            'peso_cubado': peso_cubado,
+            'valor_nf': valor_nf or 0,
+            'fornecedor': agente_nome,
+            'tipo_servico': linha_base.get('Tipo'),
+            'origem': linha_base.get('Origem'),
+            'destino': linha_base.get('Destino'),
+            'base_origem': linha_base.get('Base Origem'),
+            'base_destino': linha_base.get('Base Destino')
+        }
+        memoria = registro.memoria_aplicavel(agente_nome, dados_calculo)
         if not memoria:
-            print(f"[AGENTE] ⚠️ Nenhuma memória de cálculo encontrada para {agente_nome}")
+            print(f"[AGENTE] ⚠️ Nenhuma memória de cálculo aplicável para {agente_nome}")
             return None
         
         # Aplicar lógica baseada no tipo de memória
-        config = memoria.get_configuracao_memoria()
-        tipo_memoria = memoria.tipo_memoria
+        config = memoria['configuracao']
+        tipo_memoria = memoria['tipo_memoria']
         
         valor_base = 0.0
         
@@ -980,7 +966,7 @@ def calcular_com_configuracao_banco(agente_nome, linha_base, peso_cubado, valor_
         elif tipo_memoria == 'formula_customizada':
             # Lógica: usar fórmula customizada
             formula = config.get('formula', '')
-            valor_base = executar_formula_customizada(formula, linha_base, peso_cubado, valor_nf)
+            valor_base = executar_formula_customizada(formula, linha_base, peso_cubado, valor_nf, chave=('memoria', memoria['id']))
             
         else:
             # Fallback: usar valor mínimo se disponível
@@ -994,30 +980,30 @@ def calcular_com_configuracao_banco(agente_nome, linha_base, peso_cubado, valor_
         
         # Calcular custos adicionais baseados na configuração do agente
         gris = 0
-        if agente.gris_percentual > 0 and valor_nf:
-            gris = max((valor_nf * agente.gris_percentual / 100), agente.gris_minimo)
+        if agente['gris_percentual'] > 0 and valor_nf:
+            gris = max((valor_nf * agente['gris_percentual'] / 100), agente['gris_minimo'])
         
         pedagio = 0
-        if agente.calcula_pedagio and agente.pedagio_por_bloco > 0:
-            pedagio = agente.pedagio_por_bloco
+        if agente['calcula_pedagio'] and agente['pedagio_por_bloco'] > 0:
+            pedagio = agente['pedagio_por_bloco']
         
         seguro = 0
-        if agente.calcula_seguro and valor_nf:
+        if agente['calcula_seguro'] and valor_nf:
             seguro = valor_nf * 0.002  # 0.2% padrão
         
         total = valor_base + gris + pedagio + seguro
         
         return {
             'agente': agente_nome,
-            'tipo_agente': agente.tipo_agente,
+            'tipo_agente': agente['tipo_agente'],
             'valor_base': valor_base,
             'gris': gris,
             'pedagio': pedagio,
             'seguro': seguro,
             'total': total,
-            'peso_maximo': agente.get_parametros_calculo().get('peso_maximo', 1000),
-            'volume_maximo': agente.get_parametros_calculo().get('volume_maximo', 100),
-            'memoria_usada': memoria.nome_memoria
+            'peso_maximo': agente['parametros'].get('peso_maximo', 1000),
+            'volume_maximo': agente['parametros'].get('volume_maximo', 100),
+            'memoria_usada': memoria['nome_memoria']
         }
         
     except Exception as e:
@@ -1027,48 +1013,30 @@ def calcular_com_configuracao_banco(agente_nome, linha_base, peso_cubado, valor_
 def calcular_com_tabela_faixas(linha_base, peso_cubado, config):
     """Calcula usando tabela de faixas baseada na configuração"""
     try:
-        peso_calculo = float(peso_cubado)
-        
-        # Verificar se deve usar valor mínimo
-        usar_valor_minimo = config.get('usar_valor_minimo', True)
-        if usar_valor_minimo:
-            valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
-            if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
-                return float(valor_minimo)
-        
-        # Usar faixas configuradas ou padrão
-        faixas_config = config.get('faixas', [20, 30, 50, 70, 100, 150, 200, 300, 500])
-        
-        for faixa in faixas_config:
-            if peso_calculo <= float(faixa):
-                valor_faixa = linha_base.get(str(faixa), 0)
-                if valor_faixa and float(valor_faixa) > 0:
-                    return peso_calculo * float(valor_faixa)
-        
-        # Fallback: usar valor mínimo se disponível
-        valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
-        if valor_minimo and float(valor_minimo) > 0:
-            return float(valor_minimo)
-        
-        return 0.0
+        tabela, linha_id = localizar_linha_tarifa(linha_base)
+        
+        # Faixas configuradas ou padrão; esta lógica não usa a coluna "Acima 500"
+        valor = calcular_fretes_base(
+            tabela, [linha_id], float(peso_cubado),
+            faixas=config.get('faixas'),
+            usar_valor_minimo=config.get('usar_valor_minimo', True),
+            usar_acima_500=False
+        )
+        return float(valor[0])
         
     except Exception as e:
         print(f"[TABELA_FAIXAS] ❌ Erro: {e}")
         return 0.0
 
-def executar_formula_customizada(formula, linha_base, peso_cubado, valor_nf):
-    """Executa fórmula customizada"""
+def executar_formula_customizada(formula, linha_base, peso_cubado, valor_nf, chave=None):
+    """Executa fórmula customizada (compilada uma vez e mantida no cache de fórmulas)"""
     try:
         # Variáveis disponíveis para a fórmula
-        exec_globals = {
+        return executar_bloco(formula, {
             'peso_cubado': peso_cubado,
             'valor_nf': valor_nf or 0,
-            'linha_base': linha_base,
-            'resultado': 0
-        }
-        
-        exec(formula, exec_globals)
-        return exec_globals.get('resultado', 0)
+            'linha_base': linha_base
+        }, chave=chave)
         
     except Exception as e:
         print(f"[FORMULA] ❌ Erro executando fórmula: {e}")
@@ -1076,29 +1044,95 @@ def executar_formula_customizada(formula, linha_base, peso_cubado, valor_nf):
 
 
 
+def versao_dados_fracionado():
+    """
+    Versão dos dados da cotação fracionada: snapshot de tarifas + registro de agentes
+
+    Returns:
+        tuple: (versão ou None sem base, atual) - atual=False quando o snapshot ou o
+        registro é um valor obsoleto servido enquanto outra thread recarrega
+    """
+    snapshot = obter_snapshot_tarifas()
+    if snapshot is None:
+        return None, False
+    registro = obter_registro_agentes()
+    versao = (
+        snapshot.geracao, snapshot.carregado_em,
+        registro.geracao if registro else None, registro.carregado_em if registro else None
+    )
+    return versao, CACHE_TARIFAS.atualizado(snapshot) and (registro is None or REGISTRO_AGENTES.atualizado(registro))
+
+def carimbar_cotacao_fracionada(resultado, origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf):
+    """Ajusta ao pedido atual os campos que repetem a entrada (a chave do cache é normalizada)"""
+    resultado['origem'] = origem
+    resultado['destino'] = destino
+    ranking = resultado.get('ranking_fracionado')
+    if ranking:
+        ranking.update({
+            'id_calculo': f"FRAC_{origem}_{destino}_{int(time.time())}",
+            'origem': f"{origem}/{uf_origem}",
+            'destino': f"{destino}/{uf_destino}",
+            'peso': peso,
+            'cubagem': cubagem,
+            'valor_nf': valor_nf
+        })
+    return resultado
+
 def calcular_frete_fracionado_base_unificada(origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf=None):
+    """
+    Cotação fracionada, reaproveitando o resultado de cotações idênticas com os mesmos dados
+
+    Só uma thread por processo (e um processo, via cache compartilhado) calcula
+    cada cotação; enquanto ela recalcula uma entrada obsoleta, as demais
+    recebem o resultado anterior.
+    """
+    versao, atual = versao_dados_fracionado()
+    if versao is None:
+        return calcular_frete_fracionado_sem_cache(origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf)
+
+    chave = chave_cotacao('fracionado', origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf)
+    # Erros (base indisponível, sem rota, sistema não configurado) não ficam em cache
+    gravavel = lambda resultado: not resultado.get('erro')
+    calculadas = []
+
+    def calculo():
+        calculadas.append(True)
+        return calcular_frete_fracionado_sem_cache(origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf)
+
+    def calcular():
+        if not atual:
+            # Dados obsoletos (recarga em andamento) não vão para os outros workers
+            return calculo()
+        # No cache compartilhado a versão é a geração compartilhada da base/agentes
+        return CACHE_COMPARTILHADO.obter_ou_calcular(
+            'cotacao', (chave, _geracao_dados_vista), calculo, ttl=CACHE_COTACOES.ttl, gravavel=gravavel
+        )
+
+    resultado = CACHE_COTACOES.obter_ou_calcular(chave, versao, calcular, gravavel)
+    if calculadas or resultado.get('erro'):
+        return resultado
+    # Resultado de outro pedido (cache, outra thread ou outro worker) recebe os campos deste
+    print(f"[FRACIONADO] ✅ Cotação em cache: {origem}/{uf_origem} → {destino}/{uf_destino}, {peso}kg")
+    return carimbar_cotacao_fracionada(resultado, origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf)
+
+def calcular_frete_fracionado_sem_cache(origem, uf_origem, destino, uf_destino, peso, cubagem, valor_nf=None):
     """Função restaurada que estava funcionando - INTEGRADA COM BANCO"""
     try:
         print(f"[FRACIONADO] 📦 Calculando: {origem}/{uf_origem} → {destino}/{uf_destino}")
         print(f"[FRACIONADO] Peso: {peso}kg, Cubagem: {cubagem}m³")
         
-        # Carregar base unificada
-        df_base = carregar_base_unificada()
-        if df_base is None or df_base.empty:
+        # Carregar base unificada (snapshot em memória)
+        snapshot = obter_snapshot_tarifas()
+        if snapshot is None or snapshot.df.empty:
             return {'sem_opcoes': True, 'erro': 'Base de dados não disponível'}
+        df_base = snapshot.df
         
         # Carregar agentes e memórias do banco
         agentes_dict = carregar_agentes_e_memorias()
         
-        # Normalizar nomes
-        origem_norm = origem.strip().title()
-        destino_norm = destino.strip().title()
-        
-        # Filtrar dados da base
-        df_filtrado = df_base[
-            (df_base['Origem'].str.contains(origem_norm, case=False, na=False)) &
-            (df_base['Destino'].str.contains(destino_norm, case=False, na=False))
-        ]
+        # Filtrar dados da base pelo índice de origem/destino
+        linhas_rota = buscar_linhas_rota(snapshot, origem, uf_origem, destino, uf_destino)
+        df_filtrado = df_base.iloc[linhas_rota]
         
         if df_filtrado.empty:
             return {'sem_opcoes': True, 'erro': 'Nenhuma rota encontrada'}
@@ -1106,6 +1140,9 @@ def calcular_frete_fracionado_base_unificada(origem, uf_origem, destino, uf_dest
         # Calcular peso cubado
         peso_cubado = max(peso, cubagem * 250) if cubagem else peso
         
+        # Frete base e adicionais de todas as linhas da rota de uma vez
+        custos_rota = custos_por_linha(calcular_custos_linhas(snapshot.tabela, linhas_rota, peso_cubado, valor_nf))
+        
         resultados = []
         resultados_detalhados = []  # Para o ranking com detalhes
         
@@ -1115,7 +1152,7 @@ def calcular_frete_fracionado_base_unificada(origem, uf_origem, destino, uf_dest
             return {'sem_opcoes': True, 'erro': 'Sistema não configurado. Execute o setup na interface admin.'}
         
         # Calcular rotas automáticas baseadas nas configurações do banco
-        rotas_automaticas = calcular_rotas_automaticas_banco(origem, uf_origem, destino, uf_destino, peso_cubado, valor_nf, df_base)
+        rotas_automaticas = calcular_rotas_automaticas_banco(origem, uf_origem, destino, uf_destino, peso_cubado, valor_nf, snapshot)
         if rotas_automaticas:
             resultados_detalhados.extend(rotas_automaticas)
             print(f"[FRACIONADO] 🤖 {len(rotas_automaticas)} rotas automáticas do banco adicionadas")
@@ -1199,59 +1236,19 @@ def calcular_frete_fracionado_base_unificada(origem, uf_origem, destino, uf_dest
                 # Fallback para cálculo tradicional se não estiver no banco
                 print(f"[FRACIONADO] 📊 Cálculo tradicional para: {fornecedor}")
                 
-                # Obter valor por peso (cálculo tradicional)
-                valor_base = None
-                if peso_cubado <= 10 and linha.get('VALOR MÍNIMO ATÉ 10'):
-                    valor_base = float(linha.get('VALOR MÍNIMO ATÉ 10', 0))
-                elif peso_cubado <= 20 and linha.get('20'):
-                    valor_base = float(linha.get('20', 0)) * peso_cubado
-                elif peso_cubado <= 30 and linha.get('30'):
-                    valor_base = float(linha.get('30', 0)) * peso_cubado
-                elif peso_cubado <= 50 and linha.get('50'):
-                    valor_base = float(linha.get('50', 0)) * peso_cubado
-                elif peso_cubado <= 70 and linha.get('70'):
-                    valor_base = float(linha.get('70', 0)) * peso_cubado
-                elif peso_cubado <= 100 and linha.get('100'):
-                    valor_base = float(linha.get('100', 0)) * peso_cubado
-                elif peso_cubado <= 150 and linha.get('150'):
-                    valor_base = float(linha.get('150', 0)) * peso_cubado
-                elif peso_cubado <= 200 and linha.get('200'):
-                    valor_base = float(linha.get('200', 0)) * peso_cubado
-                elif peso_cubado <= 300 and linha.get('300'):
-                    valor_base = float(linha.get('300', 0)) * peso_cubado
-                elif peso_cubado <= 500 and linha.get('500'):
-                    valor_base = float(linha.get('500', 0)) * peso_cubado
-                else:
-                    valor_base = float(linha.get('Acima 500', 0)) * peso_cubado
-                
-                if not valor_base or valor_base <= 0:
+                # Composição de custo (cálculo tradicional, calculada em lote acima)
+                composicao = custos_rota.get(idx)
+                if not composicao:
                     continue
                 
-                # Calcular custos adicionais
-                gris = 0
-                if valor_nf and linha.get('Gris Exc'):
-                    gris_perc = float(linha.get('Gris Exc', 0))
-                    gris_min = float(linha.get('Gris Min', 0))
-                    gris = max((valor_nf * gris_perc / 100), gris_min)
-                
-                pedagio = 0
-                if linha.get('Pedagio (100 Kg)'):
-                    pedagio = (peso_cubado / 100) * float(linha.get('Pedagio (100 Kg)', 0))
-                
-                seguro = 0
-                if valor_nf and linha.get('Seguro'):
-                    seguro = valor_nf * (float(linha.get('Seguro', 0)) / 100)
-                
-                total = valor_base + gris + pedagio + seguro
-                
                 resultado = {
                     'fornecedor': fornecedor,
                     'tipo_servico': f"{linha.get('Tipo', 'Fracionado')} - {fornecedor}",
-                    'custo_base': valor_base,
-                    'gris': gris,
-                    'pedagio': pedagio,
-                    'seguro': seguro,
-                    'total': total,
+                    'custo_base': composicao['custo_base'],
+                    'gris': composicao['gris'],
+                    'pedagio': composicao['pedagio'],
+                    'seguro': composicao['seguro'],
+                    'total': composicao['total'],
                     'peso_usado': f"{peso_cubado}kg",
                     'prazo': 3,
                     'eh_melhor_opcao': False
@@ -1683,55 +1680,86 @@ def calcular():
         
         print("[CALCULO] ✅ Parâmetros válidos, iniciando geocodificação...")
         
-        # Geocodificação
-        coord_origem = geocode(origem, uf_origem)
-        coord_destino = geocode(destino, uf_destino)
-        
-        print(f"[CALCULO] Coordenadas obtidas: origem={coord_origem}, destino={coord_destino}")
-        
-        if not coord_origem or not coord_destino:
-            print("[CALCULO] ❌ Falha na geocodificação")
-            return jsonify({"error": "Não foi possível geocodificar origem ou destino"}), 400
-        
-        print("[CALCULO] ✅ Geocodificação bem-sucedida, calculando rota...")
-        
-        # Calcular rota
-        rota_info = calcular_distancia_osrm(coord_origem, coord_destino) or \
-                    calcular_distancia_reta(coord_origem, coord_destino)
+        # Etapas de rede dentro do orçamento de latência da cotação
+        orcamento = OrcamentoLatencia(ORCAMENTO_LATENCIA_COTACAO)
+        
+        # Trajeto (coordenadas, rota e pedágio) já calculado para o mesmo par origem/destino
+        chave_trajeto = chave_cotacao('dedicado', origem, uf_origem, destino, uf_destino)
+        trajeto = CACHE_COTACOES.obter(chave_trajeto, VERSAO_TRAJETO) or CACHE_COMPARTILHADO.obter('trajeto', chave_trajeto)
+        if trajeto:
+            orcamento.registrar('cache_cotacoes', 0)
+            coord_origem, coord_destino = trajeto['coord_origem'], trajeto['coord_destino']
+            rota_info, pedagio = trajeto['rota_info'], trajeto['pedagio']
+            print(f"[CALCULO] ✅ Trajeto em cache: {rota_info['distancia']:.1f} km ({rota_info['provider']})")
+        else:
+            # Geocodificação de origem e destino em paralelo
+            coordenadas = executar_etapas(POOL_REDE, {
+                'geocode_origem': lambda: geocode(origem, uf_origem, timeout=orcamento.timeout(10)),
+                'geocode_destino': lambda: geocode(destino, uf_destino, timeout=orcamento.timeout(10))
+            }, orcamento)
+            # Etapa que estourou o orçamento: tabela local / coordenada da UF, sem rede
+            coord_origem = coordenadas['geocode_origem'] or geocode(origem, uf_origem, usar_rede=False)
+            coord_destino = coordenadas['geocode_destino'] or geocode(destino, uf_destino, usar_rede=False)
+        
+            print(f"[CALCULO] Coordenadas obtidas: origem={coord_origem}, destino={coord_destino}")
+        
+            if not coord_origem or not coord_destino:
+                print("[CALCULO] ❌ Falha na geocodificação")
+                return jsonify({"error": "Não foi possível geocodificar origem ou destino"}), 400
+        
+            print("[CALCULO] ✅ Geocodificação bem-sucedida, calculando rota...")
+        
+            # Calcular rota: matriz pré-calculada, OSRM (se houver orçamento) ou linha reta
+            rota_info = distancia_da_matriz(origem, uf_origem, destino, uf_destino)
+            if rota_info:
+                orcamento.registrar('matriz_distancias', 0)
+            elif orcamento.esgotado():
+                orcamento.registrar('rota_provedores', 0, estourou=True)
+            else:
+                rota_info = executar_etapas(POOL_REDE, {
+                    'rota_provedores': lambda: calcular_distancia_rota(coord_origem, coord_destino, timeout=orcamento.timeout(10))
+                }, orcamento)['rota_provedores']
+            rota_info = rota_info or calcular_distancia_reta(coord_origem, coord_destino)
         
-        print(f"[CALCULO] Informações da rota: {rota_info}")
+            print(f"[CALCULO] Informações da rota: {rota_info}")
         
-        if not rota_info:
-            print("[CALCULO] ❌ Falha no cálculo da rota")
-            return jsonify({"error": "Não foi possível calcular a rota"}), 400
+            if not rota_info:
+                print("[CALCULO] ❌ Falha no cálculo da rota")
+                return jsonify({"error": "Não foi possível calcular a rota"}), 400
         
-        print("[CALCULO] ✅ Rota calculada, calculando custos...")
+            print("[CALCULO] ✅ Rota calculada, calculando custos...")
         
-        # Calcular pedágio real
-        analise_preliminar = gerar_analise_trajeto(coord_origem, coord_destino, rota_info, {}, "Dedicado", origem, uf_origem, destino, uf_destino)
-        pedagio_real = analise_preliminar.get('pedagio_real', 0)
+            # Pedágio por categoria de veículo (uma passada pela geometria da rota)
+            pedagio = calcular_pedagio(coord_origem, coord_destino, rota_info)
+            
+            # Linha reta ou etapa fora do orçamento são fallbacks: não guardar
+            if rota_info["provider"] != "Distância Reta" and not orcamento.relatorio()['etapas_estouradas']:
+                trajeto = {
+                    'coord_origem': coord_origem, 'coord_destino': coord_destino,
+                    'rota_info': rota_info, 'pedagio': pedagio
+                }
+                CACHE_COTACOES.gravar(chave_trajeto, VERSAO_TRAJETO, trajeto)
+                CACHE_COMPARTILHADO.gravar('trajeto', chave_trajeto, trajeto, ttl=CACHE_COTACOES.ttl)
         
-        # Calcular custos
-        custos = calcular_custos_dedicado(uf_origem, origem, uf_destino, destino, rota_info["distancia"], pedagio_real)
+        # Calcular custos só dos veículos em que a carga cabe
+        veiculos, aviso_capacidade = selecionar_veiculos_dedicado(peso, cubagem)
+        custos = calcular_custos_dedicado(uf_origem, origem, uf_destino, destino, rota_info["distancia"],
+                                          pedagio_por_veiculo=pedagio['por_veiculo'], veiculos=veiculos)
         
         print(f"[CALCULO] Custos calculados: {custos}")
         
-        # Gerar análise final
-        analise = gerar_analise_trajeto(coord_origem, coord_destino, rota_info, custos, "Dedicado", origem, uf_origem, destino, uf_destino)
+        # Gerar análise
+        analise = gerar_analise_trajeto(coord_origem, coord_destino, rota_info, custos, "Dedicado", origem, uf_origem, destino, uf_destino, pedagio)
         
         # Gerar ranking
         ranking_dedicado = gerar_ranking_dedicado(custos, analise, rota_info, peso, cubagem, valor_nf)
         
         print(f"[CALCULO] Ranking gerado: {ranking_dedicado}")
         
-        # Preparar rota para mapa
-        rota_pontos = rota_info.get("rota_pontos", [])
-        if not isinstance(rota_pontos, list) or len(rota_pontos) == 0:
-            rota_pontos = [coord_origem, coord_destino]
-        
-        for i, pt in enumerate(rota_pontos):
-            if not isinstance(pt, list) or len(pt) < 2:
-                rota_pontos[i] = [0, 0]
+        # Preparar rota para mapa: geometria simplificada como polyline codificada
+        # (sem geometria, por exemplo na matriz ou na linha reta: origem -> destino)
+        rota_polyline = rota_info.get("rota_polyline") or \
+            polyline.encode([tuple(coord_origem[:2]), tuple(coord_destino[:2])], 5)
         
         # Resposta completa
         resposta = {
@@ -1739,7 +1767,7 @@ def calcular():
             "distancia": rota_info["distancia"],
             "duracao": rota_info["duracao"],
             "custos": custos,
-            "rota_pontos": rota_pontos,
+            "rota_polyline": rota_polyline,
             "analise": {
                 "tempo_estimado": analise["tempo_estimado"],
                 "consumo_combustivel": analise["consumo_combustivel"],
@@ -1753,14 +1781,16 @@ def calcular():
                 "duracao_minutos": analise["duracao_minutos"],
                 "provider": analise["provider"],
                 "data_hora": analise["data_hora"],
-                "rota_pontos": rota_pontos,
+                "rota_polyline": rota_polyline,
                 "id_historico": analise["id_historico"],
                 "tipo": "Dedicado",
                 "custos": custos
             },
             "ranking_dedicado": ranking_dedicado,
             "melhor_opcao": ranking_dedicado['melhor_opcao'] if ranking_dedicado else None,
-            "total_opcoes": ranking_dedicado['total_opcoes'] if ranking_dedicado else len(custos)
+            "total_opcoes": ranking_dedicado['total_opcoes'] if ranking_dedicado else len(custos),
+            "aviso_capacidade": aviso_capacidade,
+            "orcamento_latencia": orcamento.relatorio()
         }
         
         print(f"[CALCULO] ✅ Resposta preparada: {resposta}")
@@ -1772,52 +1802,168 @@ def calcular():
         traceback.print_exc()
         return jsonify({"error": f"Erro ao calcular frete dedicado: {str(e)}"}), 500
 
-def geocode(municipio, uf):
-    """Geocodifica município e UF para coordenadas"""
+# Tabela local de municípios (IBGE); Nominatim só como provedor secundário
+GEOCODIFICADOR_IBGE = GeocodificadorIBGE()
+GEOCODE_NOMINATIM = os.getenv('GEOCODE_NOMINATIM', 'true').lower() == 'true'
+
+# Distâncias das rotas mais cotadas (geradas por gerar_matriz_distancias.py)
+MATRIZ_DISTANCIAS = MatrizDistancias.carregar()
+
+def distancia_da_matriz(origem, uf_origem, destino, uf_destino):
+    """Retorna a rota da matriz de distâncias pré-calculada (ou None)"""
+    if not len(MATRIZ_DISTANCIAS):
+        return None
+    municipio_origem = GEOCODIFICADOR_IBGE.buscar(origem, uf_origem)
+    municipio_destino = GEOCODIFICADOR_IBGE.buscar(destino, uf_destino)
+    if not municipio_origem or not municipio_destino:
+        return None
+    encontrado = MATRIZ_DISTANCIAS.buscar(municipio_origem['codigo_ibge'], municipio_destino['codigo_ibge'])
+    if not encontrado:
+        return None
+    return {
+        "distancia": encontrado[0],
+        "duracao": encontrado[1],
+        "rota_pontos": [],
+        "provider": "Matriz de distâncias"
+    }
+
+# Chamadas de rede das cotações: sessão keep-alive, pool de threads e orçamento total
+SESSAO_HTTP = criar_sessao_http()
+POOL_REDE = criar_pool_rede(int(os.getenv('POOL_REDE_WORKERS', 8)))
+SINGLE_FLIGHT = SingleFlight()
+
+def criar_provedores_rota():
+    """Monta a cadeia de roteamento a partir de ROTAS_PROVEDORES (ex: "osrm,openroute,haversine")"""
+    provedores = []
+    for nome in os.getenv('ROTAS_PROVEDORES', 'osrm,openroute').split(','):
+        nome = nome.strip().lower()
+        if nome == 'osrm':
+            provedores.append(ProvedorOSRM(SESSAO_HTTP, os.getenv('OSRM_URL', 'http://router.project-osrm.org')))
+        elif nome == 'openroute' and os.getenv('OPENROUTE_API_KEY'):
+            provedores.append(ProvedorOpenRoute(
+                SESSAO_HTTP, os.getenv('OPENROUTE_API_KEY'),
+                os.getenv('OPENROUTE_URL', 'https://api.openrouteservice.org')
+            ))
+        elif nome == 'haversine':
+            provedores.append(ProvedorHaversine(float(os.getenv('FATOR_DESVIO', 1.0))))
+    return CadeiaProvedores(
+        provedores,
+        falhas_para_abrir=int(os.getenv('ROTAS_FALHAS_CIRCUITO', 3)),
+        espera=int(os.getenv('ROTAS_ESPERA_CIRCUITO', 60))
+    )
+
+# Provedores de roteamento (OSRM, OpenRouteService, Haversine) com circuit breaker
+PROVEDORES_ROTA = criar_provedores_rota()
+ORCAMENTO_LATENCIA_COTACAO = float(os.getenv('ORCAMENTO_LATENCIA_MS', 8000)) / 1000
+
+# Cache persistente (SQLite) das consultas ao Nominatim e ao OSRM
+CACHE_GEOGRAFICO = CacheGeografico(
+    ttl=int(os.getenv('GEO_CACHE_TTL', 30 * 86400)),
+    ttl_negativo=int(os.getenv('GEO_CACHE_TTL_NEGATIVO', 86400))
+)
+# Falhas de rede (timeout, HTTP 5xx) ficam em cache por pouco tempo
+GEO_CACHE_TTL_ERRO = int(os.getenv('GEO_CACHE_TTL_ERRO', 300))
+
+def obter_geografico(namespace, chave):
+    """
+    Consulta o cache compartilhado e depois o SQLite local
+
+    Returns:
+        valor, NEGATIVO (consulta já feita sem resultado) ou None (não está em cache)
+    """
+    valor = CACHE_COMPARTILHADO.obter(namespace, chave, AUSENTE)
+    if valor is not AUSENTE:
+        return NEGATIVO if valor is None else valor
+    valor = CACHE_GEOGRAFICO.obter(namespace, chave)
+    if valor is not None:
+        # Validade restante no SQLite é desconhecida: promove com TTL curto
+        CACHE_COMPARTILHADO.gravar(namespace, chave, None if valor is NEGATIVO else valor, ttl=GEO_CACHE_TTL_ERRO)
+    return valor
+
+def gravar_geografico(namespace, chave, valor, ttl=None):
+    """Grava no SQLite local e no cache compartilhado (None = resultado negativo)"""
+    CACHE_GEOGRAFICO.gravar(namespace, chave, valor, ttl=ttl)
+    if ttl is None:
+        ttl = CACHE_GEOGRAFICO.ttl_negativo if valor is None else CACHE_GEOGRAFICO.ttl
+    CACHE_COMPARTILHADO.gravar(namespace, chave, valor, ttl=ttl)
+
+# Fallback: coordenadas aproximadas dos estados brasileiros
+COORDENADAS_ESTADOS = {
+    'AC': [-8.77, -70.55], 'AL': [-9.71, -35.73], 'AP': [0.90, -52.00], 'AM': [-3.42, -65.73],
+    'BA': [-12.97, -38.50], 'CE': [-3.72, -38.54], 'DF': [-15.78, -47.92], 'ES': [-20.31, -40.31],
+    'GO': [-16.64, -49.25], 'MA': [-2.53, -44.30], 'MT': [-15.60, -56.10], 'MS': [-20.44, -54.64],
+    'MG': [-19.92, -43.93], 'PA': [-1.45, -48.50], 'PB': [-7.12, -34.88], 'PR': [-25.42, -49.27],
+    'PE': [-8.05, -34.88], 'PI': [-5.09, -42.80], 'RJ': [-22.91, -43.20], 'RN': [-5.79, -35.21],
+    'RS': [-30.03, -51.23], 'RO': [-8.76, -63.90], 'RR': [2.82, -60.67], 'SC': [-27.59, -48.55],
+    'SP': [-23.55, -46.64], 'SE': [-10.90, -37.07], 'TO': [-10.17, -48.33]
+}
+
+def geocode_nominatim(municipio, uf, timeout=10):
+    """Geocodifica município e UF pelo Nominatim (provedor secundário, com cache persistente)"""
+    chave = f"{chave_municipio(municipio)}|{str(uf).strip().upper()}"
+    em_cache = obter_geografico('geocode', chave)
+    if em_cache is NEGATIVO:
+        return None
+    if em_cache is None:
+        # Consultas idênticas simultâneas compartilham uma única chamada
+        em_cache = SINGLE_FLIGHT.executar(('geocode', chave), lambda: consultar_nominatim(municipio, uf, chave, timeout))
+    if em_cache is None:
+        return None
+    return [em_cache[0], em_cache[1], f"{municipio} - {uf}"]
+
+def consultar_nominatim(municipio, uf, chave, timeout=10):
+    """Chamada ao Nominatim; grava o resultado no cache e retorna [lat, lon] ou None"""
     try:
-        if not municipio or not uf:
-            print(f"[GEOCODE] Dados inválidos: municipio='{municipio}', uf='{uf}'")
-            return None
-            
         query = f"{municipio}, {uf}, Brasil"
         url = f"https://nominatim.openstreetmap.org/search?q={query}&format=json&limit=1"
         
-        print(f"[GEOCODE] Buscando: {query}")
-        print(f"[GEOCODE] URL: {url}")
-        
-        response = requests.get(url, timeout=10)
-        print(f"[GEOCODE] Status: {response.status_code}")
+        print(f"[GEOCODE] Buscando no Nominatim: {query}")
+        response = SESSAO_HTTP.get(url, timeout=timeout)
         
         if response.status_code == 200:
             data = response.json()
-            print(f"[GEOCODE] Resposta: {data}")
-            
             if data and len(data) > 0:
                 lat = float(data[0]['lat'])
                 lon = float(data[0]['lon'])
-                resultado = [lat, lon, f"{municipio} - {uf}"]
-                print(f"[GEOCODE] Sucesso: {resultado}")
-                return resultado
-            else:
-                print(f"[GEOCODE] Nenhum resultado encontrado para: {query}")
+                gravar_geografico('geocode', chave, [lat, lon])
+                return [lat, lon]
+            print(f"[GEOCODE] Nenhum resultado encontrado para: {query}")
+            gravar_geografico('geocode', chave, None)
         else:
             print(f"[GEOCODE] Erro HTTP: {response.status_code}")
-            
-        # Fallback: coordenadas aproximadas dos estados brasileiros
-        coordenadas_estados = {
-            'AC': [-8.77, -70.55], 'AL': [-9.71, -35.73], 'AP': [0.90, -52.00], 'AM': [-3.42, -65.73],
-            'BA': [-12.97, -38.50], 'CE': [-3.72, -38.54], 'DF': [-15.78, -47.92], 'ES': [-20.31, -40.31],
-            'GO': [-16.64, -49.25], 'MA': [-2.53, -44.30], 'MT': [-15.60, -56.10], 'MS': [-20.44, -54.64],
-            'MG': [-19.92, -43.93], 'PA': [-1.45, -48.50], 'PB': [-7.12, -34.88], 'PR': [-25.42, -49.27],
-            'PE': [-8.05, -34.88], 'PI': [-5.09, -42.80], 'RJ': [-22.91, -43.20], 'RN': [-5.79, -35.21],
-            'RS': [-30.03, -51.23], 'RO': [-8.76, -63.90], 'RR': [2.82, -60.67], 'SC': [-27.59, -48.55],
-            'SP': [-23.55, -46.64], 'SE': [-10.90, -37.07], 'TO': [-10.17, -48.33]
-        }
+            gravar_geografico('geocode', chave, None, ttl=GEO_CACHE_TTL_ERRO)
+        return None
+    except Exception as e:
+        print(f"[GEOCODE] Erro no Nominatim: {e}")
+        gravar_geografico('geocode', chave, None, ttl=GEO_CACHE_TTL_ERRO)
+        return None
+
+def geocode(municipio, uf, usar_rede=True, timeout=10):
+    """Geocodifica município e UF para coordenadas (tabela IBGE local, Nominatim e UF)"""
+    try:
+        if not municipio or not uf:
+            print(f"[GEOCODE] Dados inválidos: municipio='{municipio}', uf='{uf}'")
+            return None
         
-        if uf in coordenadas_estados:
-            lat, lon = coordenadas_estados[uf]
-            resultado = [lat, lon, f"{municipio} - {uf}"]
-            print(f"[GEOCODE] Fallback para {uf}: {resultado}")
+        # 1. Tabela local de municípios (sem rede)
+        local = GEOCODIFICADOR_IBGE.buscar(municipio, uf)
+        if local:
+            return [local['lat'], local['lon'], f"{municipio} - {uf}"]
+        
+        # 2. Nominatim, quando habilitado
+        if GEOCODE_NOMINATIM and usar_rede:
+            resultado = geocode_nominatim(municipio, uf, timeout=timeout)
+            if resultado:
+                print(f"[GEOCODE] Sucesso (Nominatim): {resultado}")
+                return resultado
+        
+        # 3. Capital da UF na tabela local ou coordenada aproximada do estado
+        uf = str(uf).strip().upper()
+        capital = GEOCODIFICADOR_IBGE.capital(uf)
+        coordenada = [capital['lat'], capital['lon']] if capital else COORDENADAS_ESTADOS.get(uf)
+        if coordenada:
+            resultado = [coordenada[0], coordenada[1], f"{municipio} - {uf}"]
+            print(f"[GEOCODE] ⚠️ Fallback para {uf}: {resultado}")
             return resultado
             
         return None
@@ -1827,43 +1973,30 @@ def geocode(municipio, uf):
         traceback.print_exc()
         return None
 
-def calcular_distancia_osrm(origem, destino):
-    """Calcula distância usando OSRM"""
-    try:
-        url = f"http://router.project-osrm.org/route/v1/driving/{origem[1]},{origem[0]};{destino[1]},{destino[0]}?overview=false"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if data['routes']:
-                route = data['routes'][0]
-                return {
-                    "distancia": route['distance'] / 1000,
-                    "duracao": route['duration'] / 60,
-                    "rota_pontos": [],
-                    "provider": "OSRM"
-                }
-        return None
-    except Exception as e:
-        print(f"[OSRM] Erro: {e}")
+def calcular_distancia_rota(origem, destino, timeout=10):
+    """Calcula distância rodoviária pelos provedores configurados (com cache persistente por par de coordenadas)"""
+    chave = chave_coordenadas(origem, destino)
+    em_cache = obter_geografico('rota', chave)
+    if em_cache is NEGATIVO:
         return None
+    if em_cache is None:
+        # Consultas idênticas simultâneas compartilham uma única chamada
+        em_cache = SINGLE_FLIGHT.executar(('rota', chave), lambda: consultar_provedores_rota(origem, destino, chave, timeout))
+    # Cada chamador recebe sua própria cópia (o resultado pode ser compartilhado)
+    return copy.deepcopy(em_cache) if em_cache else None
+
+def consultar_provedores_rota(origem, destino, chave, timeout=10):
+    """Consulta a cadeia de provedores; grava o resultado no cache e retorna a rota ou None"""
+    resultado, houve_falha = PROVEDORES_ROTA.calcular(origem, destino, timeout)
+    # Resultado obtido com provedor em falha (ex: linha reta no lugar do OSRM) ou
+    # ausência de rota por falha: cache curto; caso contrário, TTL normal/negativo
+    gravar_geografico('rota', chave, resultado, ttl=GEO_CACHE_TTL_ERRO if houve_falha else None)
+    return resultado
 
 def calcular_distancia_reta(origem, destino):
     """Calcula distância em linha reta (fallback)"""
     try:
-        from math import radians, cos, sin, asin, sqrt
-        
-        lat1, lon1 = origem[0], origem[1]
-        lat2, lon2 = destino[0], destino[1]
-        
-        lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        r = 6371
-        
-        distancia = c * r
+        distancia = float(haversine_km(origem[0], origem[1], destino[0], destino[1]))
         duracao = distancia * 1.5
         
         return {
@@ -1876,34 +2009,162 @@ def calcular_distancia_reta(origem, destino):
         print(f"[DISTANCIA_RETA] Erro: {e}")
         return None
 
-def calcular_custos_dedicado(uf_origem, municipio_origem, uf_destino, municipio_destino, distancia, pedagio_real=0):
-    """Calcula custos para frete dedicado baseado na distância"""
+# Praças de pedágio (data/pracas_pedagio.csv) indexadas em grade. A tabela ainda
+# tem valores aproximados, não as tarifas da ANTT/concessionárias: enquanto
+# PEDAGIO_PRACAS não for ativado, o pedágio cotado é a estimativa por km
+PEDAGIO_PRACAS = os.getenv('PEDAGIO_PRACAS', 'false').lower() == 'true'
+MOTOR_PEDAGIO = MotorPedagio()
+
+def calcular_pedagio(origem, destino, rota_info):
+    """
+    Pedágio por categoria de veículo para a rota
+
+    Com PEDAGIO_PRACAS e geometria de um provedor de roteamento, soma as
+    praças da tabela que estão na rota (resultado em cache por trecho), com a
+    estimativa por km como piso de cada categoria: a tabela só cobre alguns
+    corredores. Nos demais casos (flag desligada, matriz, linha reta ou sem
+    praças cadastradas no trajeto) usa só a estimativa por km.
+    """
+    try:
+        if PEDAGIO_PRACAS and rota_info.get("rota_polyline") and rota_info.get("provider") != ProvedorHaversine.nome:
+            chave = chave_coordenadas(origem, destino)
+            pedagio = obter_geografico('pedagio', chave)
+            if pedagio is None or pedagio is NEGATIVO:
+                pedagio = MOTOR_PEDAGIO.calcular(polyline.decode(rota_info["rota_polyline"], 5))
+                if pedagio is not None:
+                    gravar_geografico('pedagio', chave, pedagio)
+            if pedagio and pedagio['pracas']:
+                return completar_com_estimativa(pedagio, rota_info["distancia"])
+            return estimativa_por_distancia(rota_info["distancia"], "Nenhuma praça cadastrada no trajeto")
+    except Exception as e:
+        print(f"[PEDAGIO] ❌ Erro ao calcular pedágio pela geometria: {e}")
+    return estimativa_por_distancia(rota_info["distancia"])
+
+# Máximo de pares por chamada da API de distâncias em lote
+LIMITE_PARES_DISTANCIA = int(os.getenv('LIMITE_PARES_DISTANCIA', 5000))
+# Distância rodoviária / linha reta dos pares fora da matriz (mesmo padrão de gerar_matriz_distancias.py)
+FATOR_DESVIO_LOTE = float(os.getenv('FATOR_DESVIO_LOTE', 1.3))
+
+def calcular_distancias_lote(pares, usar_matriz=True):
+    """
+    Calcula distâncias de vários pares origem/destino de uma vez (sem rede)
+
+    Municípios são localizados na tabela IBGE local; pares presentes na matriz
+    pré-calculada usam a distância rodoviária, os demais a linha reta
+    (Haversine vetorizado sobre todos os pares) vezes FATOR_DESVIO_LOTE,
+    marcados com 'estimada': True.
+    """
+    resultados = []
+    indices, coordenadas = [], []
+    for par in pares:
+        municipio_origem = GEOCODIFICADOR_IBGE.buscar(par.get('municipio_origem'), par.get('uf_origem'))
+        municipio_destino = GEOCODIFICADOR_IBGE.buscar(par.get('municipio_destino'), par.get('uf_destino'))
+        resultado = {
+            'municipio_origem': par.get('municipio_origem'),
+            'uf_origem': par.get('uf_origem'),
+            'municipio_destino': par.get('municipio_destino'),
+            'uf_destino': par.get('uf_destino')
+        }
+        if not municipio_origem or not municipio_destino:
+            resultado['erro'] = 'Município não localizado' + ('' if municipio_origem else ' (origem)') + ('' if municipio_destino else ' (destino)')
+        else:
+            indices.append(len(resultados))
+            coordenadas.append((municipio_origem, municipio_destino))
+        resultados.append(resultado)
+    
+    if coordenadas:
+        distancias = haversine_km(
+            [origem['lat'] for origem, _ in coordenadas], [origem['lon'] for origem, _ in coordenadas],
+            [destino['lat'] for _, destino in coordenadas], [destino['lon'] for _, destino in coordenadas]
+        )
+        for indice, (origem, destino), distancia in zip(indices, coordenadas, distancias):
+            na_matriz = MATRIZ_DISTANCIAS.buscar(origem['codigo_ibge'], destino['codigo_ibge']) if usar_matriz and len(MATRIZ_DISTANCIAS) else None
+            if na_matriz:
+                distancia_km, duracao_min, provider = na_matriz[0], na_matriz[1], "Matriz de distâncias"
+            else:
+                distancia_km = float(distancia) * FATOR_DESVIO_LOTE
+                duracao_min, provider = distancia_km * 1.5, "Distância Reta"
+            resultados[indice].update({
+                'codigo_ibge_origem': origem['codigo_ibge'],
+                'codigo_ibge_destino': destino['codigo_ibge'],
+                'distancia': round(distancia_km, 2),
+                'duracao': round(duracao_min, 1),
+                'provider': provider,
+                'estimada': not na_matriz
+            })
+    return resultados
+
+# Máximo de pares origem x destino por chamada da cotação dedicada em matriz
+LIMITE_PARES_MATRIZ_DEDICADO = int(os.getenv('LIMITE_PARES_MATRIZ_DEDICADO', 2000))
+
+def cotar_dedicado_matriz(origens, destinos, peso=0, cubagem=0, usar_matriz=True):
+    """
+    Cota o frete dedicado de cada origem para cada destino (sem rede)
+
+    Distâncias vêm de calcular_distancias_lote (matriz pré-calculada ou linha
+    reta x FATOR_DESVIO_LOTE) e os custos de todos os veículos saem da tabela do dedicado de uma
+    vez. O pedágio é a estimativa por km, como no /calcular sem geometria.
+
+    Returns:
+        dict: {veiculos, colunas, linhas, erros, aviso_capacidade}
+    """
+    pares = [
+        {'municipio_origem': origem.get('municipio'), 'uf_origem': origem.get('uf'),
+         'municipio_destino': destino.get('municipio'), 'uf_destino': destino.get('uf')}
+        for origem in origens for destino in destinos
+    ]
+    resultados = calcular_distancias_lote(pares, usar_matriz=usar_matriz)
+    localizados = [resultado for resultado in resultados if 'erro' not in resultado]
+    erros = [resultado for resultado in resultados if 'erro' in resultado]
+    
+    veiculos, aviso_capacidade = selecionar_veiculos_dedicado(peso, cubagem)
+    distancias = np.array([resultado['distancia'] for resultado in localizados], dtype=np.float64)
+    # Mesmo arredondamento de estimativa_por_distancia (round do Python, não np.round)
+    pedagios = [round(float(distancia) * VALOR_POR_KM_ESTIMADO, 2) for distancia in distancias]
+    custos = obter_tabela_dedicado().custos_lote(distancias, veiculos)
+    veiculos = [veiculo for veiculo in veiculos if veiculo in custos]
+    
+    linhas = []
+    for posicao, resultado in enumerate(localizados):
+        linha = [
+            f"{resultado['municipio_origem']} - {resultado['uf_origem']}",
+            f"{resultado['municipio_destino']} - {resultado['uf_destino']}",
+            resultado['distancia'], resultado['duracao'], resultado['provider'], pedagios[posicao]
+        ]
+        for veiculo in veiculos:
+            custo = custos[veiculo][posicao]
+            linha.append(None if np.isnan(custo) else round(float(custo + pedagios[posicao]), 2))
+        linhas.append(linha)
+    
+    return {
+        'veiculos': veiculos,
+        'colunas': ['origem', 'destino', 'distancia', 'duracao', 'provider', 'pedagio'] + veiculos,
+        'linhas': linhas,
+        'erros': erros,
+        'aviso_capacidade': aviso_capacidade,
+        'fator_desvio': FATOR_DESVIO_LOTE
+    }
+
+def calcular_custos_dedicado(uf_origem, municipio_origem, uf_destino, municipio_destino, distancia, pedagio_real=0, pedagio_por_veiculo=None, veiculos=None):
+    """
+    Calcula custos para frete dedicado pela tabela de faixas de distância
+
+    Args:
+        pedagio_por_veiculo (dict): Pedágio por categoria (senão pedagio_real para todos)
+        veiculos (list): Veículos a cotar (ex: os compatíveis com a carga); None = todos
+    """
     try:
         custos = {}
         
         pedagio_real = float(pedagio_real) if pedagio_real is not None else 0.0
         distancia = float(distancia) if distancia is not None else 0.0
+        pedagio_por_veiculo = pedagio_por_veiculo or {}
         
-        faixa = determinar_faixa(distancia)
-        
-        if faixa and faixa in TABELA_CUSTOS_DEDICADO:
-            tabela = TABELA_CUSTOS_DEDICADO[faixa]
-            for tipo_veiculo, valor in tabela.items():
-                custo_total = float(valor) + pedagio_real
-                custos[tipo_veiculo] = round(custo_total, 2)
-                
-        elif distancia > 600:
-            for tipo_veiculo, valor_km in DEDICADO_KM_ACIMA_600.items():
-                custo_total = (distancia * float(valor_km)) + pedagio_real
-                custos[tipo_veiculo] = round(custo_total, 2)
-        else:
-            custos_base = {
-                "FIORINO": 150.0, "VAN": 200.0, "3/4": 250.0, 
-                "TOCO": 300.0, "TRUCK": 350.0, "CARRETA": 500.0
-            }
-            for tipo_veiculo, valor in custos_base.items():
-                custo_total = float(valor) + pedagio_real
-                custos[tipo_veiculo] = round(custo_total, 2)
+        for tipo_veiculo, valor in obter_tabela_dedicado().custos(distancia).items():
+            if veiculos is not None and tipo_veiculo not in veiculos:
+                continue
+            custo_total = valor + float(pedagio_por_veiculo.get(tipo_veiculo, pedagio_real))
+            custos[tipo_veiculo] = round(custo_total, 2)
         
         for tipo_veiculo in list(custos.keys()):
             if not isinstance(custos[tipo_veiculo], (int, float)) or custos[tipo_veiculo] < 0:
@@ -1918,8 +2179,8 @@ def calcular_custos_dedicado(uf_origem, municipio_origem, uf_destino, municipio_
             "TOCO": 300.0, "TRUCK": 350.0, "CARRETA": 500.0
         }
 
-def gerar_analise_trajeto(origem_info, destino_info, rota_info, custos, tipo="Dedicado", municipio_origem=None, uf_origem=None, municipio_destino=None, uf_destino=None):
-    """Gera análise completa do trajeto"""
+def gerar_analise_trajeto(origem_info, destino_info, rota_info, custos, tipo="Dedicado", municipio_origem=None, uf_origem=None, municipio_destino=None, uf_destino=None, pedagio=None):
+    """Gera análise completa do trajeto (pedagio: resultado de calcular_pedagio)"""
     if municipio_origem and uf_origem:
         origem_nome = f"{municipio_origem} - {uf_origem}"
     else:
@@ -1936,8 +2197,9 @@ def gerar_analise_trajeto(origem_info, destino_info, rota_info, custos, tipo="De
     
     consumo_combustivel = rota_info["distancia"] * 0.12
     emissao_co2 = consumo_combustivel * 2.3
-    pedagio_real = rota_info["distancia"] * 0.05
-    pedagio_detalhes = {"fonte": "Estimativa baseada na distância", "valor_por_km": 0.05}
+    pedagio_detalhes = pedagio or estimativa_por_distancia(rota_info["distancia"])
+    # Valor único exibido na análise: o da maior categoria (carreta)
+    pedagio_real = max(pedagio_detalhes["por_veiculo"].values())
     
     import uuid
     id_historico = f"#Ded{uuid.uuid4().hex[:6].upper()}"
@@ -1960,25 +2222,41 @@ def gerar_analise_trajeto(origem_info, destino_info, rota_info, custos, tipo="De
         "custos": custos
     }
 
+def formatar_capacidade_veiculo(veiculo):
+    """Capacidade do veículo para exibição (ex: {'peso_max': '1.500kg', 'volume_max': '8m³'})"""
+    veiculo = veiculo or {}
+    peso_max, volume_max = veiculo.get('peso_max'), veiculo.get('volume_max')
+    return {
+        'peso_max': f"{peso_max:,.0f}kg".replace(',', '.') if peso_max else 'Variável',
+        'volume_max': f"{volume_max:g}m³" if volume_max else 'Variável',
+        'descricao': veiculo.get('descricao') or 'Veículo dedicado'
+    }
+
+def selecionar_veiculos_dedicado(peso, cubagem):
+    """
+    Veículos do dedicado em que a carga cabe
+
+    Returns:
+        tuple: (lista de veículos, aviso ou None); se a carga não cabe em
+        nenhum, retorna o de maior capacidade com aviso
+    """
+    tabela = obter_tabela_dedicado()
+    compativeis = tabela.compativeis(peso, cubagem)
+    if compativeis:
+        return compativeis, None
+    maior = max(tabela.veiculos.values(), key=lambda veiculo: (veiculo['peso_max'] or 0, veiculo['volume_max'] or 0))
+    return [maior['tipo']], f"Carga ({peso}kg, {cubagem}m³) excede a capacidade de todos os veículos; cotado o de maior capacidade ({maior['tipo']})"
+
 def gerar_ranking_dedicado(custos, analise, rota_info, peso=0, cubagem=0, valor_nf=None):
     """Gera ranking das opções de frete dedicado"""
     try:
         ranking_opcoes = []
         custos_ordenados = sorted(custos.items(), key=lambda x: x[1])
+        veiculos = obter_tabela_dedicado().veiculos
         
         for i, (tipo_veiculo, custo) in enumerate(custos_ordenados, 1):
-            if tipo_veiculo == "VAN":
-                capacidade_info = {'peso_max': '1.500kg', 'volume_max': '8m³', 'descricao': 'Veículo compacto para cargas leves'}
-                icone_veiculo = "🚐"
-            elif tipo_veiculo == "TRUCK":
-                capacidade_info = {'peso_max': '8.000kg', 'volume_max': '25m³', 'descricao': 'Caminhão médio para cargas variadas'}
-                icone_veiculo = "🚛"
-            elif tipo_veiculo == "CARRETA":
-                capacidade_info = {'peso_max': '27.000kg', 'volume_max': '90m³', 'descricao': 'Carreta para cargas pesadas'}
-                icone_veiculo = "🚛"
-            else:
-                capacidade_info = {'peso_max': 'Variável', 'volume_max': 'Variável', 'descricao': 'Veículo dedicado'}
-                icone_veiculo = "🚛"
+            capacidade_info = formatar_capacidade_veiculo(veiculos.get(tipo_veiculo))
+            icone_veiculo = "🚐" if tipo_veiculo == "VAN" else "🚛"
             
             if i == 1:
                 icone_posicao = "🥇"
@@ -1994,7 +2272,7 @@ def gerar_ranking_dedicado(custos, analise, rota_info, peso=0, cubagem=0, valor_
             
             custo_base = custo * 0.70
             combustivel = custo * 0.20
-            pedagio = analise.get('pedagio_real', custo * 0.10)
+            pedagio = (analise.get('pedagio_detalhes') or {}).get('por_veiculo', {}).get(tipo_veiculo, analise.get('pedagio_real', custo * 0.10))
             
             opcao_ranking = {
                 'posicao': i,
@@ -2224,6 +2502,23 @@ def api_get_base_dados():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/base-dados/valores-invalidos', methods=['GET'])
+def api_valores_invalidos_base_dados():
+    """Lista preços da base que não puderam ser convertidos para número"""
+    try:
+        snapshot = obter_snapshot_tarifas()
+        if snapshot is None or snapshot.tabela is None:
+            return jsonify({'error': 'Base de dados não disponível'}), 503
+        
+        return jsonify({
+            'geracao': snapshot.geracao,
+            'total': len(snapshot.tabela.linhas_invalidas),
+            'valores_invalidos': snapshot.tabela.linhas_invalidas
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ===== ROTAS DE EDIÇÃO DA BASE DE DADOS =====
 
 @app.route('/api/admin/base-dados/editar', methods=['POST'])
@@ -2296,6 +2591,7 @@ def api_editar_campo_base_dados():
         # Atualizar campo
         setattr(registro, campo_mapping[campo], valor)
         db.session.commit()
+        invalidar_cache_tarifas(f"edição de {campo} em {registro_id}")
         
         return jsonify({'sucesso': True, 'message': 'Campo atualizado com sucesso'})
         
@@ -2358,6 +2654,7 @@ def api_inserir_dados_automatico():
                     continue
             
             db.session.commit()
+            invalidar_cache_tarifas(f"{registros_inseridos} registros inseridos automaticamente")
             return jsonify({
                 'sucesso': True, 
                 'message': f'{registros_inseridos} registros inseridos automaticamente',
@@ -2399,6 +2696,7 @@ def api_inserir_dados_automatico():
             
             db.session.add(novo_registro)
             db.session.commit()
+            invalidar_cache_tarifas("registro inserido automaticamente")
             
             return jsonify({
                 'sucesso': True, 
@@ -2471,6 +2769,7 @@ def api_create_base_dados():
         
         db.session.add(novo_registro)
         db.session.commit()
+        invalidar_cache_tarifas(f"registro criado: {data['fornecedor']}")
         
         return jsonify({'sucesso': True, 'message': 'Registro criado com sucesso'})
         
@@ -2507,6 +2806,7 @@ def api_delete_base_dados(registro_id):
         
         db.session.delete(registro)
         db.session.commit()
+        invalidar_cache_tarifas(f"registro excluído: {registro_id}")
         
         return jsonify({'sucesso': True, 'message': 'Registro excluído com sucesso'})
         
@@ -2647,6 +2947,7 @@ def api_importar_csv():
                 continue
         
         db.session.commit()
+        invalidar_cache_tarifas(f"importação CSV: {registros_inseridos} registros")
         
         return jsonify({
             'sucesso': True,
@@ -2820,7 +3121,7 @@ def api_create_tipo_calculo():
 def api_get_formulas_calculo():
     """Listar fórmulas de cálculo"""
     try:
-        formulas = FormulaCalculoFrete.query.filter_by(ativa=True).all()
+        formulas = FormulaCalculoFrete.query.filter_by(ativo=True).all()
         return jsonify([{
             'id': formula.id,
             'nome': formula.nome,
@@ -2828,7 +3129,7 @@ def api_get_formulas_calculo():
             'formula': formula.formula,
             'condicoes': formula.condicoes,
             'prioridade': formula.prioridade,
-            'ativa': formula.ativa
+            'ativa': formula.ativo
         } for formula in formulas])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2836,8 +3137,19 @@ def api_get_formulas_calculo():
 @app.route('/api/admin/formulas-calculo', methods=['POST'])
 def api_create_formula_calculo():
     """Criar nova fórmula de cálculo"""
+    # Verificar permissão
+    if not session.get('usuario_permissoes', {}).get('pode_editar_base', False):
+        return jsonify({'error': 'Acesso negado. Você não tem permissão para editar fórmulas de cálculo.'}), 403
+    
     try:
         data = request.get_json()
+        
+        # Recusar fórmulas inválidas antes de gravar
+        try:
+            validar_formula(data['formula'], 'exec')
+        except FormulaInvalida as e:
+            return jsonify({'error': f'Fórmula inválida: {e}'}), 400
+        
         formula = FormulaCalculoFrete(
             nome=data['nome'],
             tipo_calculo_id=data['tipo_id'],
@@ -2847,11 +3159,176 @@ def api_create_formula_calculo():
         )
         db.session.add(formula)
         db.session.commit()
+        CACHE_FORMULAS.invalidar(('formula', formula.id))
+        invalidar_registro_agentes('fórmula alterada')
+        return jsonify({'sucesso': True, 'id': formula.id})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/cache-geografico', methods=['GET'])
+def api_get_cache_geografico():
+    """Estatísticas e entradas recentes do cache de geocodificação/rotas"""
+    try:
+        namespace = request.args.get('namespace')
+        limite = min(int(request.args.get('limite', 100)), 1000)
+        return jsonify({
+            'estatisticas': CACHE_GEOGRAFICO.estatisticas(),
+            'entradas': CACHE_GEOGRAFICO.listar(namespace, limite)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/cache-geografico', methods=['DELETE'])
+def api_limpar_cache_geografico():
+    """Remove entradas do cache (?namespace=geocode|rota, ?expirados=true)"""
+    try:
+        # Verificar permissão
+        if not session.get('usuario_permissoes', {}).get('pode_editar_base', False):
+            return jsonify({'error': 'Acesso negado. Você não tem permissão para limpar o cache geográfico.'}), 403
+        
+        namespace = request.args.get('namespace')
+        apenas_expirados = request.args.get('expirados', 'false').lower() == 'true'
+        removidos = CACHE_GEOGRAFICO.limpar(namespace=namespace, apenas_expirados=apenas_expirados)
+        if not apenas_expirados:
+            # O cache compartilhado expira sozinho; só a limpeza completa precisa alcançá-lo
+            for nome in ([namespace] if namespace else ['geocode', 'rota', 'pedagio']):
+                CACHE_COMPARTILHADO.remover(nome)
+        return jsonify({'sucesso': True, 'removidos': removidos})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/tabela-dedicado', methods=['GET'])
+def api_get_tabela_dedicado():
+    """Veículos e faixas de distância do frete dedicado"""
+    try:
+        return jsonify({
+            'veiculos': [veiculo.to_dict() for veiculo in VeiculoDedicado.query.order_by(VeiculoDedicado.ordem).all()],
+            'faixas': [tarifa.to_dict() for tarifa in TarifaDedicado.query.order_by(TarifaDedicado.tipo_veiculo, TarifaDedicado.distancia_min).all()],
+            'estatisticas': TABELA_DEDICADO.estatisticas()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/tabela-dedicado', methods=['PUT'])
+def api_update_tabela_dedicado():
+    """Substitui veículos e/ou faixas do frete dedicado ({"veiculos": [...], "faixas": [...]})"""
+    # Verificar permissão
+    if not session.get('usuario_permissoes', {}).get('pode_editar_base', False):
+        return jsonify({'error': 'Acesso negado. Você não tem permissão para editar a tabela do dedicado.'}), 403
+    
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Envie {"veiculos": [...], "faixas": [...]}'}), 400
+        
+        for campo, obrigatorio in (('veiculos', 'tipo'), ('faixas', 'tipo_veiculo')):
+            if campo not in data:
+                continue
+            if not isinstance(data[campo], list):
+                return jsonify({'error': f'"{campo}" deve ser uma lista'}), 400
+            for item in data[campo]:
+                if not isinstance(item, dict) or item.get(obrigatorio) in (None, ''):
+                    return jsonify({'error': f'Item de "{campo}" sem {obrigatorio}: {item}'}), 400
+        
+        if 'veiculos' in data:
+            VeiculoDedicado.query.delete()
+            for ordem, veiculo in enumerate(data['veiculos']):
+                db.session.add(VeiculoDedicado(
+                    tipo=str(veiculo['tipo']).strip().upper(),
+                    peso_max=float(veiculo['peso_max']) if veiculo.get('peso_max') not in (None, '') else None,
+                    volume_max=float(veiculo['volume_max']) if veiculo.get('volume_max') not in (None, '') else None,
+                    descricao=veiculo.get('descricao'),
+                    ordem=int(veiculo.get('ordem', ordem)),
+                    ativo=bool(veiculo.get('ativo', True))
+                ))
+        
+        if 'faixas' in data:
+            TarifaDedicado.query.delete()
+            for faixa in data['faixas']:
+                if faixa.get('valor_fixo') in (None, '') and faixa.get('valor_km') in (None, ''):
+                    db.session.rollback()
+                    return jsonify({'error': f"Faixa sem valor_fixo nem valor_km: {faixa}"}), 400
+                db.session.add(TarifaDedicado(
+                    tipo_veiculo=str(faixa['tipo_veiculo']).strip().upper(),
+                    distancia_min=float(faixa.get('distancia_min') or 0),
+                    distancia_max=float(faixa['distancia_max']) if faixa.get('distancia_max') not in (None, '') else None,
+                    valor_fixo=float(faixa['valor_fixo']) if faixa.get('valor_fixo') not in (None, '') else None,
+                    valor_km=float(faixa['valor_km']) if faixa.get('valor_km') not in (None, '') else None,
+                    ativo=bool(faixa.get('ativo', True))
+                ))
+        
+        db.session.commit()
+        invalidar_tabela_dedicado('tabela do dedicado alterada')
+        return jsonify({'sucesso': True})
+    except (TypeError, ValueError) as e:
+        # Valor não numérico em peso_max, valor_km, ordem etc.
+        db.session.rollback()
+        return jsonify({'error': f'Valor inválido: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/formulas-calculo/<int:formula_id>', methods=['PUT'])
+def api_update_formula_calculo(formula_id):
+    """Editar fórmula de cálculo"""
+    # Verificar permissão
+    if not session.get('usuario_permissoes', {}).get('pode_editar_base', False):
+        return jsonify({'error': 'Acesso negado. Você não tem permissão para editar fórmulas de cálculo.'}), 403
+    
+    try:
+        formula = FormulaCalculoFrete.query.get(formula_id)
+        if not formula:
+            return jsonify({'error': 'Fórmula não encontrada'}), 404
+        
+        data = request.get_json()
+        if 'formula' in data:
+            try:
+                validar_formula(data['formula'], 'exec')
+            except FormulaInvalida as e:
+                return jsonify({'error': f'Fórmula inválida: {e}'}), 400
+            formula.formula = data['formula']
+        
+        if 'nome' in data:
+            formula.nome = data['nome']
+        if 'tipo_id' in data:
+            formula.tipo_calculo_id = data['tipo_id']
+        if 'condicoes' in data:
+            formula.condicoes = data['condicoes']
+        if 'prioridade' in data:
+            formula.prioridade = data['prioridade']
+        if 'ativa' in data:
+            formula.ativo = bool(data['ativa'])
+        
+        db.session.commit()
+        CACHE_FORMULAS.invalidar(('formula', formula.id))
+        invalidar_registro_agentes('fórmula alterada')
         return jsonify({'sucesso': True, 'id': formula.id})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/formulas-calculo/<int:formula_id>', methods=['DELETE'])
+def api_delete_formula_calculo(formula_id):
+    """Excluir fórmula de cálculo"""
+    # Verificar permissão
+    if not session.get('usuario_permissoes', {}).get('pode_editar_base', False):
+        return jsonify({'error': 'Acesso negado. Você não tem permissão para excluir fórmulas de cálculo.'}), 403
+    
+    try:
+        formula = FormulaCalculoFrete.query.get(formula_id)
+        if not formula:
+            return jsonify({'error': 'Fórmula não encontrada'}), 404
+        
+        db.session.delete(formula)
+        db.session.commit()
+        CACHE_FORMULAS.invalidar(('formula', formula_id))
+        invalidar_registro_agentes('fórmula removida')
+        return jsonify({'sucesso': True})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/configuracoes-agente', methods=['GET'])
 def api_get_configuracoes_agente():
     """Listar configurações de agentes"""
@@ -2881,6 +3358,7 @@ def api_create_configuracao_agente():
         )
         db.session.add(config)
         db.session.commit()
+        invalidar_registro_agentes('configuração de agente criada')
         return jsonify({'sucesso': True, 'id': config.id})
     except Exception as e:
         db.session.rollback()
@@ -3099,25 +3577,32 @@ def estados():
     ]
     return jsonify(estados_brasil)
 
+# Lista de municípios por UF muda raramente
+MUNICIPIOS_CACHE_TTL = int(os.getenv('MUNICIPIOS_CACHE_TTL', 7 * 86400))
+
+def consultar_municipios_ibge(uf):
+    """Lista de nomes de municípios da UF pela API do IBGE (None se falhar)"""
+    url = f"https://servicodados.ibge.gov.br/api/v1/localidades/estados/{uf}/municipios"
+    response = SESSAO_HTTP.get(url, timeout=10)
+    if response.status_code == 200:
+        return [m['nome'] for m in response.json()]
+    return None
+
 @app.route('/municipios/<uf>')
 def municipios(uf):
     """Lista municípios por UF"""
     try:
         # Cache simples
-        if uf in MUNICIPIOS_CACHE:
-            return jsonify(MUNICIPIOS_CACHE[uf])
-        
-        # Buscar via IBGE
-        url = f"https://servicodados.ibge.gov.br/api/v1/localidades/estados/{uf}/municipios"
-        response = requests.get(url, timeout=10)
+        em_cache = CACHE_COMPARTILHADO.obter('municipios', uf)
+        if em_cache is not None:
+            return jsonify(em_cache)
         
-        if response.status_code == 200:
-            municipios_data = response.json()
-            municipios_nomes = [m['nome'] for m in municipios_data]
-            MUNICIPIOS_CACHE[uf] = municipios_nomes
-            return jsonify(municipios_nomes)
-        else:
+        # Buscar via IBGE (requisições simultâneas da mesma UF compartilham a chamada)
+        municipios_nomes = SINGLE_FLIGHT.executar(('municipios', uf), lambda: consultar_municipios_ibge(uf))
+        if municipios_nomes is None:
             return jsonify([])
+        CACHE_COMPARTILHADO.gravar('municipios', uf, municipios_nomes, ttl=MUNICIPIOS_CACHE_TTL)
+        return jsonify(municipios_nomes)
             
     except Exception as e:
         print(f"[MUNICIPIOS] Erro para {uf}: {e}")
@@ -3146,7 +3631,20 @@ def health_check():
             "services": {
                 "database": "online" if total_registros > 0 else "offline",
                 "records": total_registros,
-                "postgresql_available": POSTGRESQL_AVAILABLE
+                "postgresql_available": POSTGRESQL_AVAILABLE,
+                "tarifas": CACHE_TARIFAS.estatisticas(),
+                "rotas_combinadas": estatisticas_busca(),
+                "formulas": CACHE_FORMULAS.estatisticas(),
+                "registro_agentes": REGISTRO_AGENTES.estatisticas() if REGISTRO_AGENTES is not None else None,
+                "geocodificacao": GEOCODIFICADOR_IBGE.estatisticas(),
+                "cache_geografico": CACHE_GEOGRAFICO.estatisticas(),
+                "matriz_distancias": MATRIZ_DISTANCIAS.estatisticas(),
+                "single_flight": SINGLE_FLIGHT.estatisticas(),
+                "provedores_rota": PROVEDORES_ROTA.estatisticas(),
+                "pedagio": dict(MOTOR_PEDAGIO.estatisticas(), pracas_ativas=PEDAGIO_PRACAS),
+                "tabela_dedicado": TABELA_DEDICADO.estatisticas(),
+                "cache_cotacoes": CACHE_COTACOES.estatisticas(),
+                "cache_compartilhado": CACHE_COMPARTILHADO.estatisticas()
             }
         }
         return jsonify(status), 200
@@ -3157,6 +3655,70 @@ def health_check():
             "timestamp": datetime.datetime.now().isoformat()
         }), 503
 
+@app.route('/api/distancias/lote', methods=['POST'])
+def api_distancias_lote():
+    """Distâncias e durações estimadas de N pares de municípios em uma chamada"""
+    try:
+        if 'usuario_logado' not in session:
+            return jsonify({'error': 'Não autenticado'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        pares = data.get('pares')
+        if not isinstance(pares, list) or not pares:
+            return jsonify({'error': 'Informe "pares": [{municipio_origem, uf_origem, municipio_destino, uf_destino}]'}), 400
+        if len(pares) > LIMITE_PARES_DISTANCIA:
+            return jsonify({'error': f'Máximo de {LIMITE_PARES_DISTANCIA} pares por chamada'}), 400
+        if not all(isinstance(par, dict) for par in pares):
+            return jsonify({'error': 'Cada par deve ser um objeto {municipio_origem, uf_origem, municipio_destino, uf_destino}'}), 400
+        
+        resultados = calcular_distancias_lote(pares, usar_matriz=data.get('usar_matriz', True))
+        return jsonify({
+            'total': len(resultados),
+            'localizados': sum(1 for resultado in resultados if 'erro' not in resultado),
+            'fator_desvio': FATOR_DESVIO_LOTE,
+            'resultados': resultados
+        })
+        
+    except Exception as e:
+        print(f"[DISTANCIAS] ❌ Erro no cálculo em lote: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/dedicado/matriz', methods=['POST'])
+def api_dedicado_matriz():
+    """Frete dedicado de uma ou mais origens para muitos destinos, numa tabela compacta"""
+    try:
+        if 'usuario_logado' not in session:
+            return jsonify({'error': 'Não autenticado'}), 401
+        
+        inicio = time.time()
+        data = request.get_json(silent=True) or {}
+        origens = data.get('origens')
+        destinos = data.get('destinos')
+        if not isinstance(origens, list) or not origens or not isinstance(destinos, list) or not destinos:
+            return jsonify({'error': 'Informe "origens" e "destinos": [{municipio, uf}]'}), 400
+        if len(origens) * len(destinos) > LIMITE_PARES_MATRIZ_DEDICADO:
+            return jsonify({'error': f'Máximo de {LIMITE_PARES_MATRIZ_DEDICADO} pares origem x destino por chamada'}), 400
+        if not all(isinstance(local, dict) for local in origens + destinos):
+            return jsonify({'error': 'Cada origem e destino deve ser um objeto {municipio, uf}'}), 400
+        try:
+            peso, cubagem = float(data.get('peso') or 0), float(data.get('cubagem') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': '"peso" e "cubagem" devem ser numéricos'}), 400
+        
+        matriz = cotar_dedicado_matriz(
+            origens, destinos, peso=peso, cubagem=cubagem,
+            usar_matriz=data.get('usar_matriz', True)
+        )
+        matriz.update({
+            'total_pares': len(origens) * len(destinos),
+            'tempo_ms': round((time.time() - inicio) * 1000, 1)
+        })
+        return jsonify(matriz)
+        
+    except Exception as e:
+        print(f"[DEDICADO] ❌ Erro na cotação em matriz: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/bases-disponiveis')
 def api_bases_disponiveis():
     """API para listar bases disponíveis"""
@@ -3211,15 +3773,15 @@ admin_agentes_memoria = middleware_admin(admin_agentes_memoria)
 admin_usuarios = middleware_admin(admin_usuarios)
 admin_configuracoes = middleware_admin(admin_configuracoes)
 
-def criar_rota_parcial_transferencia_entrega(transferencia_linha, agente_entrega, origem, destino, peso_cubado, valor_nf):
+def criar_rota_parcial_transferencia_entrega(transferencia_linha, agente_entrega, origem, destino, peso_cubado, valor_nf, custos=None):
     """Cria rota parcial: Transferência + Entrega (sem agente de coleta)"""
     try:
         fornecedor_transf = transferencia_linha.get('Fornecedor', 'N/A')
         fornecedor_ent = agente_entrega.get('Fornecedor', 'N/A')
         
         # Calcular custos usando lógica original
-        custo_transferencia = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf)
-        custo_entrega = calcular_custo_agente_original(agente_entrega, peso_cubado, valor_nf)
+        custo_transferencia = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf, custos)
+        custo_entrega = calcular_custo_agente_original(agente_entrega, peso_cubado, valor_nf, custos)
         
         if not custo_transferencia or not custo_entrega:
             return None
@@ -3271,15 +3833,15 @@ def criar_rota_parcial_transferencia_entrega(transferencia_linha, agente_entrega
         print(f"[ROTA_PARCIAL_TE] ❌ Erro: {e}")
         return None
 
-def criar_rota_parcial_coleta_transferencia(agente_coleta, transferencia_linha, origem, destino, peso_cubado, valor_nf):
+def criar_rota_parcial_coleta_transferencia(agente_coleta, transferencia_linha, origem, destino, peso_cubado, valor_nf, custos=None):
     """Cria rota parcial: Coleta + Transferência (sem agente de entrega)"""
     try:
         fornecedor_col = agente_coleta.get('Fornecedor', 'N/A')
         fornecedor_transf = transferencia_linha.get('Fornecedor', 'N/A')
         
         # Calcular custos usando lógica original
-        custo_coleta = calcular_custo_agente_original(agente_coleta, peso_cubado, valor_nf)
-        custo_transferencia = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf)
+        custo_coleta = calcular_custo_agente_original(agente_coleta, peso_cubado, valor_nf, custos)
+        custo_transferencia = calcular_custo_agente_original(transferencia_linha, peso_cubado, valor_nf, custos)
         
         if not custo_coleta or not custo_transferencia:
             return None
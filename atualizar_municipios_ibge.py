@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Script para gerar data/municipios_ibge.csv com os 5.570 municípios brasileiros
+
+Baixa a tabela pública de municípios (código IBGE, nome, latitude, longitude,
+capital, código da UF) e grava no formato lido por geocodificacao.py.
+A origem também pode ser um CSV local com as mesmas colunas:
+
+    python atualizar_municipios_ibge.py [url ou caminho do CSV]
+"""
+
+import csv
+import io
+import os
+import sys
+
+import requests
+
+from geocodificacao import CAMINHO_MUNICIPIOS, CODIGOS_UF
+
+URL_MUNICIPIOS = "https://raw.githubusercontent.com/kelvins/municipios-brasileiros/main/csv/municipios.csv"
+COLUNAS = ['codigo_ibge', 'nome', 'latitude', 'longitude', 'capital', 'codigo_uf']
+
+def atualizar_municipios(url=URL_MUNICIPIOS, destino=CAMINHO_MUNICIPIOS):
+    """Baixa (ou lê do disco) a tabela de municípios e grava apenas as colunas usadas"""
+    try:
+        if os.path.exists(url):
+            print(f"📂 Lendo: {url}")
+            with open(url, 'rb') as arquivo:
+                conteudo = arquivo.read()
+        else:
+            print(f"📥 Baixando: {url}")
+            response = requests.get(url, timeout=60)
+            response.raise_for_status()
+            conteudo = response.content
+
+        linhas = list(csv.DictReader(io.StringIO(conteudo.decode('utf-8-sig'))))
+        faltando = [coluna for coluna in COLUNAS if coluna not in (linhas[0] if linhas else {})]
+        if faltando:
+            print(f"❌ Colunas ausentes na origem: {faltando}")
+            return False
+
+        linhas = [linha for linha in linhas if int(linha['codigo_uf']) in CODIGOS_UF]
+        with open(destino, 'w', encoding='utf-8', newline='') as arquivo:
+            writer = csv.DictWriter(arquivo, fieldnames=COLUNAS, extrasaction='ignore', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(sorted(linhas, key=lambda linha: int(linha['codigo_ibge'])))
+
+        print(f"✅ {len(linhas)} municípios gravados em {destino}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Erro ao atualizar municípios: {e}")
+        return False
+
+if __name__ == "__main__":
+    sys.exit(0 if atualizar_municipios(*sys.argv[1:2]) else 1)
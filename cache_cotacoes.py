@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache de resultados de cotação
+
+Cotações idênticas (mesma origem/UF, destino/UF, peso, cubagem e valor da
+NF) são comuns: o usuário refaz a consulta, compara modalidades ou volta à
+tela. O CacheCotacoes guarda o resultado pronto num LRU limitado, com TTL.
+
+Cada entrada é marcada com a versão dos dados usados no cálculo (geração e
+momento de carga do snapshot de tarifas e do registro de agentes). Quando a
+base é editada/importada ou um agente/fórmula muda, a versão muda e as
+entradas antigas deixam de ser usadas, sem precisar varrer o cache.
+
+O peso entra na chave arredondado ao grama, e não por faixa: o excedente e
+as fórmulas dos agentes cobram por kg, então pesos diferentes na mesma faixa
+têm preços diferentes.
+
+obter_ou_calcular() evita a avalanche de recálculos quando muitas entradas
+populares ficam inválidas de uma vez (importação de CSV, TTL):
+
+- só um chamador por chave recalcula (concessão por chave); os demais
+  recebem o valor obsoleto enquanto ele trabalha, se a entrada estiver
+  obsoleta há no máximo janela_obsoleto segundos, ou esperam e recebem o
+  resultado dele;
+- perto do fim do TTL, cada leitura sorteia uma expiração antecipada com
+  probabilidade crescente (XFetch: proporcional ao custo do cálculo e a
+  beta), então chaves quentes são renovadas antes de expirar, por um único
+  chamador, sem que ninguém espere.
+"""
+import copy
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from tarifas import chave_localidade
+
+
+def chave_cotacao(tipo, origem, uf_origem, destino, uf_destino, peso=None, cubagem=None, valor_nf=None):
+    """
+    Chave normalizada da cotação (município sem acento/caixa, números arredondados)
+
+    Returns:
+        tuple: Chave hashável
+    """
+    def numero(valor, casas):
+        try:
+            return round(float(valor), casas) if valor not in (None, '') else None
+        except (TypeError, ValueError):
+            return str(valor)
+
+    return (
+        tipo,
+        chave_localidade(origem, uf_origem),
+        chave_localidade(destino, uf_destino),
+        numero(peso, 3),
+        numero(cubagem, 4),
+        numero(valor_nf, 2)
+    )
+
+
+class CacheCotacoes:
+    """
+    LRU limitado de resultados de cotação com TTL e versão dos dados
+
+    Args:
+        max_entradas (int): Quantidade máxima de cotações guardadas
+        ttl (float): Idade máxima de uma entrada em segundos (0 = sem expiração)
+        janela_obsoleto (float): Por quanto tempo uma entrada vencida ou de outra
+            versão ainda pode ser servida enquanto outro chamador a recalcula
+        beta (float): Intensidade da expiração antecipada (0 = desligada)
+    """
+
+    def __init__(self, max_entradas=1000, ttl=300, janela_obsoleto=30, beta=1.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.janela_obsoleto = janela_obsoleto
+        self.beta = beta
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._concessoes = {}
+        self._acertos = 0
+        self._falhas = 0
+        self._descartes = 0
+        self._obsoletos_servidos = 0
+        self._antecipadas = 0
+        self._esperas = 0
+
+    def obter(self, chave, versao):
+        """
+        Retorna uma cópia do resultado guardado (None se ausente, expirado ou de outra versão)
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self._falhas += 1
+                return None
+            if entrada['versao'] != versao or (self.ttl and time.time() - entrada['gravado_em'] > self.ttl):
+                del self._entradas[chave]
+                self._descartes += 1
+                self._falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self._acertos += 1
+            valor = entrada['valor']
+        # Cada chamador recebe sua própria cópia (o resultado é ajustado por requisição)
+        return copy.deepcopy(valor)
+
+    def _estado(self, entrada, versao, agora):
+        """
+        'fresco', 'antecipado' (fresco, mas sorteado para renovação), 'obsoleto'
+        (servível durante a recarga) ou None (ausente ou obsoleto além da janela)
+        """
+        if entrada is None:
+            return None
+        if entrada['versao'] != versao:
+            # A mudança de versão só é percebida na leitura: a janela conta dali
+            entrada.setdefault('obsoleto_desde', agora)
+            obsoleto_desde = entrada['obsoleto_desde']
+        elif self.ttl and agora - entrada['gravado_em'] > self.ttl:
+            obsoleto_desde = entrada['gravado_em'] + self.ttl
+        else:
+            if self.ttl and self.beta and entrada.get('custo'):
+                expira_em = entrada['gravado_em'] + self.ttl
+                if agora - entrada['custo'] * self.beta * math.log(1.0 - random.random()) >= expira_em:
+                    return 'antecipado'
+            return 'fresco'
+        return 'obsoleto' if agora - obsoleto_desde <= self.janela_obsoleto else None
+
+    def obter_ou_calcular(self, chave, versao, calcular, gravavel=None):
+        """
+        Resultado em cache ou calculado por calcular(), com um único cálculo por chave
+
+        Args:
+            calcular (callable): Função sem argumentos que produz o resultado
+            gravavel (callable): Recebe o resultado e diz se ele pode ir para o
+                cache (None = sempre)
+
+        Returns:
+            Cópia do resultado (possivelmente obsoleto, dentro da janela)
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            estado = self._estado(entrada, versao, time.time())
+            concessao = self._concessoes.get(chave)
+            servir = estado == 'fresco' or (estado in ('antecipado', 'obsoleto') and concessao is not None)
+            lider = not servir and concessao is None
+            if servir:
+                if estado == 'obsoleto':
+                    self._obsoletos_servidos += 1
+                else:
+                    self._entradas.move_to_end(chave)
+                    self._acertos += 1
+                valor = entrada['valor']
+            elif lider:
+                # Este chamador recalcula; os demais usam o valor antigo ou esperam
+                concessao = {'evento': threading.Event(), 'resultado': None, 'erro': None}
+                self._concessoes[chave] = concessao
+                if estado == 'antecipado':
+                    self._antecipadas += 1
+                else:
+                    self._falhas += 1
+            else:
+                self._esperas += 1
+
+        if lider:
+            return self._calcular(chave, versao, calcular, gravavel, concessao)
+        if not servir:
+            concessao['evento'].wait()
+            if concessao['erro'] is not None:
+                raise concessao['erro']
+            valor = concessao['resultado']
+        # Cada chamador recebe sua própria cópia (o resultado é ajustado por requisição)
+        return copy.deepcopy(valor)
+
+    def _calcular(self, chave, versao, calcular, gravavel, concessao):
+        try:
+            inicio = time.time()
+            resultado = calcular()
+            if gravavel is None or gravavel(resultado):
+                self.gravar(chave, versao, resultado, custo=time.time() - inicio)
+            concessao['resultado'] = copy.deepcopy(resultado)
+            return resultado
+        except Exception as e:
+            concessao['erro'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._concessoes[chave]
+            concessao['evento'].set()
+
+    def gravar(self, chave, versao, valor, custo=None):
+        """Grava uma cópia do valor; custo (s) é a duração do cálculo, usada na expiração antecipada"""
+        valor = copy.deepcopy(valor)
+        with self._lock:
+            self._entradas[chave] = {'versao': versao, 'valor': valor, 'gravado_em': time.time(), 'custo': custo}
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self._descartes += 1
+
+    def invalidar(self, motivo=''):
+        """Remove todas as entradas"""
+        with self._lock:
+            removidas = len(self._entradas)
+            self._entradas.clear()
+        print(f"[COTACOES] 🔄 Cache de cotações limpo: {removidas} entradas{f' ({motivo})' if motivo else ''}")
+        return removidas
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self._acertos + self._falhas
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'ttl': self.ttl,
+                'janela_obsoleto': self.janela_obsoleto,
+                'beta': self.beta,
+                'acertos': self._acertos,
+                'falhas': self._falhas,
+                'descartes': self._descartes,
+                'obsoletos_servidos': self._obsoletos_servidos,
+                'renovacoes_antecipadas': self._antecipadas,
+                'esperas': self._esperas,
+                'recalculos_em_andamento': len(self._concessoes),
+                'taxa_acerto': round(self._acertos / consultas, 3) if consultas else None
+            }
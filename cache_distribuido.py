@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache em dois níveis: LRU no processo (L1) na frente de um Redis compartilhado (L2)
+
+O gunicorn roda vários workers e cada um aquecia seus próprios caches. Com
+REDIS_URL configurado, geocodificações, rotas, listas de municípios e
+resultados de cotação calculados por um worker passam a servir os demais
+(e as outras máquinas). O L1 guarda as entradas mais usadas por pouco tempo,
+evitando ida ao Redis nas chaves quentes.
+
+Sem Redis (variável ausente, pacote não instalado ou servidor fora do ar na
+inicialização) o L2 é o RedisEmProcesso, com a mesma interface, e o
+comportamento volta a ser o de um cache por processo; ele é um LRU limitado
+que descarta periodicamente as entradas expiradas. Falhas do Redis durante
+a operação contam como ausência no cache e não interrompem a cotação.
+
+Um valor trazido do L2 fica no L1 no máximo pelo tempo que ainda lhe resta
+no L2 (PTTL lido junto com o valor), então entradas curtas, como resultados
+negativos, não sobrevivem à própria expiração.
+
+Os valores são serializados com pickle (mais rápido que JSON para dicts e
+listas aninhados e sem dependência extra); o Redis deve ser privado da
+aplicação, pois pickle só deve ler dados de origem confiável. O L1 também
+guarda os bytes serializados: cada chamador recebe sua própria cópia.
+
+O L2 também guarda contadores de geração compartilhados (incr), usados para
+avisar os outros workers de que a base ou os agentes mudaram.
+
+obter_ou_calcular() protege o cálculo entre processos com uma concessão no
+Redis (SET NX com expiração): só o worker que a obtém calcula; os outros
+consultam o L2 por até espera_concessao segundos e, se o valor não chegar
+(cálculo lento ou worker caído), calculam por conta própria.
+"""
+import fnmatch
+import hashlib
+import math
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Valor retornado por obter() quando a chave não está no cache
+AUSENTE = object()
+
+
+class RedisEmProcesso:
+    """
+    Substituto do Redis em memória (get/set/incr/delete/pttl/scan_iter/pipeline com expiração)
+
+    Args:
+        max_entradas (int): Acima disso as chaves menos usadas são descartadas
+        intervalo_limpeza (float): De quanto em quanto tempo as gravações
+            varrem e removem as chaves expiradas
+    """
+
+    def __init__(self, max_entradas=10000, intervalo_limpeza=60):
+        self.max_entradas = max_entradas
+        self.intervalo_limpeza = intervalo_limpeza
+        self._lock = threading.Lock()
+        self._dados = OrderedDict()
+        self._limpo_em = time.time()
+
+    def _vivo(self, nome):
+        item = self._dados.get(nome)
+        if item is None:
+            return None
+        valor, expira_em = item
+        if expira_em is not None and time.time() >= expira_em:
+            del self._dados[nome]
+            return None
+        self._dados.move_to_end(nome)
+        return valor
+
+    def _guardar(self, nome, item):
+        agora = time.time()
+        self._dados[nome] = item
+        self._dados.move_to_end(nome)
+        if agora - self._limpo_em >= self.intervalo_limpeza:
+            self._limpo_em = agora
+            for expirado in [chave for chave, (_, expira_em) in self._dados.items() if expira_em is not None and agora >= expira_em]:
+                del self._dados[expirado]
+        while len(self._dados) > self.max_entradas:
+            self._dados.popitem(last=False)
+
+    def ping(self):
+        return True
+
+    def get(self, nome):
+        with self._lock:
+            return self._vivo(nome)
+
+    def pttl(self, nome):
+        """Milissegundos até expirar (-1 sem expiração, -2 ausente), como no Redis"""
+        with self._lock:
+            if self._vivo(nome) is None:
+                return -2
+            expira_em = self._dados[nome][1]
+            return -1 if expira_em is None else max(0, int((expira_em - time.time()) * 1000))
+
+    def set(self, nome, valor, ex=None, nx=False):
+        with self._lock:
+            if nx and self._vivo(nome) is not None:
+                return None
+            self._guardar(nome, (valor, time.time() + ex if ex else None))
+        return True
+
+    def incr(self, nome):
+        with self._lock:
+            valor = int(self._vivo(nome) or 0) + 1
+            self._guardar(nome, (str(valor).encode(), None))
+            return valor
+
+    def delete(self, *nomes):
+        with self._lock:
+            return sum(1 for nome in nomes if self._dados.pop(nome, None) is not None)
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            return [nome for nome in list(self._dados) if self._vivo(nome) is not None and fnmatch.fnmatchcase(nome, match)]
+
+    def pipeline(self, transaction=True):
+        return _PipelineEmProcesso(self)
+
+
+class _PipelineEmProcesso:
+    """Pipeline do RedisEmProcesso: enfileira os comandos e os executa em ordem"""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self._comandos = []
+
+    def __getattr__(self, comando):
+        def enfileirar(*args, **kwargs):
+            self._comandos.append((comando, args, kwargs))
+            return self
+        return enfileirar
+
+    def execute(self):
+        comandos, self._comandos = self._comandos, []
+        return [getattr(self.cliente, comando)(*args, **kwargs) for comando, args, kwargs in comandos]
+
+
+def criar_cliente_redis(url=None, max_entradas_local=10000):
+    """
+    Cliente Redis para REDIS_URL ou, sem ele, o RedisEmProcesso
+
+    Args:
+        max_entradas_local (int): Limite do RedisEmProcesso
+
+    Returns:
+        tuple: (cliente, compartilhado) - compartilhado=False para o substituto em memória
+    """
+    if not url:
+        return RedisEmProcesso(max_entradas_local), False
+    try:
+        import redis
+        cliente = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        cliente.ping()
+        print(f"[CACHE] ✅ Redis conectado: {url.split('@')[-1]}")
+        return cliente, True
+    except Exception as e:
+        print(f"[CACHE] ⚠️ Redis indisponível ({e}); usando cache em processo")
+        return RedisEmProcesso(max_entradas_local), False
+
+
+class CacheDoisNiveis:
+    """
+    L1 (LRU em memória, TTL curto) + L2 (Redis ou substituto)
+
+    Args:
+        cliente: Cliente L2 (redis.Redis ou RedisEmProcesso)
+        compartilhado (bool): Se o L2 é de fato compartilhado entre processos
+        prefixo (str): Prefixo das chaves no Redis
+        max_l1 (int): Entradas máximas no L1
+        ttl_l1 (float): Idade máxima no L1; limita por quanto tempo um worker
+            pode servir um valor já removido/alterado no L2 por outro
+        espera_concessao (float): Quanto um worker sem a concessão espera o
+            resultado do worker que está calculando
+    """
+
+    def __init__(self, cliente, compartilhado=False, prefixo='portoex', max_l1=2000, ttl_l1=60, espera_concessao=10):
+        self.cliente = cliente
+        self.compartilhado = compartilhado
+        self.prefixo = prefixo
+        self.max_l1 = max_l1
+        self.ttl_l1 = ttl_l1
+        self.espera_concessao = espera_concessao
+        self._lock = threading.Lock()
+        self._l1 = OrderedDict()
+        self._acertos_l1 = 0
+        self._acertos_l2 = 0
+        self._falhas = 0
+        self._erros_l2 = 0
+        self._concessoes = 0
+        self._esperas = 0
+
+    def _nome(self, namespace, chave):
+        """Nome da chave no Redis; chaves compostas viram um hash curto"""
+        if not isinstance(chave, str):
+            chave = hashlib.sha1(repr(chave).encode('utf-8')).hexdigest()
+        return f"{self.prefixo}:{namespace}:{chave}"
+
+    def _gravar_l1(self, nome, dados, ttl):
+        ttl_l1 = min(self.ttl_l1, ttl) if ttl else self.ttl_l1
+        with self._lock:
+            self._l1[nome] = (dados, time.time() + ttl_l1)
+            self._l1.move_to_end(nome)
+            while len(self._l1) > self.max_l1:
+                self._l1.popitem(last=False)
+
+    def obter(self, namespace, chave, padrao=None):
+        """
+        Valor da chave (L1, depois L2); padrao se ausente
+
+        Use padrao=AUSENTE quando None é um valor válido (ex: resultado negativo).
+        """
+        nome = self._nome(namespace, chave)
+        with self._lock:
+            item = self._l1.get(nome)
+            if item is not None:
+                if time.time() < item[1]:
+                    self._l1.move_to_end(nome)
+                    self._acertos_l1 += 1
+                    return pickle.loads(item[0])
+                del self._l1[nome]
+
+        dados, restante = self._ler_l2(nome)
+        if dados is None:
+            self._falhas += 1
+            return padrao
+
+        self._acertos_l2 += 1
+        self._gravar_l1(nome, dados, restante)
+        return pickle.loads(dados)
+
+    def gravar(self, namespace, chave, valor, ttl=None):
+        """Grava nos dois níveis; ttl em segundos (None = sem expiração no L2)"""
+        nome = self._nome(namespace, chave)
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        self._gravar_l1(nome, dados, ttl)
+        try:
+            self.cliente.set(nome, dados, ex=max(1, math.ceil(ttl)) if ttl else None)
+        except Exception as e:
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao gravar no Redis: {e}")
+
+    def obter_ou_calcular(self, namespace, chave, calcular, ttl=None, gravavel=None):
+        """
+        Valor em cache ou calculado por calcular(), com um único cálculo entre os processos
+
+        Args:
+            calcular (callable): Função sem argumentos que produz o valor
+            gravavel (callable): Recebe o valor e diz se ele pode ir para o cache (None = sempre)
+        """
+        valor = self.obter(namespace, chave, AUSENTE)
+        if valor is not AUSENTE:
+            return valor
+
+        nome = self._nome(namespace, chave)
+        concessao = self._nome('concessao', nome)
+        limite = time.time() + self.espera_concessao
+        obtida = self._conceder(concessao)
+        if not obtida:
+            self._esperas += 1
+            while time.time() < limite:
+                time.sleep(0.05)
+                dados, restante = self._ler_l2(nome)
+                if dados is not None:
+                    self._acertos_l2 += 1
+                    self._gravar_l1(nome, dados, restante)
+                    return pickle.loads(dados)
+                obtida = self._conceder(concessao)
+                if obtida:
+                    break
+
+        try:
+            valor = calcular()
+            if gravavel is None or gravavel(valor):
+                self.gravar(namespace, chave, valor, ttl=ttl)
+            return valor
+        finally:
+            if obtida:
+                try:
+                    self.cliente.delete(concessao)
+                except Exception as e:
+                    self._erros_l2 += 1
+                    print(f"[CACHE] ⚠️ Erro ao liberar concessão no Redis: {e}")
+
+    def _conceder(self, nome):
+        """Tenta obter a concessão de cálculo (expira sozinha se o worker cair)"""
+        try:
+            obtida = bool(self.cliente.set(nome, b'1', ex=max(1, int(self.espera_concessao)), nx=True))
+        except Exception as e:
+            # Sem Redis não há como coordenar: cada worker calcula
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao obter concessão no Redis: {e}")
+            return True
+        if obtida:
+            self._concessoes += 1
+        return obtida
+
+    def _ler_l2(self, nome):
+        """
+        Bytes da chave no L2 e segundos que ainda lhe restam (uma ida ao Redis)
+
+        Returns:
+            tuple: (dados ou None, restante em segundos ou None se não expira)
+        """
+        try:
+            dados, restante_ms = self.cliente.pipeline(transaction=False).get(nome).pttl(nome).execute()
+        except Exception as e:
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao ler do Redis: {e}")
+            return None, None
+        if dados is None or restante_ms == -2 or restante_ms == 0:
+            # Ausente ou expirou entre o GET e o PTTL
+            return None, None
+        return dados, restante_ms / 1000 if restante_ms > 0 else None
+
+    def remover(self, namespace, chave=None):
+        """Remove uma chave ou, sem chave, o namespace inteiro (L1 deste processo e L2)"""
+        if chave is not None:
+            nome = self._nome(namespace, chave)
+            with self._lock:
+                self._l1.pop(nome, None)
+        else:
+            padrao = f"{self.prefixo}:{namespace}:*"
+            with self._lock:
+                for nome in [nome for nome in self._l1 if fnmatch.fnmatchcase(nome, padrao)]:
+                    del self._l1[nome]
+        try:
+            nomes = [nome] if chave is not None else list(self.cliente.scan_iter(match=padrao))
+            return self.cliente.delete(*nomes) if nomes else 0
+        except Exception as e:
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao remover do Redis: {e}")
+            return 0
+
+    def geracao(self, nome):
+        """Contador de geração compartilhado (0 se nunca incrementado; None se o Redis falhar)"""
+        try:
+            return int(self.cliente.get(f"{self.prefixo}:geracao:{nome}") or 0)
+        except Exception as e:
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao ler geração '{nome}' do Redis: {e}")
+            return None
+
+    def incrementar_geracao(self, nome):
+        try:
+            return int(self.cliente.incr(f"{self.prefixo}:geracao:{nome}"))
+        except Exception as e:
+            self._erros_l2 += 1
+            print(f"[CACHE] ⚠️ Erro ao incrementar geração '{nome}' no Redis: {e}")
+            return None
+
+    def estatisticas(self):
+        with self._lock:
+            tamanho_l1 = len(self._l1)
+        return {
+            'l2': 'redis' if self.compartilhado else 'em_processo',
+            'entradas_l1': tamanho_l1,
+            'max_l1': self.max_l1,
+            'ttl_l1': self.ttl_l1,
+            'acertos_l1': self._acertos_l1,
+            'acertos_l2': self._acertos_l2,
+            'falhas': self._falhas,
+            'erros_l2': self._erros_l2,
+            'concessoes': self._concessoes,
+            'esperas_concessao': self._esperas
+        }
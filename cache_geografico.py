@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache persistente de geocodificação e distâncias de rota
+
+Resultados do Nominatim e do OSRM são gravados num arquivo SQLite local,
+compartilhado pelos workers da mesma máquina e preservado entre reinícios.
+Cada entrada pertence a um namespace ('geocode', 'rota') e tem validade
+própria; falhas também são gravadas (cache negativo, com TTL menor) para que
+uma localidade desconhecida não gere uma chamada de rede a cada cotação.
+
+O arquivo é aberto com uma conexão por thread; erros de leitura/gravação
+nunca interrompem a cotação, apenas contam como falha do cache.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CAMINHO_CACHE_GEO = os.getenv(
+    'GEO_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache_geografico.sqlite3')
+)
+
+# Marca de entrada negativa (consulta feita, sem resultado)
+NEGATIVO = object()
+
+
+def chave_coordenadas(origem, destino, casas=4):
+    """Chave de um par de coordenadas (arredondadas, ~11 m com 4 casas)"""
+    return f"{round(float(origem[0]), casas)},{round(float(origem[1]), casas)};" \
+           f"{round(float(destino[0]), casas)},{round(float(destino[1]), casas)}"
+
+
+class CacheGeografico:
+    """
+    Cache chave/valor em SQLite com TTL e cache negativo
+
+    Attributes:
+        caminho (str): Arquivo SQLite
+        ttl (int): Validade das entradas positivas, em segundos
+        ttl_negativo (int): Validade das entradas negativas, em segundos
+    """
+
+    def __init__(self, caminho=CAMINHO_CACHE_GEO, ttl=30 * 86400, ttl_negativo=86400):
+        self.caminho = caminho
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._contadores = {}
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=5)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('''
+                CREATE TABLE IF NOT EXISTS cache_geografico (
+                    namespace TEXT NOT NULL,
+                    chave TEXT NOT NULL,
+                    valor TEXT,
+                    criado_em REAL NOT NULL,
+                    expira_em REAL NOT NULL,
+                    PRIMARY KEY (namespace, chave)
+                )
+            ''')
+            conexao.commit()
+            self._local.conexao = conexao
+        return conexao
+
+    def _contar(self, namespace, evento):
+        with self._lock:
+            contadores = self._contadores.setdefault(
+                namespace, {'acertos': 0, 'acertos_negativos': 0, 'falhas': 0, 'gravacoes': 0, 'erros': 0}
+            )
+            contadores[evento] += 1
+
+    def obter(self, namespace, chave):
+        """
+        Busca uma entrada válida
+
+        Returns:
+            Valor gravado, NEGATIVO para falha em cache, ou None se ausente/expirada
+        """
+        try:
+            linha = self._conexao().execute(
+                'SELECT valor, expira_em FROM cache_geografico WHERE namespace = ? AND chave = ?',
+                (namespace, chave)
+            ).fetchone()
+        except Exception as e:
+            print(f"[CACHE_GEO] ⚠️ Erro ao ler cache: {e}")
+            self._contar(namespace, 'erros')
+            return None
+
+        if linha is None or linha[1] < time.time():
+            self._contar(namespace, 'falhas')
+            return None
+        if linha[0] is None:
+            self._contar(namespace, 'acertos_negativos')
+            return NEGATIVO
+        self._contar(namespace, 'acertos')
+        return json.loads(linha[0])
+
+    def gravar(self, namespace, chave, valor, ttl=None):
+        """Grava um resultado; valor None grava uma entrada negativa"""
+        agora = time.time()
+        if ttl is None:
+            ttl = self.ttl_negativo if valor is None else self.ttl
+        try:
+            conexao = self._conexao()
+            conexao.execute(
+                'INSERT OR REPLACE INTO cache_geografico (namespace, chave, valor, criado_em, expira_em) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (namespace, chave, None if valor is None else json.dumps(valor), agora, agora + ttl)
+            )
+            conexao.commit()
+            self._contar(namespace, 'gravacoes')
+        except Exception as e:
+            print(f"[CACHE_GEO] ⚠️ Erro ao gravar cache: {e}")
+            self._contar(namespace, 'erros')
+
+    def listar(self, namespace=None, limite=100):
+        """Lista as entradas mais recentes (para inspeção no painel admin)"""
+        sql = 'SELECT namespace, chave, valor, criado_em, expira_em FROM cache_geografico'
+        parametros = []
+        if namespace:
+            sql += ' WHERE namespace = ?'
+            parametros.append(namespace)
+        sql += ' ORDER BY criado_em DESC LIMIT ?'
+        parametros.append(int(limite))
+        agora = time.time()
+        return [{
+            'namespace': linha[0],
+            'chave': linha[1],
+            'valor': json.loads(linha[2]) if linha[2] is not None else None,
+            'negativo': linha[2] is None,
+            'expirado': linha[4] < agora,
+            'criado_em': linha[3],
+            'expira_em': linha[4]
+        } for linha in self._conexao().execute(sql, parametros).fetchall()]
+
+    def limpar(self, namespace=None, apenas_expirados=False):
+        """Remove entradas (todas, de um namespace e/ou só as expiradas); retorna a quantidade"""
+        condicoes, parametros = [], []
+        if namespace:
+            condicoes.append('namespace = ?')
+            parametros.append(namespace)
+        if apenas_expirados:
+            condicoes.append('expira_em < ?')
+            parametros.append(time.time())
+        sql = 'DELETE FROM cache_geografico'
+        if condicoes:
+            sql += ' WHERE ' + ' AND '.join(condicoes)
+        conexao = self._conexao()
+        removidos = conexao.execute(sql, parametros).rowcount
+        conexao.commit()
+        print(f"[CACHE_GEO] 🧹 {removidos} entradas removidas")
+        return removidos
+
+    def estatisticas(self):
+        """Retorna contadores do processo e tamanho do cache por namespace"""
+        try:
+            agora = time.time()
+            entradas = {
+                linha[0]: {'entradas': linha[1], 'negativas': linha[2], 'expiradas': linha[3]}
+                for linha in self._conexao().execute(
+                    'SELECT namespace, COUNT(*), SUM(valor IS NULL), SUM(expira_em < ?) '
+                    'FROM cache_geografico GROUP BY namespace', (agora,)
+                ).fetchall()
+            }
+        except Exception as e:
+            entradas = {'erro': str(e)}
+        with self._lock:
+            contadores = {namespace: dict(valores) for namespace, valores in self._contadores.items()}
+        return {
+            'arquivo': self.caminho,
+            'ttl': self.ttl,
+            'ttl_negativo': self.ttl_negativo,
+            'entradas': entradas,
+            'contadores': contadores
+        }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Valor carregado uma vez por processo, com TTL, geração e revalidação em segundo plano
+
+O snapshot de tarifas, o registro de agentes e a tabela do dedicado seguem a
+mesma regra: uma única thread carrega do banco; o valor vale até o TTL ou
+até uma invalidação explícita (que incrementa a geração); durante a
+recarga, as demais threads recebem o valor anterior se ele estiver obsoleto
+há no máximo janela_obsoleto segundos, em vez de esperar a carga.
+
+O carregador recebe a geração da carga e devolve um objeto com os atributos
+geracao e carregado_em; None ou uma exceção indicam falha e não são
+guardados (a próxima consulta tenta de novo).
+"""
+import threading
+import time
+
+
+class CacheRecarregavel:
+    """
+    Mantém o valor do processo e controla sua invalidação
+
+    Args:
+        carregador (callable): Recebe a geração e retorna o valor (None se falhar)
+        rotulo (str): Prefixo dos logs, ex: 'TARIFAS'
+        descricao (str): Nome do valor nos logs, ex: 'base de tarifas'
+        ttl (float): Idade máxima do valor em segundos. Como cada worker do
+            gunicorn tem seu próprio cache, o TTL limita por quanto tempo um
+            worker pode ficar com dados antigos após uma edição feita em outro.
+            Use 0 para nunca expirar.
+        janela_obsoleto (float): Por quanto tempo um valor obsoleto (invalidado
+            ou vencido) ainda é servido enquanto outra thread recarrega.
+            Use 0 para sempre esperar.
+    """
+
+    def __init__(self, carregador, rotulo, descricao='valor', ttl=300, janela_obsoleto=30):
+        self.carregador = carregador
+        self.rotulo = rotulo
+        self.descricao = descricao
+        self.ttl = ttl
+        self.janela_obsoleto = janela_obsoleto
+        # _lock serializa a carga; _lock_estado protege geração e valor e nunca
+        # é mantido durante a carga, para a invalidação não esperar por ela
+        self._lock = threading.Lock()
+        self._lock_estado = threading.Lock()
+        self._valor = None
+        self._geracao = 0
+        self._cargas = 0
+        self._acertos = 0
+        self._obsoletos_servidos = 0
+        self._ultima_invalidacao = None
+        self._invalidado_em = None
+
+    @property
+    def geracao(self):
+        """Geração atual (incrementada a cada invalidação)"""
+        return self._geracao
+
+    def _valido(self, valor):
+        if valor is None or valor.geracao != self._geracao:
+            return False
+        if self.ttl and (time.time() - valor.carregado_em) > self.ttl:
+            return False
+        return True
+
+    def _servivel(self, valor):
+        """Valor obsoleto que ainda pode ser usado enquanto outra thread recarrega"""
+        if valor is None or not self.janela_obsoleto:
+            return False
+        obsoleto_desde = []
+        if valor.geracao != self._geracao and self._invalidado_em is not None:
+            obsoleto_desde.append(self._invalidado_em)
+        if self.ttl:
+            obsoleto_desde.append(valor.carregado_em + self.ttl)
+        return bool(obsoleto_desde) and time.time() - min(obsoleto_desde) <= self.janela_obsoleto
+
+    def _descrever(self, valor):
+        """Resumo do valor carregado para o log"""
+        return self.descricao
+
+    def obter(self):
+        """
+        Retorna o valor atual, carregando se necessário
+
+        Só uma thread recarrega; as que chegam durante a carga recebem o valor
+        anterior (dentro da janela de obsolescência) ou esperam.
+
+        Returns:
+            Valor válido (ou obsoleto, durante a recarga ou após uma falha) ou None
+        """
+        valor = self._valor
+        if self._valido(valor):
+            self._acertos += 1
+            return valor
+
+        if not self._lock.acquire(blocking=False):
+            if self._servivel(valor):
+                self._obsoletos_servidos += 1
+                return valor
+            self._lock.acquire()
+        try:
+            # Outra thread pode ter carregado enquanto esperávamos o lock
+            valor = self._valor
+            if self._valido(valor):
+                self._acertos += 1
+                return valor
+
+            geracao = self._geracao
+            try:
+                novo = self.carregador(geracao)
+            except Exception as e:
+                print(f"[{self.rotulo}] ❌ Erro ao carregar {self.descricao}: {e}")
+                novo = None
+            if novo is None:
+                # Não guardar falhas: a próxima consulta tenta de novo
+                if self._servivel(valor):
+                    print(f"[{self.rotulo}] ⚠️ Falha ao recarregar {self.descricao}; usando a geração {valor.geracao}")
+                    self._obsoletos_servidos += 1
+                    return valor
+                return None
+
+            with self._lock_estado:
+                self._valor = novo
+                # Invalidado durante a carga: o novo valor já nasce obsoleto
+                if geracao == self._geracao:
+                    self._invalidado_em = None
+            self._cargas += 1
+            print(f"[{self.rotulo}] ✅ {self._descrever(novo)} (geração {geracao})")
+            return novo
+        finally:
+            self._lock.release()
+
+    def atualizado(self, valor):
+        """Se o valor é o atual (False para um valor obsoleto servido durante a recarga)"""
+        return self._valido(valor)
+
+    def invalidar(self, motivo=''):
+        """
+        Invalida o valor atual; a próxima consulta recarrega
+
+        O valor antigo é mantido apenas para ser servido durante a recarga.
+        Não espera uma carga em andamento: ela termina com a geração antiga e
+        o valor resultante já é considerado obsoleto.
+
+        Args:
+            motivo (str): Descrição da alteração (apenas para log)
+        """
+        with self._lock_estado:
+            self._geracao += 1
+            self._ultima_invalidacao = time.time()
+            if self._invalidado_em is None:
+                self._invalidado_em = self._ultima_invalidacao
+        print(f"[{self.rotulo}] 🔄 Invalidação de {self.descricao} (geração {self._geracao}){': ' + motivo if motivo else ''}")
+
+    def estatisticas(self):
+        """Retorna métricas do cache para monitoramento"""
+        valor = self._valor
+        return {
+            'geracao': self._geracao,
+            'carregado': valor is not None,
+            'atualizado': self._valido(valor),
+            'carregado_em': valor.carregado_em if valor is not None else None,
+            'cargas': self._cargas,
+            'acertos': self._acertos,
+            'obsoletos_servidos': self._obsoletos_servidos,
+            'ttl': self.ttl,
+            'janela_obsoleto': self.janela_obsoleto,
+            'ultima_invalidacao': self._ultima_invalidacao
+        }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Condições de aplicação pré-compiladas (memórias de cálculo e fórmulas)
+
+As condições ficam gravadas como JSON em MemoriaCalculoAgente.condicoes_aplicacao
+e FormulaCalculoFrete.condicoes, por exemplo:
+
+    {"peso_usado": {"min": 0, "max": 100}, "tipo_servico": "TRANSFERENCIA",
+     "uf_destino": ["SP", "RJ"], "peso_min": 0, "peso_max": 100}
+
+Semântica (a mesma de _verificar_condicoes):
+    - dict: limites inclusivos "min"/"max" e igualdade "igual"
+    - str: igualdade sem diferenciar maiúsculas/acentos
+    - list: pertence à lista (sem diferenciar maiúsculas/acentos)
+    - "<campo>_min"/"<campo>_max" numéricos: limites de <campo> ("peso" = peso_usado)
+    - campos ausentes nos dados não bloqueiam; erro de comparação também não
+
+CondicoesCompiladas guarda intervalos, igualdades e conjuntos (hash) prontos;
+IndiceCondicoes organiza as regras de um agente num índice de intervalos de
+peso e devolve as aplicáveis em ordem de prioridade sem ler JSON.
+"""
+import json
+import math
+from bisect import bisect_left
+from functools import lru_cache
+
+from tarifas import normalizar_texto
+
+# Prefixos de "<campo>_min"/"<campo>_max" que apontam para outro campo dos dados
+ALIASES_CAMPOS = {
+    'peso': 'peso_usado'
+}
+
+
+def _numero(valor):
+    """Retorna o valor como float se for numérico (bool e NaN não contam)"""
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return None
+    valor = float(valor)
+    return None if math.isnan(valor) else valor
+
+
+class CondicoesCompiladas:
+    """
+    Condições de uma regra já interpretadas
+
+    Attributes:
+        intervalos (dict): {campo: (minimo, maximo)} inclusivos
+        igualdades (dict): {campo: valor} da chave "igual"
+        textos (dict): {campo: texto normalizado}
+        conjuntos (dict): {campo: frozenset de textos normalizados}
+    """
+
+    def __init__(self, condicoes=None):
+        self.intervalos = {}
+        self.igualdades = {}
+        self.textos = {}
+        self.conjuntos = {}
+
+        for campo, condicao in (condicoes or {}).items():
+            if isinstance(condicao, dict):
+                if 'min' in condicao or 'max' in condicao:
+                    self._limitar(campo, condicao.get('min'), condicao.get('max'))
+                if 'igual' in condicao:
+                    self.igualdades[campo] = condicao['igual']
+            elif isinstance(condicao, str):
+                self.textos[campo] = normalizar_texto(condicao)
+            elif isinstance(condicao, list):
+                self.conjuntos[campo] = frozenset(normalizar_texto(item) for item in condicao)
+            elif _numero(condicao) is not None and campo.endswith(('_min', '_max')):
+                base = ALIASES_CAMPOS.get(campo[:-4], campo[:-4])
+                if campo.endswith('_min'):
+                    self._limitar(base, condicao, None)
+                else:
+                    self._limitar(base, None, condicao)
+
+    def _limitar(self, campo, minimo, maximo):
+        # Limite não numérico nunca bloqueou (a comparação falhava); é ignorado
+        minimo, maximo = _numero(minimo), _numero(maximo)
+        atual_min, atual_max = self.intervalos.get(campo, (-math.inf, math.inf))
+        if minimo is not None:
+            atual_min = max(atual_min, minimo)
+        if maximo is not None:
+            atual_max = min(atual_max, maximo)
+        self.intervalos[campo] = (atual_min, atual_max)
+
+    def intervalo(self, campo):
+        """Retorna (minimo, maximo) do campo; sem condição = (-inf, inf)"""
+        return self.intervalos.get(campo, (-math.inf, math.inf))
+
+    def vazia(self):
+        return not (self.intervalos or self.igualdades or self.textos or self.conjuntos)
+
+    def atende(self, dados, ignorar=None):
+        """
+        Verifica se os dados atendem às condições
+
+        Args:
+            dados (dict): Valores do cálculo (peso_usado, valor_nf, tipo_servico...)
+            ignorar (str): Campo de intervalo já resolvido pelo índice
+
+        Returns:
+            bool: True se todas as condições presentes nos dados forem atendidas
+        """
+        try:
+            for campo, (minimo, maximo) in self.intervalos.items():
+                if campo == ignorar or campo not in dados:
+                    continue
+                valor = dados[campo]
+                if valor < minimo or valor > maximo:
+                    return False
+
+            for campo, esperado in self.igualdades.items():
+                if campo in dados and dados[campo] != esperado:
+                    return False
+
+            for campo, esperado in self.textos.items():
+                if campo in dados and normalizar_texto(dados[campo]) != esperado:
+                    return False
+
+            for campo, permitidos in self.conjuntos.items():
+                if campo in dados and normalizar_texto(dados[campo]) not in permitidos:
+                    return False
+
+            return True
+
+        except Exception:
+            return True  # Se erro, não bloquear
+
+
+@lru_cache(maxsize=1024)
+def compilar_condicoes_texto(texto):
+    """Compila as condições gravadas como JSON (mesmo texto = mesmo objeto)"""
+    try:
+        condicoes = json.loads(texto) if texto else {}
+    except (TypeError, ValueError):
+        condicoes = {}
+    return CondicoesCompiladas(condicoes if isinstance(condicoes, dict) else {})
+
+
+class IndiceCondicoes:
+    """
+    Índice das regras de um grupo (memórias de um agente, fórmulas de um tipo)
+
+    Os limites de campo_intervalo de todas as regras dividem a reta em
+    segmentos; cada segmento guarda as regras que o cobrem, já em ordem de
+    prioridade. A consulta faz uma busca binária no segmento e só avalia as
+    demais condições (faixas de valor e conjuntos) das regras candidatas.
+    """
+
+    def __init__(self, regras, campo_intervalo='peso_usado'):
+        """
+        Args:
+            regras (list): [(prioridade, id, CondicoesCompiladas, item)]
+            campo_intervalo (str): Campo numérico indexado por intervalo
+        """
+        regras = sorted(regras, key=lambda regra: (-regra[0], regra[1]))
+        self.campo = campo_intervalo
+        self.condicoes = [regra[2] for regra in regras]
+        self.itens = [regra[3] for regra in regras]
+
+        intervalos = [condicoes.intervalo(self.campo) for condicoes in self.condicoes]
+        self.pontos = sorted({
+            limite for intervalo in intervalos for limite in intervalo if math.isfinite(limite)
+        })
+
+        # Segmento 2i: entre pontos[i-1] e pontos[i]; segmento 2i+1: exatamente pontos[i]
+        self.segmentos = []
+        for segmento in range(2 * len(self.pontos) + 1):
+            valor = self._representante(segmento)
+            self.segmentos.append(tuple(
+                posicao for posicao, (minimo, maximo) in enumerate(intervalos)
+                if minimo <= valor <= maximo
+            ))
+        self.todos = tuple(range(len(self.itens)))
+
+    def _representante(self, segmento):
+        if not self.pontos:
+            return 0.0
+        i = segmento // 2
+        if segmento % 2:
+            return self.pontos[i]
+        if i == 0:
+            return self.pontos[0] - 1
+        if i == len(self.pontos):
+            return self.pontos[-1] + 1
+        return (self.pontos[i - 1] + self.pontos[i]) / 2
+
+    def _candidatos(self, dados):
+        valor = _numero(dados.get(self.campo)) if self.campo in dados else None
+        if valor is None:
+            return self.todos, None
+        i = bisect_left(self.pontos, valor)
+        if i < len(self.pontos) and self.pontos[i] == valor:
+            return self.segmentos[2 * i + 1], self.campo
+        return self.segmentos[2 * i], self.campo
+
+    def aplicaveis(self, dados):
+        """Retorna os itens cujas condições são atendidas, em ordem de prioridade"""
+        candidatos, resolvido = self._candidatos(dados)
+        return [
+            self.itens[posicao] for posicao in candidatos
+            if self.condicoes[posicao].atende(dados, ignorar=resolvido)
+        ]
+
+    def primeira(self, dados):
+        """Retorna o item aplicável de maior prioridade (ou None)"""
+        candidatos, resolvido = self._candidatos(dados)
+        for posicao in candidatos:
+            if self.condicoes[posicao].atende(dados, ignorar=resolvido):
+                return self.itens[posicao]
+        return None
+
+    def __len__(self):
+        return len(self.itens)
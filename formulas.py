@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compilação e cache das fórmulas de cálculo cadastradas no banco
+
+Fórmulas de FormulaCalculoFrete, das memórias de cálculo dos agentes e das
+configurações de agente são texto Python guardado no banco. Em vez de passar
+o texto para exec/eval a cada cotação, cada fórmula é validada pela árvore
+sintática (AST) e compilada uma única vez; as cotações seguintes só executam
+o code object já pronto.
+
+A chave do cache é (identificador da fórmula, hash do conteúdo), então uma
+fórmula editada nunca reaproveita o código antigo, mesmo antes da
+invalidação explícita feita pelas rotas do painel admin.
+
+Dois modos de fórmula:
+  - 'eval': expressão única (ex: "peso_usado * valor_kg + pedagio")
+  - 'exec': bloco de comandos que atribui a variável `resultado`
+"""
+import ast
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Funções disponíveis dentro das fórmulas
+FUNCOES_PERMITIDAS = {
+    'abs': abs,
+    'float': float,
+    'int': int,
+    'max': max,
+    'min': min,
+    'round': round,
+    'str': str,
+}
+
+# Métodos permitidos em variáveis (ex: linha_base.get('50', 0))
+METODOS_PERMITIDOS = {'get'}
+
+# Limites de tamanho: `9**9**9` ou `[0] * 10**10` travariam o worker
+LIMITE_EXPOENTE = 100          # expoente constante máximo em `a ** n`
+LIMITE_BITS_INTEIRO = 4096     # tamanho máximo de um inteiro calculado
+LIMITE_SEQUENCIA = 10000       # itens/caracteres máximos de uma lista ou texto concatenado
+
+_NOS_PERMITIDOS = (
+    ast.Expression, ast.Module, ast.Expr, ast.Assign, ast.AugAssign, ast.If, ast.Pass,
+    ast.For, ast.Break, ast.Continue,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Attribute, ast.Subscript, ast.Name, ast.Constant, ast.Tuple, ast.List,
+    ast.Load, ast.Store,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+    ast.And, ast.Or, ast.Not,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+
+
+class FormulaInvalida(ValueError):
+    """Fórmula com sintaxe inválida ou construção não permitida"""
+
+
+def hash_formula(fonte):
+    """Hash do conteúdo da fórmula (sha1 do texto)"""
+    return hashlib.sha1((fonte or '').encode('utf-8')).hexdigest()
+
+
+def validar_formula(fonte, modo='eval'):
+    """
+    Valida a fórmula pela árvore sintática
+
+    Só são aceitos aritmética, comparações, condicionais, atribuições simples,
+    acesso por índice (linha_base['50']), as funções de FUNCOES_PERMITIDAS e
+    os métodos de METODOS_PERMITIDOS. Nomes com "__" são recusados.
+
+    Laços `for` (com break/continue) são aceitos quando percorrem uma lista ou
+    tupla literal ou uma variável (ex: `for faixa in [20, 30, 50]`), com uma
+    variável simples como alvo; sem range/while não há laço sem fim.
+
+    Repetição de lista ou texto (`[0] * n`), formatação com `%`, potências
+    encadeadas (`9 ** 9 ** 9`) e expoentes constantes acima de
+    LIMITE_EXPOENTE são recusados; os demais produtos, potências e
+    concatenações são limitados na execução (ver _OperacoesLimitadas).
+
+    Args:
+        fonte (str): Texto da fórmula
+        modo (str): 'eval' (expressão) ou 'exec' (comandos)
+
+    Returns:
+        ast.AST: Árvore validada
+
+    Raises:
+        FormulaInvalida: Sintaxe inválida ou construção não permitida
+    """
+    if not fonte or not str(fonte).strip():
+        raise FormulaInvalida("Fórmula vazia")
+
+    try:
+        arvore = ast.parse(str(fonte).strip(), mode=modo)
+    except SyntaxError as e:
+        raise FormulaInvalida(f"Sintaxe inválida: {e.msg} (linha {e.lineno})")
+
+    for no in ast.walk(arvore):
+        if not isinstance(no, _NOS_PERMITIDOS):
+            raise FormulaInvalida(f"Construção não permitida: {type(no).__name__}")
+        if isinstance(no, ast.Name) and '__' in no.id:
+            raise FormulaInvalida(f"Nome não permitido: {no.id}")
+        if isinstance(no, ast.For):
+            if not isinstance(no.target, ast.Name):
+                raise FormulaInvalida("Laço for deve usar uma variável simples")
+            if not isinstance(no.iter, (ast.List, ast.Tuple, ast.Name)):
+                raise FormulaInvalida("Laço for deve percorrer uma lista literal ou uma variável")
+        if isinstance(no, (ast.BinOp, ast.AugAssign)):
+            _validar_operacao(no)
+        if isinstance(no, ast.Attribute) and no.attr not in METODOS_PERMITIDOS:
+            raise FormulaInvalida(f"Atributo não permitido: {no.attr}")
+        if isinstance(no, ast.Call):
+            if isinstance(no.func, ast.Name):
+                if no.func.id not in FUNCOES_PERMITIDAS:
+                    raise FormulaInvalida(f"Função não permitida: {no.func.id}")
+            elif not isinstance(no.func, ast.Attribute):
+                raise FormulaInvalida("Chamada não permitida")
+
+    return arvore
+
+
+def _eh_sequencia_literal(no):
+    return isinstance(no, (ast.List, ast.Tuple)) or (isinstance(no, ast.Constant) and isinstance(no.value, str))
+
+
+def _validar_operacao(no):
+    """Recusa repetição de sequência e potências grandes visíveis no texto da fórmula"""
+    esquerda = no.target if isinstance(no, ast.AugAssign) else no.left
+    direita = no.value if isinstance(no, ast.AugAssign) else no.right
+    if isinstance(no.op, ast.Mult) and (_eh_sequencia_literal(esquerda) or _eh_sequencia_literal(direita)):
+        raise FormulaInvalida("Repetição de lista ou texto não permitida")
+    if isinstance(no.op, ast.Mod) and isinstance(esquerda, ast.Constant) and isinstance(esquerda.value, str):
+        raise FormulaInvalida("Formatação de texto com % não permitida")
+    if isinstance(no.op, ast.Pow):
+        expoente = direita.operand if isinstance(direita, ast.UnaryOp) else direita
+        if isinstance(expoente, ast.BinOp) and isinstance(expoente.op, ast.Pow):
+            raise FormulaInvalida("Potência encadeada não permitida")
+        if isinstance(expoente, ast.Constant) and isinstance(expoente.value, (int, float)) \
+                and abs(expoente.value) > LIMITE_EXPOENTE:
+            raise FormulaInvalida(f"Expoente acima de {LIMITE_EXPOENTE} não permitido")
+
+
+def _multiplicar(a, b):
+    if isinstance(a, (str, list, tuple)) or isinstance(b, (str, list, tuple)):
+        raise FormulaInvalida("Repetição de lista ou texto não permitida")
+    if isinstance(a, int) and isinstance(b, int) and a.bit_length() + b.bit_length() > LIMITE_BITS_INTEIRO:
+        raise FormulaInvalida(f"Resultado acima de {LIMITE_BITS_INTEIRO} bits")
+    return a * b
+
+
+def _potenciar(base, expoente):
+    if isinstance(base, int) and isinstance(expoente, int) and expoente > 0 and abs(base) > 1 \
+            and (abs(base) - 1).bit_length() * expoente > LIMITE_BITS_INTEIRO:
+        raise FormulaInvalida(f"Resultado acima de {LIMITE_BITS_INTEIRO} bits")
+    return base ** expoente
+
+
+def _resto(a, b):
+    if isinstance(a, str):
+        raise FormulaInvalida("Formatação de texto com % não permitida")
+    return a % b
+
+
+def _somar(a, b):
+    if isinstance(a, (str, list, tuple)) and isinstance(b, (str, list, tuple)) \
+            and len(a) + len(b) > LIMITE_SEQUENCIA:
+        raise FormulaInvalida(f"Lista ou texto com mais de {LIMITE_SEQUENCIA} itens")
+    return a + b
+
+
+# Nomes com "__" não passam pela validação, então a fórmula não alcança as funções auxiliares
+_OPERACOES = {ast.Mult: '__multiplicar__', ast.Pow: '__potenciar__', ast.Add: '__somar__', ast.Mod: '__resto__'}
+_GLOBAIS = {
+    '__builtins__': FUNCOES_PERMITIDAS,
+    '__multiplicar__': _multiplicar,
+    '__potenciar__': _potenciar,
+    '__somar__': _somar,
+    '__resto__': _resto,
+}
+
+
+class _OperacoesLimitadas(ast.NodeTransformer):
+    """
+    Troca `*`, `**`, `+` e `%` (inclusive `*=`, `**=`, `+=`, `%=`) por
+    chamadas que limitam o tamanho do resultado
+
+    Operandos variáveis só são conhecidos na execução: `x ** y` com x e y
+    vindos do escopo, ou `x = x + x` repetido num laço, passam pela validação.
+    """
+
+    def _chamar(self, op, esquerda, direita, origem):
+        funcao = ast.Name(id=_OPERACOES[type(op)], ctx=ast.Load())
+        return ast.copy_location(ast.Call(func=funcao, args=[esquerda, direita], keywords=[]), origem)
+
+    def visit_BinOp(self, no):
+        self.generic_visit(no)
+        if type(no.op) not in _OPERACOES:
+            return no
+        return self._chamar(no.op, no.left, no.right, no)
+
+    def visit_AugAssign(self, no):
+        self.generic_visit(no)
+        if type(no.op) not in _OPERACOES:
+            return no
+        leitura = _como_leitura(no.target)
+        return ast.copy_location(ast.Assign(targets=[no.target], value=self._chamar(no.op, leitura, no.value, no)), no)
+
+
+def _como_leitura(alvo):
+    """Cópia do alvo de uma atribuição com contexto de leitura"""
+    leitura = copy.deepcopy(alvo)
+    leitura.ctx = ast.Load()
+    return leitura
+
+
+def detectar_modo(fonte):
+    """Retorna 'eval' se a fórmula é uma expressão única, senão 'exec'"""
+    try:
+        ast.parse(str(fonte or '').strip(), mode='eval')
+        return 'eval'
+    except SyntaxError:
+        return 'exec'
+
+
+class CacheFormulas:
+    """
+    Cache LRU de fórmulas validadas e compiladas
+
+    Thread-safe; compartilhado por todas as cotações do processo.
+    """
+
+    def __init__(self, max_itens=512):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._compilacoes = 0
+        self._acertos = 0
+        self._rejeitadas = 0
+
+    def compilar(self, fonte, chave=None, modo='eval'):
+        """
+        Retorna o code object da fórmula, compilando apenas na primeira vez
+
+        Args:
+            fonte (str): Texto da fórmula
+            chave (tuple): Identificador da fórmula, ex: ('formula', 12)
+            modo (str): 'eval' ou 'exec'
+
+        Raises:
+            FormulaInvalida: Fórmula recusada pela validação
+        """
+        item = (chave, modo, hash_formula(fonte))
+        with self._lock:
+            codigo = self._itens.get(item)
+            if codigo is not None:
+                self._itens.move_to_end(item)
+                self._acertos += 1
+                return codigo
+
+        try:
+            arvore = validar_formula(fonte, modo)
+        except FormulaInvalida:
+            with self._lock:
+                self._rejeitadas += 1
+            raise
+        arvore = ast.fix_missing_locations(_OperacoesLimitadas().visit(arvore))
+        codigo = compile(arvore, f'<formula {chave}>', modo)
+
+        with self._lock:
+            self._compilacoes += 1
+            self._itens[item] = codigo
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return codigo
+
+    def invalidar(self, chave=None):
+        """Remove as versões compiladas de uma fórmula (ou de todas, sem chave)"""
+        with self._lock:
+            if chave is None:
+                removidas = len(self._itens)
+                self._itens.clear()
+            else:
+                itens = [item for item in self._itens if item[0] == chave]
+                for item in itens:
+                    del self._itens[item]
+                removidas = len(itens)
+        print(f"[FORMULAS] 🔄 Cache invalidado ({chave or 'todas'}): {removidas} fórmulas removidas")
+        return removidas
+
+    def estatisticas(self):
+        """Retorna métricas do cache para monitoramento"""
+        with self._lock:
+            return {
+                'formulas': len(self._itens),
+                'compilacoes': self._compilacoes,
+                'acertos': self._acertos,
+                'rejeitadas': self._rejeitadas,
+                'max_itens': self.max_itens
+            }
+
+
+CACHE_FORMULAS = CacheFormulas()
+
+
+def avaliar_expressao(fonte, variaveis, chave=None):
+    """Avalia uma fórmula-expressão (modo 'eval') com as variáveis informadas"""
+    codigo = CACHE_FORMULAS.compilar(fonte, chave, 'eval')
+    return eval(codigo, _GLOBAIS, dict(variaveis))
+
+
+def executar_bloco(fonte, variaveis, chave=None):
+    """
+    Executa uma fórmula em bloco (modo 'exec') e retorna a variável `resultado`
+
+    As variáveis informadas são copiadas; `resultado` começa em 0 se não vier.
+    """
+    codigo = CACHE_FORMULAS.compilar(fonte, chave, 'exec')
+    escopo = {'resultado': 0}
+    escopo.update(variaveis)
+    exec(codigo, _GLOBAIS, escopo)
+    return escopo.get('resultado', 0)
+
+
+# Fórmulas cadastradas pelo setup inicial (popular_banco_com_memorias_originais)
+FORMULAS_ORIGINAIS = [
+    {
+        'nome': 'JEM_DFI_TRANSFERENCIA',
+        'tipo': 'FRACIONADO_TRANSFERENCIA',
+        'formula': '''
+# Lógica original JEM/DFI - transferência padrão
+peso_calculo = float(peso_usado)
+valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
+if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
+    resultado = float(valor_minimo)
+else:
+    faixas_kg = [20, 30, 50, 70, 100, 150, 200, 300, 500]
+    for faixa in faixas_kg:
+        if peso_calculo <= float(faixa):
+            valor_faixa = linha_base.get(str(faixa), 0)
+            if valor_faixa and float(valor_faixa) > 0:
+                resultado = peso_calculo * float(valor_faixa)
+                break
+''',
+        'condicoes': 'fornecedor.contains("JEM") or fornecedor.contains("DFI")',
+        'prioridade': 1
+    },
+    {
+        'nome': 'REUNIDAS_VALOR_FIXO',
+        'tipo': 'FRACIONADO_DIRETO',
+        'formula': '''
+# Lógica original REUNIDAS - valor fixo faixa 200kg
+valor_200 = linha_base.get('200', 0)
+if valor_200 and float(valor_200) > 0:
+    resultado = float(valor_200)  # Valor fixo, não multiplicado
+else:
+    for faixa in [100, 150, 300, 500]:
+        valor_faixa = linha_base.get(str(faixa), 0)
+        if valor_faixa and float(valor_faixa) > 0:
+            resultado = float(valor_faixa)
+            break
+''',
+        'condicoes': 'fornecedor.contains("REUNIDAS")',
+        'prioridade': 1
+    },
+    {
+        'nome': 'PTX_MULTIPLICADO',
+        'tipo': 'FRACIONADO_DIRETO',
+        'formula': '''
+# Lógica original PTX - valor multiplicado pelo peso
+peso_calculo = float(peso_usado)
+valor_por_kg = 0.0
+for key in ['20', '10', '30', '50', '70', '100']:
+    valor_key = linha_base.get(key, 0)
+    if valor_key and float(valor_key) > 0:
+        valor_por_kg = float(valor_key)
+        break
+resultado = peso_calculo * valor_por_kg
+''',
+        'condicoes': 'fornecedor.contains("PTX")',
+        'prioridade': 1
+    },
+    {
+        'nome': 'GRITSCH_DIRETO',
+        'tipo': 'FRACIONADO_DIRETO',
+        'formula': '''
+# Lógica original Gritsch - direto porta-a-porta
+peso_calculo = float(peso_usado)
+valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
+if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
+    resultado = float(valor_minimo)
+else:
+    faixas_kg = [20, 30, 50, 70, 100, 150, 200, 300, 500]
+    for faixa in faixas_kg:
+        if peso_calculo <= float(faixa):
+            valor_faixa = linha_base.get(str(faixa), 0)
+            if valor_faixa and float(valor_faixa) > 0:
+                resultado = peso_calculo * float(valor_faixa)
+                break
+''',
+        'condicoes': 'fornecedor.contains("GRITSCH")',
+        'prioridade': 1
+    },
+    {
+        'nome': 'ROTA_COMPLETA_AUTOMATICA',
+        'tipo': 'FRACIONADO_ROTA_COMPLETA',
+        'formula': '''
+# Sistema automático de combinação de agentes
+# Busca automaticamente: agente_coleta + transferencia + agente_entrega
+# Soma os custos totais de cada etapa
+resultado = custo_coleta_total + custo_transferencia_total + custo_entrega_total
+''',
+        'condicoes': 'peso_cubado <= 1000',
+        'prioridade': 1
+    }
+]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Geocodificação offline dos municípios brasileiros
+
+A tabela data/municipios_ibge.csv traz, por município, o código IBGE, o nome
+e a coordenada do centroide (sede municipal), no formato público derivado do
+IBGE: codigo_ibge, nome, latitude, longitude, capital, codigo_uf.
+
+O GeocodificadorIBGE carrega a tabela uma vez por processo num dicionário
+indexado por (nome normalizado, UF). A consulta não diferencia maiúsculas,
+acentos, hífens ou apóstrofos e responde sem acesso à rede. O Nominatim
+continua disponível em app2.geocode como provedor secundário.
+
+Para gerar a tabela completa (5.570 municípios) use atualizar_municipios_ibge.py.
+"""
+import csv
+import os
+import re
+import threading
+
+from tarifas import normalizar_texto
+
+CAMINHO_MUNICIPIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'municipios_ibge.csv')
+
+# Código IBGE da UF -> sigla
+CODIGOS_UF = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF'
+}
+
+# Quantidade de municípios da tabela completa (abaixo disso a carga avisa)
+TOTAL_MUNICIPIOS = 5570
+
+_SEPARADORES = re.compile(r"[-'’`´.]")
+
+
+def chave_municipio(nome):
+    """Normaliza o nome do município para busca (ex: "Santa Bárbara d'Oeste" -> "santa barbara d oeste")"""
+    return normalizar_texto(_SEPARADORES.sub(' ', str(nome or '')))
+
+
+def _sigla_uf(valor):
+    valor = str(valor or '').strip()
+    if valor.isdigit():
+        return CODIGOS_UF.get(int(valor), '')
+    return valor.upper()
+
+
+class GeocodificadorIBGE:
+    """
+    Índice local de municípios -> coordenadas
+
+    Attributes:
+        caminho (str): CSV com os municípios
+        municipios (dict): {(chave do nome, UF): municipio}
+        por_nome (dict): {chave do nome: [municipios]} para consultas sem UF
+    """
+
+    def __init__(self, caminho=CAMINHO_MUNICIPIOS):
+        self.caminho = caminho
+        self.municipios = {}
+        self.por_nome = {}
+        self.capitais = {}
+        self.carregado = False
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+
+    def carregar(self):
+        """Lê o CSV uma única vez (chamado sob demanda na primeira consulta)"""
+        if self.carregado:
+            return self
+        with self._lock:
+            if self.carregado:
+                return self
+            try:
+                with open(self.caminho, encoding='utf-8') as arquivo:
+                    for linha in csv.DictReader(arquivo):
+                        uf = _sigla_uf(linha.get('codigo_uf') or linha.get('uf'))
+                        municipio = {
+                            'codigo_ibge': int(linha['codigo_ibge']),
+                            'nome': linha['nome'],
+                            'uf': uf,
+                            'lat': float(linha['latitude']),
+                            'lon': float(linha['longitude'])
+                        }
+                        chave = chave_municipio(municipio['nome'])
+                        self.municipios[(chave, uf)] = municipio
+                        self.por_nome.setdefault(chave, []).append(municipio)
+                        if str(linha.get('capital', '0')).strip() in ('1', 'true', 'True'):
+                            self.capitais[uf] = municipio
+                print(f"[GEOCODE] ✅ {len(self.municipios)} municípios carregados de {os.path.basename(self.caminho)}")
+                if len(self.municipios) < TOTAL_MUNICIPIOS:
+                    print(f"[GEOCODE] ⚠️ Tabela incompleta ({len(self.municipios)} de {TOTAL_MUNICIPIOS}): "
+                          f"municípios ausentes ficam fora das APIs em lote; gere a tabela com atualizar_municipios_ibge.py")
+            except Exception as e:
+                print(f"[GEOCODE] ❌ Erro ao carregar tabela de municípios: {e}")
+            self.carregado = True
+        return self
+
+    def buscar(self, municipio, uf=None):
+        """
+        Busca o município na tabela local
+
+        Args:
+            municipio (str): Nome do município (qualquer grafia/acentuação)
+            uf (str): Sigla da UF; sem UF, só responde se o nome for único
+
+        Returns:
+            dict: {codigo_ibge, nome, uf, lat, lon} ou None
+        """
+        self.carregar()
+        chave = chave_municipio(municipio)
+        if uf:
+            encontrado = self.municipios.get((chave, str(uf).strip().upper()))
+        else:
+            candidatos = self.por_nome.get(chave, [])
+            encontrado = candidatos[0] if len(candidatos) == 1 else None
+
+        if encontrado:
+            self._acertos += 1
+        else:
+            self._falhas += 1
+        return encontrado
+
+    def capital(self, uf):
+        """Retorna a capital da UF (ou None)"""
+        self.carregar()
+        return self.capitais.get(str(uf or '').strip().upper())
+
+    def estatisticas(self):
+        """Retorna métricas do geocodificador local para monitoramento"""
+        return {
+            'municipios': len(self.municipios),
+            'completa': len(self.municipios) >= TOTAL_MUNICIPIOS,
+            'carregado': self.carregado,
+            'acertos': self._acertos,
+            'falhas': self._falhas
+        }
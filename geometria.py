@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Geometria das rotas: simplificação (Douglas-Peucker) e polyline codificada
+
+A geometria completa de uma rota longa tem milhares de pontos, muito mais
+do que o mapa consegue desenhar. A rota é simplificada com Douglas-Peucker
+usando uma tolerância de ~1 pixel quando ela inteira cabe no mapa e é
+devolvida como polyline codificada (formato Google, precisão 5), que ocupa
+uma fração do tamanho de uma lista JSON de coordenadas.
+"""
+import numpy as np
+import polyline
+
+# Largura (px) do mapa em que a rota inteira é exibida
+LARGURA_MAPA_PX = 1000
+
+
+def simplificar_douglas_peucker(pontos, tolerancia):
+    """
+    Simplifica uma linha mantendo os pontos que se afastam mais que a tolerância
+
+    Args:
+        pontos (list): [[lat, lon], ...]
+        tolerancia (float): Distância máxima (em graus) entre a linha original e a simplificada
+
+    Returns:
+        list: Subconjunto dos pontos, mantendo o primeiro e o último
+    """
+    coordenadas = np.asarray(pontos, dtype=np.float64)
+    if len(coordenadas) < 3 or tolerancia <= 0:
+        return [list(ponto) for ponto in coordenadas]
+
+    manter = np.zeros(len(coordenadas), dtype=bool)
+    manter[0] = manter[-1] = True
+    pilha = [(0, len(coordenadas) - 1)]
+    while pilha:
+        inicio, fim = pilha.pop()
+        if fim - inicio < 2:
+            continue
+        a, b = coordenadas[inicio], coordenadas[fim]
+        trecho = coordenadas[inicio + 1:fim]
+        segmento = b - a
+        comprimento = np.hypot(segmento[0], segmento[1])
+        if comprimento == 0:
+            distancias = np.hypot(trecho[:, 0] - a[0], trecho[:, 1] - a[1])
+        else:
+            # Distância perpendicular de cada ponto à reta a-b
+            distancias = np.abs(segmento[0] * (trecho[:, 1] - a[1]) - segmento[1] * (trecho[:, 0] - a[0])) / comprimento
+        maior = int(np.argmax(distancias))
+        if distancias[maior] > tolerancia:
+            indice = inicio + 1 + maior
+            manter[indice] = True
+            pilha.append((inicio, indice))
+            pilha.append((indice, fim))
+
+    return coordenadas[manter].tolist()
+
+
+def tolerancia_para_mapa(pontos, largura_px=LARGURA_MAPA_PX):
+    """Tolerância (graus) equivalente a 1 pixel com a rota inteira enquadrada no mapa"""
+    coordenadas = np.asarray(pontos, dtype=np.float64)
+    if len(coordenadas) < 2:
+        return 0.0
+    extensao = float(np.max(coordenadas.max(axis=0) - coordenadas.min(axis=0)))
+    return extensao / largura_px
+
+
+def codificar_rota(pontos, largura_px=LARGURA_MAPA_PX):
+    """
+    Simplifica e codifica a geometria da rota
+
+    Returns:
+        tuple: (polyline codificada, quantidade de pontos após a simplificação)
+    """
+    simplificados = simplificar_douglas_peucker(pontos, tolerancia_para_mapa(pontos, largura_px))
+    return polyline.encode([tuple(ponto) for ponto in simplificados], 5), len(simplificados)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Job offline: gera data/matriz_distancias.npz com as rotas mais cotadas
+
+Pares de municípios vêm do histórico de cálculos (rotas mais frequentes) e
+dos pares Origem/Destino da base unificada. As distâncias são calculadas por
+um OSRM local/compatível (OSRM_URL, ex: http://localhost:5000) ou, sem ele,
+por Haversine x fator de desvio rodoviário.
+
+Uso:
+    python gerar_matriz_distancias.py [limite_historico]
+
+Variáveis:
+    OSRM_URL           URL base de um serviço compatível com OSRM (opcional)
+    FATOR_DESVIO       Distância rodoviária / linha reta (padrão 1.3)
+    VELOCIDADE_MEDIA   km/h para estimar a duração sem OSRM (padrão 40)
+"""
+
+import os
+import sys
+
+import requests
+from sqlalchemy import func
+
+from app2 import app
+from geocodificacao import GeocodificadorIBGE
+from matriz_distancias import CAMINHO_MATRIZ, MatrizDistancias, haversine_km
+from models import BaseUnificada, HistoricoCalculo, db
+from provedores_rota import ProvedorOSRM
+
+OSRM_URL = os.getenv('OSRM_URL', '').rstrip('/')
+FATOR_DESVIO = float(os.getenv('FATOR_DESVIO', 1.3))
+VELOCIDADE_MEDIA = float(os.getenv('VELOCIDADE_MEDIA', 40))
+
+def coletar_pares(geocodificador, limite_historico=500):
+    """Retorna {(codigo_origem, codigo_destino): (municipio_origem, municipio_destino)}"""
+    pares = {}
+
+    # Rotas mais frequentes do histórico (têm UF)
+    historico = db.session.query(
+        HistoricoCalculo.origem_municipio, HistoricoCalculo.origem_uf,
+        HistoricoCalculo.destino_municipio, HistoricoCalculo.destino_uf,
+        func.count(HistoricoCalculo.id).label('total')
+    ).group_by(
+        HistoricoCalculo.origem_municipio, HistoricoCalculo.origem_uf,
+        HistoricoCalculo.destino_municipio, HistoricoCalculo.destino_uf
+    ).order_by(func.count(HistoricoCalculo.id).desc()).limit(limite_historico).all()
+
+    for origem, uf_origem, destino, uf_destino, _ in historico:
+        municipio_origem = geocodificador.buscar(origem, uf_origem)
+        municipio_destino = geocodificador.buscar(destino, uf_destino)
+        if municipio_origem and municipio_destino:
+            pares[(municipio_origem['codigo_ibge'], municipio_destino['codigo_ibge'])] = (municipio_origem, municipio_destino)
+    print(f"📊 Histórico: {len(historico)} rotas, {len(pares)} localizadas")
+
+    # Pares Origem/Destino da base (sem UF: só nomes únicos no país)
+    base = db.session.query(BaseUnificada.origem, BaseUnificada.destino).filter(
+        BaseUnificada.destino.isnot(None), BaseUnificada.destino != ''
+    ).distinct().all()
+    antes = len(pares)
+    for origem, destino in base:
+        municipio_origem = geocodificador.buscar(origem)
+        municipio_destino = geocodificador.buscar(destino)
+        if municipio_origem and municipio_destino and municipio_origem is not municipio_destino:
+            pares[(municipio_origem['codigo_ibge'], municipio_destino['codigo_ibge'])] = (municipio_origem, municipio_destino)
+    print(f"📊 Base unificada: {len(base)} pares, {len(pares) - antes} novos localizados")
+
+    return pares
+
+def distancia_osrm(provedor, origem, destino):
+    """Distância/duração pelo OSRM configurado (None se indisponível)"""
+    try:
+        rota = provedor.consultar([origem['lat'], origem['lon']], [destino['lat'], destino['lon']])
+        if rota:
+            return rota['distancia'], rota['duracao']
+    except Exception as e:
+        print(f"⚠️ OSRM falhou para {origem['nome']} → {destino['nome']}: {e}")
+    return None
+
+def calcular_distancias(pares):
+    """Retorna {(codigo_origem, codigo_destino): (distancia_km, duracao_min)}"""
+    chaves = list(pares)
+    origens = [pares[chave][0] for chave in chaves]
+    destinos = [pares[chave][1] for chave in chaves]
+
+    # Estimativa vetorizada para todos os pares; OSRM substitui quando disponível
+    distancias = haversine_km(
+        [municipio['lat'] for municipio in origens], [municipio['lon'] for municipio in origens],
+        [municipio['lat'] for municipio in destinos], [municipio['lon'] for municipio in destinos]
+    ) * FATOR_DESVIO
+    duracoes = distancias / VELOCIDADE_MEDIA * 60
+
+    resultado = {chave: (float(distancia), float(duracao)) for chave, distancia, duracao in zip(chaves, distancias, duracoes)}
+    if OSRM_URL:
+        via_osrm = 0
+        provedor = ProvedorOSRM(requests.Session(), OSRM_URL)
+        for chave, origem, destino in zip(chaves, origens, destinos):
+            rota = distancia_osrm(provedor, origem, destino)
+            if rota:
+                resultado[chave] = rota
+                via_osrm += 1
+        print(f"🛣️ {via_osrm}/{len(chaves)} pares calculados pelo OSRM")
+    return resultado
+
+def gerar_matriz(limite_historico=500, caminho=CAMINHO_MATRIZ):
+    """Atualiza a matriz gravada com os pares atuais do histórico e da base"""
+    with app.app_context():
+        geocodificador = GeocodificadorIBGE()
+        pares = coletar_pares(geocodificador, limite_historico)
+        if not pares:
+            print("❌ Nenhum par de municípios localizado")
+            return False
+
+        # Mantém pares já gravados e atualiza os recalculados
+        existentes = MatrizDistancias.carregar(caminho).pares()
+        existentes.update(calcular_distancias(pares))
+        MatrizDistancias.de_pares(existentes).salvar(caminho)
+        return True
+
+if __name__ == "__main__":
+    limite = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sys.exit(0 if gerar_matriz(limite) else 1)
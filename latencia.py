@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Orçamento de latência das cotações e execução concorrente das etapas de rede
+
+Geocodificação e roteamento dependem de serviços externos. Em vez de somar
+timeouts de 10 s por chamada, cada cotação recebe um orçamento total: as
+etapas independentes (geocodificar origem e destino) rodam em paralelo num
+pool de threads compartilhado e a cotação espera no máximo o que resta do
+orçamento. Etapas que estouram ficam registradas e o chamador usa o fallback
+offline (tabela IBGE, distância em linha reta).
+
+Uma etapa que estoura continua rodando em segundo plano até o timeout HTTP;
+o resultado não é usado na cotação atual, mas alimenta o cache persistente.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def criar_sessao_http(conexoes=20):
+    """Sessão HTTP com keep-alive compartilhada pelas chamadas a Nominatim/OSRM"""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes)
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    sessao.headers.update({'User-Agent': 'PortoEx-Cotacao/1.0'})
+    return sessao
+
+
+class SingleFlight:
+    """
+    Agrupa consultas idênticas em andamento numa única chamada de rede
+
+    A primeira thread com uma chave executa a função; as que chegam enquanto
+    ela está em andamento esperam e recebem o mesmo resultado (ou a mesma
+    exceção). Nada é guardado depois que a chamada termina: o cache é papel
+    do CacheGeografico.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+        self._execucoes = 0
+        self._compartilhadas = 0
+
+    def executar(self, chave, funcao):
+        with self._lock:
+            chamada = self._em_andamento.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = {'evento': threading.Event(), 'resultado': None, 'erro': None}
+                self._em_andamento[chave] = chamada
+                self._execucoes += 1
+            else:
+                self._compartilhadas += 1
+
+        if not lider:
+            chamada['evento'].wait()
+            if chamada['erro'] is not None:
+                raise chamada['erro']
+            return chamada['resultado']
+
+        try:
+            chamada['resultado'] = funcao()
+            return chamada['resultado']
+        except Exception as e:
+            chamada['erro'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+            chamada['evento'].set()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'em_andamento': len(self._em_andamento),
+                'execucoes': self._execucoes,
+                'compartilhadas': self._compartilhadas
+            }
+
+
+def criar_pool_rede(max_workers=8):
+    """Pool de threads para as chamadas de rede das cotações"""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rede')
+
+
+class OrcamentoLatencia:
+    """
+    Tempo disponível para as etapas de rede de uma cotação
+
+    Attributes:
+        total (float): Orçamento em segundos
+        etapas (list): [{etapa, ms, estourou}] na ordem em que terminaram
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.inicio = time.perf_counter()
+        self.etapas = []
+
+    def decorrido(self):
+        return time.perf_counter() - self.inicio
+
+    def restante(self):
+        """Segundos restantes (nunca negativo)"""
+        return max(0.0, self.total - self.decorrido())
+
+    def esgotado(self):
+        return self.restante() <= 0
+
+    def timeout(self, maximo):
+        """Timeout para uma chamada HTTP: o menor entre o máximo e o restante"""
+        return max(0.1, min(maximo, self.restante()))
+
+    def registrar(self, etapa, segundos, estourou=False):
+        self.etapas.append({'etapa': etapa, 'ms': round(segundos * 1000, 1), 'estourou': estourou})
+
+    def relatorio(self):
+        """Resumo para a resposta da API"""
+        return {
+            'orcamento_ms': round(self.total * 1000),
+            'gasto_ms': round(self.decorrido() * 1000, 1),
+            'etapas': self.etapas,
+            'etapas_estouradas': [etapa['etapa'] for etapa in self.etapas if etapa['estourou']]
+        }
+
+
+def executar_etapas(pool, tarefas, orcamento):
+    """
+    Executa as tarefas em paralelo, esperando no máximo o restante do orçamento
+
+    Args:
+        pool (ThreadPoolExecutor): Pool compartilhado
+        tarefas (dict): {nome da etapa: função sem argumentos}
+        orcamento (OrcamentoLatencia): Orçamento da cotação
+
+    Returns:
+        dict: {nome da etapa: resultado}; None para etapas que estouraram ou falharam
+    """
+    inicio = time.perf_counter()
+    futuros = {nome: pool.submit(_cronometrar, funcao) for nome, funcao in tarefas.items()}
+    wait(list(futuros.values()), timeout=orcamento.restante())
+
+    resultados = {}
+    for nome, futuro in futuros.items():
+        if not futuro.done():
+            orcamento.registrar(nome, time.perf_counter() - inicio, estourou=True)
+            print(f"[LATENCIA] ⚠️ Etapa '{nome}' estourou o orçamento de {orcamento.total:.1f}s")
+            resultados[nome] = None
+            continue
+        resultado, duracao, erro = futuro.result()
+        if erro is not None:
+            print(f"[LATENCIA] ❌ Erro na etapa '{nome}': {erro}")
+        resultados[nome] = resultado
+        orcamento.registrar(nome, duracao)
+    return resultados
+
+
+def _cronometrar(funcao):
+    inicio = time.perf_counter()
+    try:
+        return funcao(), time.perf_counter() - inicio, None
+    except Exception as e:
+        return None, time.perf_counter() - inicio, e
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Matriz de distâncias pré-calculadas entre municípios
+
+As cotações se concentram em poucas centenas de rotas. Em vez de consultar o
+OSRM a cada vez, as distâncias das rotas quentes são calculadas por um job
+offline (gerar_matriz_distancias.py) e gravadas em data/matriz_distancias.npz.
+
+Uma matriz densa 5.570 x 5.570 ocuparia centenas de MB; como poucas células
+são usadas, a matriz é guardada em formato esparso: chaves int64 ordenadas
+(codigo_ibge_origem * 10^7 + codigo_ibge_destino) e arrays float32 paralelos
+de distância (km) e duração (min). A busca é binária (np.searchsorted).
+"""
+import os
+
+import numpy as np
+
+CAMINHO_MATRIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'matriz_distancias.npz')
+
+# Códigos IBGE de município têm 7 dígitos
+_BASE_CHAVE = 10 ** 7
+
+RAIO_TERRA_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distância em linha reta (km) entre coordenadas; aceita escalares ou arrays
+
+    Returns:
+        float ou np.ndarray: Distância em km, elemento a elemento
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(valor, dtype=np.float64)) for valor in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(a))
+
+
+def chave_par(codigo_origem, codigo_destino):
+    return np.int64(codigo_origem) * _BASE_CHAVE + np.int64(codigo_destino)
+
+
+class MatrizDistancias:
+    """
+    Distâncias e durações por par de municípios (códigos IBGE)
+
+    Attributes:
+        chaves (np.ndarray): int64 ordenado, um por par origem/destino
+        distancias (np.ndarray): float32, km
+        duracoes (np.ndarray): float32, minutos
+    """
+
+    def __init__(self, chaves=None, distancias=None, duracoes=None):
+        chaves = np.asarray(chaves if chaves is not None else [], dtype=np.int64)
+        ordem = np.argsort(chaves, kind='stable')
+        self.chaves = chaves[ordem]
+        self.distancias = np.asarray(distancias if distancias is not None else [], dtype=np.float32)[ordem]
+        self.duracoes = np.asarray(duracoes if duracoes is not None else [], dtype=np.float32)[ordem]
+        self._consultas = 0
+        self._acertos = 0
+
+    @classmethod
+    def de_pares(cls, pares):
+        """Cria a matriz a partir de {(codigo_origem, codigo_destino): (distancia, duracao)}"""
+        chaves = [chave_par(origem, destino) for origem, destino in pares]
+        valores = list(pares.values())
+        return cls(chaves, [valor[0] for valor in valores], [valor[1] for valor in valores])
+
+    def pares(self):
+        """Retorna {(codigo_origem, codigo_destino): (distancia, duracao)}"""
+        return {
+            (int(chave // _BASE_CHAVE), int(chave % _BASE_CHAVE)): (float(distancia), float(duracao))
+            for chave, distancia, duracao in zip(self.chaves, self.distancias, self.duracoes)
+        }
+
+    def _posicao(self, chave):
+        posicao = np.searchsorted(self.chaves, chave)
+        if posicao < len(self.chaves) and self.chaves[posicao] == chave:
+            return posicao
+        return None
+
+    def buscar(self, codigo_origem, codigo_destino):
+        """
+        Distância do par (ou do par inverso, se só ele estiver na matriz)
+
+        Returns:
+            tuple: (distancia_km, duracao_min) ou None
+        """
+        self._consultas += 1
+        posicao = self._posicao(chave_par(codigo_origem, codigo_destino))
+        if posicao is None:
+            posicao = self._posicao(chave_par(codigo_destino, codigo_origem))
+        if posicao is None:
+            return None
+        self._acertos += 1
+        return float(self.distancias[posicao]), float(self.duracoes[posicao])
+
+    def salvar(self, caminho=CAMINHO_MATRIZ):
+        np.savez_compressed(caminho, chaves=self.chaves, distancias=self.distancias, duracoes=self.duracoes)
+        print(f"[MATRIZ] ✅ {len(self)} pares gravados em {caminho}")
+
+    @classmethod
+    def carregar(cls, caminho=CAMINHO_MATRIZ):
+        """Lê a matriz gravada; arquivo ausente ou inválido resulta numa matriz vazia"""
+        if not os.path.exists(caminho):
+            print(f"[MATRIZ] ⚠️ {os.path.basename(caminho)} não encontrado, matriz vazia")
+            return cls()
+        try:
+            with np.load(caminho) as arquivo:
+                matriz = cls(arquivo['chaves'], arquivo['distancias'], arquivo['duracoes'])
+            print(f"[MATRIZ] ✅ {len(matriz)} pares carregados de {os.path.basename(caminho)}")
+            return matriz
+        except Exception as e:
+            print(f"[MATRIZ] ❌ Erro ao carregar matriz de distâncias: {e}")
+            return cls()
+
+    def estatisticas(self):
+        return {
+            'pares': len(self),
+            'bytes': int(self.chaves.nbytes + self.distancias.nbytes + self.duracoes.nbytes),
+            'consultas': self._consultas,
+            'acertos': self._acertos
+        }
+
+    def __len__(self):
+        return len(self.chaves)
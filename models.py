@@ -4,6 +4,8 @@ import json
 import re
 from decimal import Decimal
 from werkzeug.security import generate_password_hash, check_password_hash
+from formulas import avaliar_expressao
+from condicoes import compilar_condicoes_texto
 
 db = SQLAlchemy()
 
@@ -655,9 +657,8 @@ class FormulaCalculoFrete(db.Model):
             if not self._verificar_condicoes(valores):
                 return None
             
-            # Aplicar fórmula
-            formula_segura = self._preparar_formula_segura(self.formula)
-            resultado = eval(formula_segura, {"__builtins__": {}}, valores)
+            # Aplicar fórmula (validada e compilada uma única vez)
+            resultado = avaliar_expressao(self.formula, valores, chave=('formula', self.id))
             
             return float(resultado) if resultado is not None else None
             
@@ -666,53 +667,8 @@ class FormulaCalculoFrete(db.Model):
             return None
     
     def _verificar_condicoes(self, valores):
-        """Verifica se as condições da fórmula são atendidas"""
-        try:
-            condicoes = self.get_condicoes()
-            
-            for campo, condicao in condicoes.items():
-                if campo not in valores:
-                    continue
-                    
-                valor = valores[campo]
-                
-                # Condições numéricas
-                if isinstance(condicao, dict):
-                    if 'min' in condicao and valor < condicao['min']:
-                        return False
-                    if 'max' in condicao and valor > condicao['max']:
-                        return False
-                    if 'igual' in condicao and valor != condicao['igual']:
-                        return False
-                
-                # Condições de string
-                elif isinstance(condicao, str):
-                    if str(valor).lower() != condicao.lower():
-                        return False
-                
-                # Condições de lista (contém)
-                elif isinstance(condicao, list):
-                    if str(valor) not in [str(c) for c in condicao]:
-                        return False
-            
-            return True
-            
-        except Exception:
-            return True  # Se erro, não bloquear
-    
-    def _preparar_formula_segura(self, formula):
-        """Prepara fórmula para execução segura"""
-        # Substituir funções matemáticas comuns
-        formula_segura = formula.replace('max(', 'max(').replace('min(', 'min(')
-        formula_segura = formula_segura.replace('abs(', 'abs(').replace('round(', 'round(')
-        
-        # Remover caracteres perigosos
-        caracteres_perigosos = ['import', 'exec', 'eval', '__', 'open', 'file']
-        for char in caracteres_perigosos:
-            if char in formula_segura:
-                raise ValueError(f"Fórmula contém código inseguro: {char}")
-        
-        return formula_segura
+        """Verifica se as condições da fórmula são atendidas (compiladas uma vez por texto)"""
+        return compilar_condicoes_texto(self.condicoes).atende(valores)
     
     def to_dict(self):
         return {
@@ -972,32 +928,8 @@ class MemoriaCalculoAgente(db.Model):
             return None
     
     def _verificar_condicoes(self, dados_calculo):
-        """Verifica se as condições para aplicar a memória são atendidas"""
-        try:
-            condicoes = self.get_condicoes_aplicacao()
-            
-            for campo, condicao in condicoes.items():
-                if campo not in dados_calculo:
-                    continue
-                    
-                valor = dados_calculo[campo]
-                
-                if isinstance(condicao, dict):
-                    if 'min' in condicao and valor < condicao['min']:
-                        return False
-                    if 'max' in condicao and valor > condicao['max']:
-                        return False
-                elif isinstance(condicao, str):
-                    if str(valor).upper() != condicao.upper():
-                        return False
-                elif isinstance(condicao, list):
-                    if str(valor).upper() not in [str(c).upper() for c in condicao]:
-                        return False
-            
-            return True
-            
-        except Exception:
-            return True  # Se erro, não bloquear
+        """Verifica se as condições para aplicar a memória são atendidas (compiladas uma vez por texto)"""
+        return compilar_condicoes_texto(self.condicoes_aplicacao).atende(dados_calculo)
     
     def _aplicar_calculo_faixa_peso(self, dados_calculo, config):
         """Aplica cálculo por faixa de peso (ex: REUNIDAS)"""
@@ -1040,8 +972,8 @@ class MemoriaCalculoAgente(db.Model):
             variaveis = dados_calculo.copy()
             variaveis.update(config.get('variaveis_adicionais', {}))
             
-            # Aplicar fórmula de forma segura
-            resultado = eval(formula, {"__builtins__": {}}, variaveis)
+            # Aplicar fórmula de forma segura (validada e compilada uma única vez)
+            resultado = avaliar_expressao(formula, variaveis, chave=('memoria', self.id))
             
             return {
                 'valor_base': float(resultado),
@@ -1066,4 +998,90 @@ class MemoriaCalculoAgente(db.Model):
             'prioridade': self.prioridade,
             'ativo': self.ativo,
             'criado_em': self.criado_em.strftime('%d/%m/%Y %H:%M:%S')
-        } 
\ No newline at end of file
+        }
+
+
+class VeiculoDedicado(db.Model):
+    """
+    Veículos do frete dedicado e sua capacidade
+    Veículos em que a carga não cabe ficam fora do ranking
+    """
+    __tablename__ = 'veiculos_dedicado'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), unique=True, nullable=False, index=True)  # Ex: "FIORINO", "CARRETA"
+    peso_max = db.Column(db.Float, nullable=True)  # kg
+    volume_max = db.Column(db.Float, nullable=True)  # m³
+    descricao = db.Column(db.String(200), nullable=True)
+    ordem = db.Column(db.Integer, default=0, nullable=False)
+    ativo = db.Column(db.Boolean, default=True, nullable=False, index=True)
+    
+    # Metadados
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<VeiculoDedicado {self.tipo}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'peso_max': self.peso_max,
+            'volume_max': self.volume_max,
+            'descricao': self.descricao,
+            'ordem': self.ordem,
+            'ativo': self.ativo
+        }
+
+class TarifaDedicado(db.Model):
+    """
+    Faixas de distância do frete dedicado por veículo
+    Custo = valor_fixo + valor_km * distância; faixa (distancia_min, distancia_max], sem máximo = em diante
+    """
+    __tablename__ = 'tarifas_dedicado'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo_veiculo = db.Column(db.String(50), nullable=False, index=True)
+    distancia_min = db.Column(db.Float, default=0, nullable=False)
+    distancia_max = db.Column(db.Float, nullable=True)
+    valor_fixo = db.Column(db.Float, nullable=True)
+    valor_km = db.Column(db.Float, nullable=True)
+    ativo = db.Column(db.Boolean, default=True, nullable=False, index=True)
+    
+    # Metadados
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<TarifaDedicado {self.tipo_veiculo} {self.distancia_min}-{self.distancia_max}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo_veiculo': self.tipo_veiculo,
+            'distancia_min': self.distancia_min,
+            'distancia_max': self.distancia_max,
+            'valor_fixo': self.valor_fixo,
+            'valor_km': self.valor_km,
+            'ativo': self.ativo
+        }
+    
+    @staticmethod
+    def criar_tabela_padrao():
+        """Cadastra veículos e faixas padrão do dedicado se as tabelas estiverem vazias"""
+        from tabela_dedicado import linhas_padrao, veiculos_padrao
+        try:
+            if not VeiculoDedicado.query.first():
+                for veiculo in veiculos_padrao():
+                    db.session.add(VeiculoDedicado(**veiculo))
+            if not TarifaDedicado.query.first():
+                for linha in linhas_padrao():
+                    db.session.add(TarifaDedicado(**linha))
+            db.session.commit()
+            print("[DEDICADO] ✅ Tabela padrão do dedicado verificada")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            print(f"[DEDICADO] ❌ Erro ao criar tabela padrão do dedicado: {e}")
+            return False
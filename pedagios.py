@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pedágio das rotas a partir de uma tabela de praças
+
+A tabela data/pracas_pedagio.csv traz, por praça, nome, rodovia, UF,
+coordenada e tarifa por eixo (valor da categoria 1; veículos comerciais
+pagam a tarifa vezes o número de eixos). A tabela distribuída cobre os
+principais corredores do Sul/Sudeste com valores de referência aproximados
+e deve ser atualizada com as tabelas publicadas pela ANTT e concessionárias;
+até lá o app2 só usa as praças com PEDAGIO_PRACAS=true e cota pela
+estimativa por km (estimativa_por_distancia).
+
+As praças ficam numa grade regular (células de 0,1 grau); para cada trecho
+da geometria da rota só as células próximas são consultadas e a distância
+praça-trecho é calculada de uma vez para todos os candidatos. Uma única
+passada pela geometria devolve o total de todas as categorias de veículo.
+"""
+import csv
+import math
+import os
+import threading
+
+import numpy as np
+
+from geometria import tolerancia_para_mapa
+
+CAMINHO_PRACAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pracas_pedagio.csv')
+
+# Eixos cobrados por categoria (utilitários leves pagam como categoria 1)
+EIXOS_VEICULO = {"FIORINO": 1, "VAN": 2, "3/4": 2, "TOCO": 2, "TRUCK": 3, "CARRETA": 5}
+
+# Praça considerada na rota quando está a até este raio da geometria
+RAIO_PRACA_KM = 2.0
+TAMANHO_CELULA = 0.1
+KM_POR_GRAU = 111.32
+
+# Estimativa usada sem geometria ou sem praças cadastradas na rota (e como
+# piso do total das praças, que só cobre os corredores da tabela)
+VALOR_POR_KM_ESTIMADO = 0.05
+
+
+def estimativa_por_distancia(distancia_km, motivo=None):
+    """Pedágio estimado por km rodado (mesmo valor para todas as categorias)"""
+    valor = round(float(distancia_km or 0) * VALOR_POR_KM_ESTIMADO, 2)
+    estimativa = {
+        'fonte': 'Estimativa baseada na distância',
+        'valor_por_km': VALOR_POR_KM_ESTIMADO,
+        'pracas': [],
+        'por_veiculo': {veiculo: valor for veiculo in EIXOS_VEICULO}
+    }
+    if motivo:
+        estimativa['motivo'] = motivo
+    return estimativa
+
+
+def completar_com_estimativa(pedagio, distancia_km):
+    """
+    Pedágio das praças com a estimativa por km como piso, por categoria
+
+    A tabela só cobre alguns corredores: numa rota que sai deles as praças
+    não cadastradas ficam fora da soma. Cada categoria paga o maior valor
+    entre a soma das praças e a estimativa por distância; as categorias em
+    que a estimativa prevaleceu vão em 'veiculos_estimados'.
+    """
+    estimativa = estimativa_por_distancia(distancia_km)['por_veiculo']
+    por_veiculo = {veiculo: max(valor, estimativa.get(veiculo, 0)) for veiculo, valor in pedagio['por_veiculo'].items()}
+    estimados = [veiculo for veiculo, valor in pedagio['por_veiculo'].items() if por_veiculo[veiculo] > valor]
+    resultado = dict(pedagio, por_veiculo=por_veiculo)
+    if estimados:
+        resultado.update({
+            'fonte': 'Praças de pedágio na rota + estimativa baseada na distância',
+            'valor_por_km': VALOR_POR_KM_ESTIMADO,
+            'veiculos_estimados': estimados
+        })
+    return resultado
+
+
+class MotorPedagio:
+    """
+    Índice espacial das praças de pedágio
+
+    Attributes:
+        pracas (list): [{nome, rodovia, uf, lat, lon, tarifa_eixo}]
+        grade (dict): {(linha, coluna): [índices das praças na célula]}
+    """
+
+    def __init__(self, caminho=CAMINHO_PRACAS, raio_km=RAIO_PRACA_KM, tamanho_celula=TAMANHO_CELULA):
+        self.caminho = caminho
+        self.raio_km = raio_km
+        self.tamanho_celula = tamanho_celula
+        self.pracas = []
+        self.grade = {}
+        self.carregado = False
+        self._lock = threading.Lock()
+        self._latitudes = np.zeros(0)
+        self._longitudes = np.zeros(0)
+        self._calculos = 0
+
+    def carregar(self):
+        """Lê o CSV uma única vez (chamado sob demanda no primeiro cálculo)"""
+        if self.carregado:
+            return self
+        with self._lock:
+            if self.carregado:
+                return self
+            try:
+                with open(self.caminho, encoding='utf-8') as arquivo:
+                    for linha in csv.DictReader(arquivo):
+                        praca = {
+                            'nome': linha['nome'],
+                            'rodovia': linha.get('rodovia', ''),
+                            'uf': str(linha.get('uf', '')).strip().upper(),
+                            'lat': float(linha['latitude']),
+                            'lon': float(linha['longitude']),
+                            'tarifa_eixo': float(linha['tarifa_eixo'])
+                        }
+                        self.grade.setdefault(self._celula(praca['lat'], praca['lon']), []).append(len(self.pracas))
+                        self.pracas.append(praca)
+                self._latitudes = np.array([praca['lat'] for praca in self.pracas], dtype=np.float64)
+                self._longitudes = np.array([praca['lon'] for praca in self.pracas], dtype=np.float64)
+                print(f"[PEDAGIO] ✅ {len(self.pracas)} praças carregadas de {os.path.basename(self.caminho)}")
+            except Exception as e:
+                print(f"[PEDAGIO] ❌ Erro ao carregar tabela de praças: {e}")
+            self.carregado = True
+        return self
+
+    def _celula(self, lat, lon):
+        return int(math.floor(lat / self.tamanho_celula)), int(math.floor(lon / self.tamanho_celula))
+
+    def _candidatas(self, coordenadas, raio_graus):
+        """Pares (praça, trecho) cujas células cobrem o retângulo de cada trecho"""
+        indices_praca, indices_trecho = [], []
+        for trecho in range(len(coordenadas) - 1):
+            (lat_a, lon_a), (lat_b, lon_b) = coordenadas[trecho], coordenadas[trecho + 1]
+            linha_min, coluna_min = self._celula(min(lat_a, lat_b) - raio_graus, min(lon_a, lon_b) - raio_graus)
+            linha_max, coluna_max = self._celula(max(lat_a, lat_b) + raio_graus, max(lon_a, lon_b) + raio_graus)
+            if (linha_max - linha_min + 1) * (coluna_max - coluna_min + 1) > len(self.grade):
+                # Trecho longo: percorrer as células ocupadas custa menos que o retângulo
+                celulas = [
+                    praca for (linha, coluna), pracas in self.grade.items()
+                    if linha_min <= linha <= linha_max and coluna_min <= coluna <= coluna_max
+                    for praca in pracas
+                ]
+            else:
+                celulas = [
+                    praca for linha in range(linha_min, linha_max + 1) for coluna in range(coluna_min, coluna_max + 1)
+                    for praca in self.grade.get((linha, coluna), ())
+                ]
+            indices_praca.extend(celulas)
+            indices_trecho.extend([trecho] * len(celulas))
+        return np.array(indices_praca, dtype=np.int64), np.array(indices_trecho, dtype=np.int64)
+
+    def pracas_na_rota(self, pontos, raio_km=None):
+        """
+        Praças a até raio_km da geometria, na ordem em que aparecem na rota
+
+        A tolerância da simplificação (Douglas-Peucker) é somada ao raio, pois
+        a geometria recebida pode se afastar da estrada até esse valor.
+        """
+        self.carregar()
+        coordenadas = np.asarray(pontos, dtype=np.float64)
+        if not self.pracas or len(coordenadas) < 2:
+            return []
+        raio_km = (raio_km or self.raio_km) + tolerancia_para_mapa(coordenadas) * KM_POR_GRAU
+        indices_praca, indices_trecho = self._candidatas(coordenadas, raio_km / KM_POR_GRAU)
+        if not len(indices_praca):
+            return []
+
+        # Distância praça-trecho numa projeção local em km (todos os candidatos de uma vez)
+        escala_lon = KM_POR_GRAU * np.cos(np.radians(self._latitudes[indices_praca]))
+        a, b = coordenadas[indices_trecho], coordenadas[indices_trecho + 1]
+        px = (self._longitudes[indices_praca] - a[:, 1]) * escala_lon
+        py = (self._latitudes[indices_praca] - a[:, 0]) * KM_POR_GRAU
+        sx = (b[:, 1] - a[:, 1]) * escala_lon
+        sy = (b[:, 0] - a[:, 0]) * KM_POR_GRAU
+        comprimento = sx ** 2 + sy ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(comprimento > 0, np.clip((px * sx + py * sy) / comprimento, 0, 1), 0)
+        distancias = np.hypot(px - t * sx, py - t * sy)
+
+        # Cada praça conta uma vez, na posição (trecho, fração) mais próxima
+        encontradas = {}
+        for praca, trecho, fracao, distancia in zip(indices_praca, indices_trecho, t, distancias):
+            if distancia <= raio_km and (praca not in encontradas or distancia < encontradas[praca][2]):
+                encontradas[praca] = (trecho, fracao, distancia)
+        return [int(praca) for praca, _ in sorted(encontradas.items(), key=lambda item: item[1][:2])]
+
+    def calcular(self, pontos):
+        """
+        Pedágio de todas as categorias de veículo para a geometria da rota
+
+        Args:
+            pontos (list): [[lat, lon], ...]
+
+        Returns:
+            dict: {fonte, pracas, tarifa_eixos, por_veiculo} ou None se a tabela não carregou
+        """
+        self.carregar()
+        if not self.pracas:
+            return None
+        self._calculos += 1
+        pracas = [self.pracas[indice] for indice in self.pracas_na_rota(pontos)]
+        tarifa_eixos = sum(praca['tarifa_eixo'] for praca in pracas)
+        return {
+            'fonte': 'Praças de pedágio na rota',
+            'pracas': [
+                {'nome': praca['nome'], 'rodovia': praca['rodovia'], 'uf': praca['uf'], 'tarifa_eixo': praca['tarifa_eixo']}
+                for praca in pracas
+            ],
+            'tarifa_eixos': round(tarifa_eixos, 2),
+            'por_veiculo': {veiculo: round(tarifa_eixos * eixos, 2) for veiculo, eixos in EIXOS_VEICULO.items()}
+        }
+
+    def estatisticas(self):
+        return {
+            'pracas': len(self.pracas),
+            'celulas': len(self.grade),
+            'carregado': self.carregado,
+            'calculos': self._calculos
+        }
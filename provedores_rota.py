@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Provedores de roteamento (OSRM, OpenRouteService, Haversine) com circuit breaker
+
+Cada provedor é configurado por URL, então o OSRM público pode ser trocado
+por um container local ou por um stub em processo sem mudar o código da
+cotação. A CadeiaProvedores tenta os provedores na ordem configurada; um
+provedor que falha repetidamente (timeout, HTTP 5xx/429, chave recusada) tem
+o circuito aberto e deixa de ser chamado durante o período de espera, de
+modo que uma indisponibilidade não custa um timeout a cada cotação.
+
+Só respostas definitivas sem rota (OSRM HTTP 400 "NoRoute"/"NoSegment",
+erros 2009/2010 do OpenRouteService) não contam como falha; qualquer outro
+status de erro, inclusive 4xx, conta para o circuit breaker.
+"""
+import threading
+import time
+
+import polyline
+
+from geometria import codificar_rota
+from matriz_distancias import haversine_km
+
+# Status HTTP que indicam problema do provedor (e não da consulta)
+STATUS_FALHA = {401, 403, 429}
+
+# Códigos de erro que significam "não há rota" (resposta definitiva)
+CODIGOS_SEM_ROTA_OSRM = {'NoRoute', 'NoSegment'}
+# 2009: rota não encontrada; 2010: ponto fora da malha viária
+CODIGOS_SEM_ROTA_OPENROUTE = {2009, 2010}
+
+
+class FalhaProvedor(Exception):
+    """Provedor indisponível ou com erro (conta para o circuit breaker)"""
+
+
+class CircuitBreaker:
+    """
+    Circuito fechado -> aberto após N falhas seguidas -> meio-aberto após a espera
+
+    No estado meio-aberto uma única chamada de teste é liberada: sucesso
+    fecha o circuito, falha reabre por mais um período de espera.
+    """
+
+    def __init__(self, falhas_para_abrir=3, espera=60):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.espera = espera
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto_em = None
+        self._teste_em_andamento = False
+        self.aberturas = 0
+
+    def estado(self):
+        if self._aberto_em is None:
+            return 'fechado'
+        if time.time() - self._aberto_em >= self.espera:
+            return 'meio_aberto'
+        return 'aberto'
+
+    def permitir(self):
+        """Retorna True se a chamada pode ser feita agora"""
+        with self._lock:
+            estado = self.estado()
+            if estado == 'fechado':
+                return True
+            if estado == 'meio_aberto' and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._aberto_em = None
+            self._teste_em_andamento = False
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            if self._teste_em_andamento or self._falhas >= self.falhas_para_abrir:
+                if self._aberto_em is None or self._teste_em_andamento:
+                    self.aberturas += 1
+                self._aberto_em = time.time()
+            self._teste_em_andamento = False
+
+    def estatisticas(self):
+        return {
+            'estado': self.estado(),
+            'falhas_seguidas': self._falhas,
+            'aberturas': self.aberturas,
+            'espera': self.espera
+        }
+
+
+class ProvedorRota:
+    """Interface dos provedores: consultar() retorna a rota, None (sem rota) ou levanta FalhaProvedor"""
+
+    nome = 'base'
+
+    def consultar(self, origem, destino, timeout=10):
+        raise NotImplementedError
+
+    def _rota(self, distancia_km, duracao_min, pontos):
+        """Monta o resultado padrão com a geometria simplificada e codificada"""
+        rota_polyline, quantidade = codificar_rota(pontos) if len(pontos) >= 2 else (None, 0)
+        return {
+            "distancia": distancia_km,
+            "duracao": duracao_min,
+            "rota_pontos": [],
+            "rota_polyline": rota_polyline,
+            "rota_pontos_simplificados": quantidade,
+            "provider": self.nome
+        }
+
+    def _get(self, sessao, url, timeout, **kwargs):
+        try:
+            response = sessao.get(url, timeout=timeout, **kwargs)
+        except Exception as e:
+            raise FalhaProvedor(f"{self.nome}: {e}")
+        if response.status_code >= 500 or response.status_code in STATUS_FALHA:
+            raise FalhaProvedor(f"{self.nome}: HTTP {response.status_code}")
+        return response
+
+    def _corpo(self, response):
+        """Corpo JSON da resposta de erro ({} se não for um objeto JSON)"""
+        try:
+            corpo = response.json()
+        except Exception:
+            return {}
+        return corpo if isinstance(corpo, dict) else {}
+
+
+class ProvedorOSRM(ProvedorRota):
+    """OSRM (público, container local ou qualquer serviço com a mesma API)"""
+
+    nome = 'OSRM'
+
+    def __init__(self, sessao, url='http://router.project-osrm.org'):
+        self.sessao = sessao
+        self.url = url.rstrip('/')
+
+    def consultar(self, origem, destino, timeout=10):
+        url = f"{self.url}/route/v1/driving/{origem[1]},{origem[0]};{destino[1]},{destino[0]}?overview=full&geometries=polyline"
+        response = self._get(self.sessao, url, timeout)
+        if response.status_code != 200:
+            if response.status_code == 400 and self._corpo(response).get('code') in CODIGOS_SEM_ROTA_OSRM:
+                return None
+            raise FalhaProvedor(f"{self.nome}: HTTP {response.status_code}")
+        data = response.json()
+        if not data.get('routes'):
+            return None
+        route = data['routes'][0]
+        pontos = polyline.decode(route['geometry'], 5) if route.get('geometry') else [origem[:2], destino[:2]]
+        return self._rota(route['distance'] / 1000, route['duration'] / 60, pontos)
+
+
+class ProvedorOpenRoute(ProvedorRota):
+    """OpenRouteService (directions/driving-car); exige chave de API"""
+
+    nome = 'OpenRoute'
+
+    def __init__(self, sessao, api_key, url='https://api.openrouteservice.org'):
+        self.sessao = sessao
+        self.api_key = api_key
+        self.url = url.rstrip('/')
+
+    def consultar(self, origem, destino, timeout=10):
+        response = self._get(
+            self.sessao, f"{self.url}/v2/directions/driving-car", timeout,
+            params={'api_key': self.api_key, 'start': f"{origem[1]},{origem[0]}", 'end': f"{destino[1]},{destino[0]}"}
+        )
+        if response.status_code != 200:
+            erro = self._corpo(response).get('error')
+            if isinstance(erro, dict) and erro.get('code') in CODIGOS_SEM_ROTA_OPENROUTE:
+                return None
+            raise FalhaProvedor(f"{self.nome}: HTTP {response.status_code}")
+        features = response.json().get('features') or []
+        if not features:
+            return None
+        resumo = features[0].get('properties', {}).get('summary', {})
+        if 'distance' not in resumo:
+            return None
+        # GeoJSON traz [lon, lat]
+        coordenadas = (features[0].get('geometry') or {}).get('coordinates') or []
+        pontos = [[lat, lon] for lon, lat in (coordenada[:2] for coordenada in coordenadas)] or [origem[:2], destino[:2]]
+        return self._rota(resumo['distance'] / 1000, resumo.get('duration', 0) / 60, pontos)
+
+
+class ProvedorHaversine(ProvedorRota):
+    """Linha reta x fator de desvio (sem rede; nunca falha)"""
+
+    nome = 'Distância Reta'
+
+    def __init__(self, fator_desvio=1.0, minutos_por_km=1.5):
+        self.fator_desvio = fator_desvio
+        self.minutos_por_km = minutos_por_km
+
+    def consultar(self, origem, destino, timeout=10):
+        distancia = float(haversine_km(origem[0], origem[1], destino[0], destino[1])) * self.fator_desvio
+        return self._rota(distancia, distancia * self.minutos_por_km, [origem[:2], destino[:2]])
+
+
+class CadeiaProvedores:
+    """Tenta os provedores em ordem, pulando os que estão com o circuito aberto"""
+
+    def __init__(self, provedores, falhas_para_abrir=3, espera=60):
+        self.provedores = list(provedores)
+        self.circuitos = {provedor.nome: CircuitBreaker(falhas_para_abrir, espera) for provedor in self.provedores}
+        self._pulos = {provedor.nome: 0 for provedor in self.provedores}
+
+    def calcular(self, origem, destino, timeout=10):
+        """
+        Returns:
+            tuple: (rota ou None, houve_falha) - houve_falha indica que algum
+            provedor falhou ou foi pulado, ou seja, a ausência de rota pode
+            ser temporária
+        """
+        houve_falha = False
+        for provedor in self.provedores:
+            circuito = self.circuitos[provedor.nome]
+            if not circuito.permitir():
+                self._pulos[provedor.nome] += 1
+                houve_falha = True
+                continue
+            try:
+                rota = provedor.consultar(origem, destino, timeout)
+            except Exception as e:
+                print(f"[ROTA] ⚠️ {e if isinstance(e, FalhaProvedor) else f'{provedor.nome}: {e}'}")
+                circuito.falha()
+                if circuito.estado() != 'fechado':
+                    print(f"[ROTA] 🔌 Circuito de {provedor.nome} aberto por {circuito.espera}s")
+                houve_falha = True
+                continue
+            circuito.sucesso()
+            if rota:
+                return rota, houve_falha
+        return None, houve_falha
+
+    def estatisticas(self):
+        return {
+            provedor.nome: dict(self.circuitos[provedor.nome].estatisticas(), pulos=self._pulos[provedor.nome])
+            for provedor in self.provedores
+        }
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro em memória dos agentes e das suas regras de cálculo
+
+Agentes (AgenteTransportadora), memórias de cálculo (MemoriaCalculoAgente),
+configurações de agente (ConfiguracaoAgente) e fórmulas (FormulaCalculoFrete)
+mudam raramente, mas eram consultados no banco a cada cotação e a cada linha
+da base. O registro carrega tudo de uma vez (memórias e agentes via
+selectinload/joinedload), guarda dicionários somente-leitura com o JSON já
+interpretado e oferece busca O(1) por nome de agente.
+
+Como o cache de tarifas, o registro é por processo, tem TTL e é invalidado
+pelas rotas do painel admin que alteram essas tabelas.
+"""
+import time
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from cache_recarregavel import CacheRecarregavel
+from condicoes import IndiceCondicoes, compilar_condicoes_texto
+from models import AgenteTransportadora, ConfiguracaoAgente, FormulaCalculoFrete
+
+
+def _memoria_para_dict(memoria):
+    return {
+        'id': memoria.id,
+        'agente_id': memoria.agente_id,
+        'tipo_memoria': memoria.tipo_memoria,
+        'nome_memoria': memoria.nome_memoria,
+        'condicoes': memoria.get_condicoes_aplicacao(),
+        'condicoes_compiladas': compilar_condicoes_texto(memoria.condicoes_aplicacao),
+        'configuracao': memoria.get_configuracao_memoria(),
+        'prioridade': memoria.prioridade or 0,
+        'ativo': memoria.ativo
+    }
+
+
+def _agente_para_dict(agente):
+    memorias = [_memoria_para_dict(memoria) for memoria in agente.memorias_calculo if memoria.ativo]
+    memorias.sort(key=lambda memoria: (-memoria['prioridade'], memoria['id']))
+    return {
+        'id': agente.id,
+        'nome': agente.nome,
+        'nome_normalizado': agente.nome_normalizado,
+        'tipo_agente': agente.tipo_agente,
+        'ativo': agente.ativo,
+        'logica_calculo': agente.logica_calculo,
+        'gris_percentual': agente.gris_percentual or 0.0,
+        'gris_minimo': agente.gris_minimo or 0.0,
+        'calcula_seguro': agente.calcula_seguro,
+        'calcula_pedagio': agente.calcula_pedagio,
+        'pedagio_por_bloco': agente.pedagio_por_bloco or 0.0,
+        'parametros': agente.get_parametros_calculo(),
+        'descricao': agente.descricao_logica,
+        'memorias': memorias,
+        'indice_memorias': IndiceCondicoes([
+            (memoria['prioridade'], memoria['id'], memoria['condicoes_compiladas'], memoria)
+            for memoria in memorias
+        ])
+    }
+
+
+def _configuracao_para_dict(config):
+    return {
+        'id': config.id,
+        'agente_id': config.agente_id,
+        'agente_nome': config.agente.nome if config.agente else None,
+        'tipo_calculo_id': config.tipo_calculo_id,
+        'valores_customizados': config.get_valores_customizados(),
+        'formulas_customizadas': config.get_formulas_customizadas()
+    }
+
+
+def _formula_para_dict(formula):
+    return {
+        'id': formula.id,
+        'nome': formula.nome,
+        'tipo_calculo_id': formula.tipo_calculo_id,
+        'formula': formula.formula,
+        'condicoes': formula.get_condicoes(),
+        'condicoes_compiladas': compilar_condicoes_texto(formula.condicoes),
+        'valores_padrao': formula.get_valores_padrao(),
+        'prioridade': formula.prioridade or 0,
+        'ativo': formula.ativo
+    }
+
+
+class RegistroAgentes:
+    """
+    Fotografia somente-leitura das regras de cálculo dos agentes
+
+    Attributes:
+        agentes (dict): {nome: agente}, apenas agentes ativos, cada um com a
+            lista 'memorias' (ativas, em ordem de prioridade decrescente) e o
+            'indice_memorias' (IndiceCondicoes) para escolher pelas condições
+        configuracoes (dict): {nome do agente: [configurações ativas]}
+        formulas (dict): {id: fórmula}
+        indice_formulas (dict): {tipo_calculo_id: IndiceCondicoes das fórmulas ativas}
+        geracao (int): Geração do registro no momento da carga
+        carregado_em (float): Timestamp (time.time) da carga
+    """
+
+    def __init__(self, agentes, configuracoes, formulas, geracao, carregado_em):
+        self.agentes = {agente['nome']: agente for agente in agentes}
+        self.agentes_por_id = {agente['id']: agente for agente in agentes}
+        self.configuracoes = {}
+        for config in configuracoes:
+            self.configuracoes.setdefault(config['agente_nome'], []).append(config)
+        self.formulas = {formula['id']: formula for formula in formulas}
+        por_tipo = {}
+        for formula in formulas:
+            if formula['ativo']:
+                por_tipo.setdefault(formula['tipo_calculo_id'], []).append(
+                    (formula['prioridade'], formula['id'], formula['condicoes_compiladas'], formula)
+                )
+        self.indice_formulas = {tipo: IndiceCondicoes(regras) for tipo, regras in por_tipo.items()}
+        self.geracao = geracao
+        self.carregado_em = carregado_em
+
+    def agente(self, nome):
+        """Retorna o agente ativo pelo nome (ou None)"""
+        return self.agentes.get(nome)
+
+    def memorias(self, nome):
+        """Retorna as memórias ativas do agente em ordem de prioridade"""
+        agente = self.agentes.get(nome)
+        return agente['memorias'] if agente else []
+
+    def memorias_aplicaveis(self, nome, dados):
+        """Retorna as memórias do agente cujas condições os dados atendem, por prioridade"""
+        agente = self.agentes.get(nome)
+        return agente['indice_memorias'].aplicaveis(dados) if agente else []
+
+    def memoria_aplicavel(self, nome, dados):
+        """Retorna a memória aplicável de maior prioridade (ou None)"""
+        agente = self.agentes.get(nome)
+        return agente['indice_memorias'].primeira(dados) if agente else None
+
+    def configuracao(self, nome):
+        """Retorna a primeira configuração ativa do agente (ou None)"""
+        configs = self.configuracoes.get(nome)
+        return configs[0] if configs else None
+
+    def formula(self, formula_id):
+        """Retorna a fórmula pelo id (ou None)"""
+        return self.formulas.get(formula_id)
+
+    def formulas_aplicaveis(self, tipo_calculo_id, valores):
+        """Retorna as fórmulas ativas do tipo cujas condições os valores atendem, por prioridade"""
+        indice = self.indice_formulas.get(tipo_calculo_id)
+        return indice.aplicaveis(valores) if indice else []
+
+    def __len__(self):
+        return len(self.agentes)
+
+    def __repr__(self):
+        return f'<RegistroAgentes geracao={self.geracao} agentes={len(self)} formulas={len(self.formulas)}>'
+
+
+def carregar_registro_do_banco(geracao):
+    """Consulta agentes, memórias, configurações e fórmulas em poucas queries"""
+    agentes = AgenteTransportadora.query.options(
+        selectinload(AgenteTransportadora.memorias_calculo)
+    ).filter(AgenteTransportadora.ativo == True).all()
+
+    configuracoes = ConfiguracaoAgente.query.options(
+        joinedload(ConfiguracaoAgente.agente)
+    ).filter(ConfiguracaoAgente.ativo == True).all()
+
+    formulas = FormulaCalculoFrete.query.all()
+
+    return RegistroAgentes(
+        [_agente_para_dict(agente) for agente in agentes],
+        [_configuracao_para_dict(config) for config in configuracoes],
+        [_formula_para_dict(formula) for formula in formulas],
+        geracao,
+        time.time()
+    )
+
+
+class CacheRegistroAgentes(CacheRecarregavel):
+    """Mantém o RegistroAgentes do processo (mesmo funcionamento do CacheTarifas)"""
+
+    def __init__(self, carregador=carregar_registro_do_banco, ttl=300, janela_obsoleto=30):
+        super().__init__(carregador, 'REGISTRO', 'registro de agentes', ttl, janela_obsoleto)
+
+    def _descrever(self, registro):
+        return f"{len(registro)} agentes e {len(registro.formulas)} fórmulas carregados"
+
+    def estatisticas(self):
+        """Retorna métricas do registro para monitoramento"""
+        registro = self._valor
+        estatisticas = super().estatisticas()
+        estatisticas.update({
+            'agentes': len(registro) if registro else 0,
+            'formulas': len(registro.formulas) if registro else 0
+        })
+        return estatisticas
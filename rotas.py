@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Busca de rotas combinadas sobre o grafo de bases
+
+As bases da base_unificada (códigos de "Base Origem"/"Base Destino") são os
+nós do grafo e cada linha de transferência é uma aresta com preço entre duas
+bases. Os agentes ligam as cidades às bases:
+
+    cidade de origem --(agente de coleta)--> base A
+    base A --(transferência)--> base B
+    base B --(agente de entrega)--> cidade de destino
+
+Para um peso, a busca devolve as k combinações mais baratas. Só entram
+transferências que partem de uma base com agente de coleta e chegam a uma
+base com agente de entrega. As k melhores somas são extraídas com um heap
+sobre as listas ordenadas de cada perna, então o custo da busca depende de k
+e do número de pares de bases conectados, não do produto de todas as linhas.
+
+A busca é um branch-and-bound: o custo mínimo de cada perna é um limite
+inferior para todas as combinações que a usam, e combinações cujo limite não
+bate a K-ésima melhor rota já conhecida (TopK) são descartadas sem avaliação.
+"""
+import heapq
+import math
+import threading
+
+import numpy as np
+
+from tarifas import calcular_custos_linhas, custos_por_linha, normalizar_texto
+
+
+class GrafoBases:
+    """
+    Arestas de transferência agrupadas por base
+
+    Attributes:
+        arestas (dict): {base_origem: {base_destino: array de linha_id}}, com
+            os códigos de base normalizados (normalizar_texto)
+    """
+
+    def __init__(self, tabela, linhas_transferencia):
+        arestas = {}
+        for linha_id in linhas_transferencia:
+            base_origem = normalizar_texto(tabela.base_origem[linha_id])
+            base_destino = normalizar_texto(tabela.base_destino[linha_id])
+            if not base_origem or not base_destino:
+                continue
+            arestas.setdefault(base_origem, {}).setdefault(base_destino, []).append(int(linha_id))
+
+        self.arestas = {
+            base_origem: {base_destino: np.array(linhas, dtype=np.int64) for base_destino, linhas in destinos.items()}
+            for base_origem, destinos in arestas.items()
+        }
+        self.total_arestas = sum(len(linhas) for destinos in self.arestas.values() for linhas in destinos.values())
+
+    def __len__(self):
+        return self.total_arestas
+
+    def saidas(self, base):
+        """Retorna {base_destino: linhas} das transferências que partem da base"""
+        return self.arestas.get(base, {})
+
+
+class TopK:
+    """
+    Mantém as K rotas mais baratas vistas até agora
+
+    Heap de máximo limitado a K itens: o topo é a K-ésima melhor rota, cujo
+    custo (limite) serve de corte para a poda. Em caso de empate, a rota
+    adicionada primeiro é mantida.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        self._sequencia = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def limite(self):
+        """Custo que uma nova rota precisa bater para entrar (inf enquanto não há K rotas)"""
+        if len(self._heap) < self.k:
+            return math.inf
+        return -self._heap[0][0]
+
+    def adicionar(self, custo, item):
+        """Adiciona a rota se ela estiver entre as K melhores; retorna True se entrou"""
+        if self.k <= 0 or custo >= self.limite():
+            return False
+        self._sequencia += 1
+        entrada = (-custo, -self._sequencia, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entrada)
+        else:
+            heapq.heapreplace(self._heap, entrada)
+        return True
+
+    def ordenados(self):
+        """Rotas em ordem crescente de custo (empates na ordem de chegada)"""
+        return [item for _, _, item in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
+
+
+# Contadores acumulados da busca no processo (expostos no /health)
+_lock_estatisticas = threading.Lock()
+_estatisticas = {'buscas': 0, 'combinacoes_avaliadas': 0, 'combinacoes_podadas': 0}
+
+
+def estatisticas_busca():
+    """Retorna os contadores acumulados da busca de rotas combinadas"""
+    with _lock_estatisticas:
+        return dict(_estatisticas)
+
+
+def grafo_do_snapshot(snapshot):
+    """Retorna o grafo de bases do snapshot, montando-o na primeira chamada"""
+    if snapshot.grafo_bases is None:
+        snapshot.grafo_bases = GrafoBases(snapshot.tabela, snapshot.indice.linhas_tipo('Transferência'))
+    return snapshot.grafo_bases
+
+
+def _pernas_por_base(custos, bases, k):
+    """
+    Agrupa as linhas de uma perna pela base, mantendo as k mais baratas
+
+    Returns:
+        dict: {base: (totais ordenados, linhas na mesma ordem, quantidade de
+            linhas válidas da base antes do corte em k)}
+    """
+    validos = custos['custo_base'] > 0
+    ordem = np.argsort(custos['total'][validos], kind='stable')
+    totais = custos['total'][validos][ordem]
+    linhas = custos['linhas'][validos][ordem]
+    chaves = [bases[i] for i in np.flatnonzero(validos)[ordem]]
+
+    grupos = {}
+    for total, linha_id, base in zip(totais, linhas, chaves):
+        if not base:
+            continue
+        totais_base, linhas_base, quantidade = grupos.get(base, ([], [], 0))
+        if len(totais_base) < k:
+            totais_base.append(float(total))
+            linhas_base.append(int(linha_id))
+        grupos[base] = (totais_base, linhas_base, quantidade + 1)
+    return grupos
+
+
+def _k_melhores(grupos, k, limite=math.inf):
+    """
+    Extrai as k menores somas entre grupos de pernas ordenadas
+
+    Cada grupo entra no heap pela soma dos custos mínimos das suas pernas,
+    que é o limite inferior de todas as suas combinações. A extração para
+    quando o próximo limite não bate a k-ésima melhor soma ou o corte externo.
+
+    Args:
+        grupos (list): [(chave, [(totais, linhas, quantidade), ...])], uma
+            entrada por perna, com totais em ordem crescente
+        k (int): Quantidade de combinações desejadas
+        limite (float): Corte externo (K-ésima melhor rota já conhecida)
+
+    Returns:
+        tuple: ([(total, chave, (linha_id, ...))] em ordem crescente de total,
+            combinações avaliadas, combinações podadas)
+    """
+    melhores = TopK(k)
+    combinacoes = 0
+    heap = []
+    for posicao, (chave, pernas) in enumerate(grupos):
+        combinacoes += math.prod(quantidade for _, _, quantidade in pernas)
+        if all(totais for totais, _, _ in pernas):
+            indices = (0,) * len(pernas)
+            heap.append((sum(p[0][0] for p in pernas), posicao, indices))
+    heapq.heapify(heap)
+
+    visitados = {(posicao, indices) for _, posicao, indices in heap}
+    avaliadas = 0
+    while heap and heap[0][0] < min(limite, melhores.limite()):
+        total, posicao, indices = heapq.heappop(heap)
+        chave, pernas = grupos[posicao]
+        avaliadas += 1
+        melhores.adicionar(total, (total, chave, tuple(pernas[i][1][j] for i, j in enumerate(indices))))
+
+        for perna in range(len(pernas)):
+            proximo = indices[:perna] + (indices[perna] + 1,) + indices[perna + 1:]
+            if proximo[perna] >= len(pernas[perna][0]) or (posicao, proximo) in visitados:
+                continue
+            visitados.add((posicao, proximo))
+            novo_total = sum(pernas[i][0][j] for i, j in enumerate(proximo))
+            heapq.heappush(heap, (novo_total, posicao, proximo))
+
+    return melhores.ordenados(), avaliadas, combinacoes - avaliadas
+
+
+def buscar_rotas_combinadas(snapshot, peso, valor_nf, linhas_coleta=(), linhas_entrega=(),
+                            linhas_saida_origem=(), linhas_chegada_destino=(), k=10, limite=math.inf):
+    """
+    Busca as k rotas combinadas mais baratas no grafo de bases
+
+    Args:
+        snapshot (SnapshotTarifas): Snapshot atual da base
+        peso (float): Peso cubado em kg
+        valor_nf (float): Valor da nota fiscal
+        linhas_coleta (array): Agentes de coleta na origem (base = Base Origem)
+        linhas_entrega (array): Agentes de entrega no destino (base = Base Origem)
+        linhas_saida_origem (array): Transferências que saem da cidade de
+            origem, usadas para rotas sem agente de coleta
+        linhas_chegada_destino (array): Transferências que chegam à cidade de
+            destino, usadas para rotas sem agente de entrega
+        k (int): Quantidade máxima de rotas
+        limite (float): Custo da K-ésima melhor rota já conhecida (ex: rotas
+            diretas); combinações que não o batem são podadas
+
+    Returns:
+        dict: {
+            'completas': [{'coleta', 'transferencia', 'entrega', 'total'}],
+            'sem_coleta': [{'coleta': None, 'transferencia', 'entrega', 'total'}],
+            'sem_entrega': [{'coleta', 'transferencia', 'entrega': None, 'total'}],
+            'custos': {linha_id: composição} das linhas usadas nas rotas,
+            'avaliadas': combinações avaliadas,
+            'podadas': combinações descartadas pelo limite inferior
+        }
+    """
+    tabela = snapshot.tabela
+    grafo = grafo_do_snapshot(snapshot)
+    resultado = {'completas': [], 'sem_coleta': [], 'sem_entrega': [], 'custos': {}, 'avaliadas': 0, 'podadas': 0}
+    linhas_usadas = set()
+
+    # Corte compartilhado entre as modalidades: K melhores totais encontrados
+    corte = TopK(k)
+
+    def limite_atual():
+        return min(limite, corte.limite())
+
+    def pernas(linhas, coluna_base):
+        linhas = np.asarray(linhas, dtype=np.int64)
+        if not len(linhas):
+            return {}
+        bases = [normalizar_texto(valor) for valor in getattr(tabela, coluna_base)[linhas]]
+        return _pernas_por_base(calcular_custos_linhas(tabela, linhas, peso, valor_nf), bases, k)
+
+    def extrair(modalidade, grupos, campos):
+        melhores, avaliadas, podadas = _k_melhores(grupos, k, limite_atual())
+        resultado['avaliadas'] += avaliadas
+        resultado['podadas'] += podadas
+        for total, _, linhas in melhores:
+            rota = {'coleta': None, 'transferencia': None, 'entrega': None, 'total': total}
+            rota.update(zip(campos, linhas))
+            resultado[modalidade].append(rota)
+            linhas_usadas.update(linhas)
+            corte.adicionar(total, None)
+
+    coleta = pernas(linhas_coleta, 'base_origem')
+    entrega = pernas(linhas_entrega, 'base_origem')
+
+    # Coleta + transferência + entrega: arestas entre bases com agentes nas duas pontas.
+    # Pares cujo mínimo de coleta + entrega já não bate o limite nem têm as
+    # transferências calculadas.
+    pares = []
+    for base_a in coleta:
+        for base_b, linhas in grafo.saidas(base_a).items():
+            if base_b not in entrega:
+                continue
+            if coleta[base_a][0][0] + entrega[base_b][0][0] >= limite:
+                resultado['podadas'] += coleta[base_a][2] * len(linhas) * entrega[base_b][2]
+                continue
+            pares.append((base_a, base_b, linhas))
+
+    if pares:
+        linhas_transf = np.concatenate([linhas for _, _, linhas in pares])
+        bases_par = [(base_a, base_b) for base_a, base_b, linhas in pares for _ in range(len(linhas))]
+        transferencias = _pernas_por_base(calcular_custos_linhas(tabela, linhas_transf, peso, valor_nf), bases_par, k)
+
+        grupos = [((base_a, base_b), [coleta[base_a], transf, entrega[base_b]])
+                  for (base_a, base_b), transf in transferencias.items()]
+        extrair('completas', grupos, ('coleta', 'transferencia', 'entrega'))
+
+    # Transferência saindo da cidade de origem + entrega na base de chegada
+    if entrega and len(linhas_saida_origem):
+        saidas = pernas(linhas_saida_origem, 'base_destino')
+        grupos = [(base, [saidas[base], entrega[base]]) for base in saidas if base in entrega]
+        extrair('sem_coleta', grupos, ('transferencia', 'entrega'))
+
+    # Coleta + transferência chegando na cidade de destino
+    if coleta and len(linhas_chegada_destino):
+        chegadas = pernas(linhas_chegada_destino, 'base_origem')
+        grupos = [(base, [coleta[base], chegadas[base]]) for base in chegadas if base in coleta]
+        extrair('sem_entrega', grupos, ('coleta', 'transferencia'))
+
+    if linhas_usadas:
+        resultado['custos'] = custos_por_linha(
+            calcular_custos_linhas(tabela, np.array(sorted(linhas_usadas), dtype=np.int64), peso, valor_nf)
+        )
+
+    with _lock_estatisticas:
+        _estatisticas['buscas'] += 1
+        _estatisticas['combinacoes_avaliadas'] += resultado['avaliadas']
+        _estatisticas['combinacoes_podadas'] += resultado['podadas']
+    return resultado
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tabela de custos do frete dedicado (faixas de distância x veículo)
+
+A tabela fica no banco (tarifas_dedicado e veiculos_dedicado) e é compilada
+uma vez por processo: para cada veículo, os limites superiores das faixas
+ficam numa lista ordenada e a faixa de uma distância é achada com bisect.
+Cada faixa tem valor fixo e/ou valor por km, então a cobrança por km acima
+de 600 km é só mais uma faixa (600 km em diante, sem limite).
+
+As faixas seguem a regra original: limite inferior exclusivo e superior
+inclusivo; distâncias até zero caem na primeira faixa.
+
+O cadastro de veículos traz a capacidade (peso e volume), usada para tirar
+do ranking os veículos em que a carga não cabe.
+"""
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+from cache_recarregavel import CacheRecarregavel
+
+# Veículos: (tipo, peso máximo em kg, volume máximo em m³, descrição)
+VEICULOS_PADRAO = [
+    ("FIORINO", 500, 3, "Utilitário para pequenos volumes"),
+    ("VAN", 1500, 8, "Veículo compacto para cargas leves"),
+    ("3/4", 3500, 16, "Caminhão leve para entregas urbanas"),
+    ("TOCO", 6000, 20, "Caminhão toco para cargas médias"),
+    ("TRUCK", 8000, 25, "Caminhão médio para cargas variadas"),
+    ("CARRETA", 27000, 90, "Carreta para cargas pesadas")
+]
+
+# Valor fixo por faixa de distância (km)
+FAIXAS_PADRAO = [
+    (0, 20, {"FIORINO": 150.0, "VAN": 200.0, "3/4": 250.0, "TOCO": 300.0, "TRUCK": 350.0, "CARRETA": 500.0}),
+    (20, 50, {"FIORINO": 200.0, "VAN": 250.0, "3/4": 300.0, "TOCO": 400.0, "TRUCK": 500.0, "CARRETA": 700.0}),
+    (50, 100, {"FIORINO": 300.0, "VAN": 400.0, "3/4": 500.0, "TOCO": 600.0, "TRUCK": 700.0, "CARRETA": 1000.0}),
+    (100, 150, {"FIORINO": 400.0, "VAN": 500.0, "3/4": 600.0, "TOCO": 800.0, "TRUCK": 1000.0, "CARRETA": 1500.0}),
+    (150, 200, {"FIORINO": 500.0, "VAN": 600.0, "3/4": 800.0, "TOCO": 1000.0, "TRUCK": 1200.0, "CARRETA": 1800.0}),
+    (200, 250, {"FIORINO": 600.0, "VAN": 800.0, "3/4": 1000.0, "TOCO": 1200.0, "TRUCK": 1500.0, "CARRETA": 2200.0}),
+    (250, 300, {"FIORINO": 700.0, "VAN": 900.0, "3/4": 1200.0, "TOCO": 1500.0, "TRUCK": 1800.0, "CARRETA": 2500.0}),
+    (300, 400, {"FIORINO": 900.0, "VAN": 1200.0, "3/4": 1500.0, "TOCO": 1800.0, "TRUCK": 2200.0, "CARRETA": 3000.0}),
+    (400, 600, {"FIORINO": 1200.0, "VAN": 1600.0, "3/4": 2000.0, "TOCO": 2500.0, "TRUCK": 3000.0, "CARRETA": 4000.0})
+]
+
+# Valor por km acima de 600 km
+VALOR_KM_ACIMA_600 = {"FIORINO": 3.0, "VAN": 4.0, "3/4": 4.5, "TOCO": 5.0, "TRUCK": 5.5, "CARRETA": 8.0}
+
+
+def linhas_padrao():
+    """Faixas padrão no formato das linhas de tarifas_dedicado"""
+    linhas = []
+    for distancia_min, distancia_max, valores in FAIXAS_PADRAO:
+        for tipo_veiculo, valor in valores.items():
+            linhas.append({
+                'tipo_veiculo': tipo_veiculo, 'distancia_min': distancia_min, 'distancia_max': distancia_max,
+                'valor_fixo': valor, 'valor_km': None
+            })
+    for tipo_veiculo, valor_km in VALOR_KM_ACIMA_600.items():
+        linhas.append({
+            'tipo_veiculo': tipo_veiculo, 'distancia_min': 600, 'distancia_max': None,
+            'valor_fixo': None, 'valor_km': valor_km
+        })
+    return linhas
+
+
+def veiculos_padrao():
+    """Veículos padrão no formato das linhas de veiculos_dedicado"""
+    return [
+        {'tipo': tipo, 'peso_max': peso_max, 'volume_max': volume_max, 'descricao': descricao, 'ordem': ordem}
+        for ordem, (tipo, peso_max, volume_max, descricao) in enumerate(VEICULOS_PADRAO)
+    ]
+
+
+class TabelaDedicado:
+    """
+    Tabela compilada do frete dedicado
+
+    Attributes:
+        veiculos (dict): {tipo: {tipo, peso_max, volume_max, descricao, ordem}} na ordem de exibição
+        faixas (dict): {tipo: (limites superiores ordenados, limites inferiores, [(valor_fixo, valor_km)])}
+    """
+
+    def __init__(self, linhas, veiculos, geracao=0):
+        self.geracao = geracao
+        self.carregado_em = time.time()
+        self.veiculos = {veiculo['tipo']: veiculo for veiculo in sorted(veiculos, key=lambda v: (v.get('ordem') or 0, v['tipo']))}
+
+        por_veiculo = {}
+        for linha in linhas:
+            por_veiculo.setdefault(linha['tipo_veiculo'], []).append(linha)
+        self.faixas = {}
+        for tipo_veiculo, faixas in por_veiculo.items():
+            faixas.sort(key=lambda linha: _limite(linha['distancia_max']))
+            self.faixas[tipo_veiculo] = (
+                [_limite(linha['distancia_max']) for linha in faixas],
+                [float(linha['distancia_min'] or 0) for linha in faixas],
+                [(float(linha['valor_fixo'] or 0), float(linha['valor_km'] or 0)) for linha in faixas]
+            )
+            if tipo_veiculo not in self.veiculos:
+                # Veículo com tarifa mas sem cadastro: sem limite de capacidade
+                self.veiculos[tipo_veiculo] = {'tipo': tipo_veiculo, 'peso_max': None, 'volume_max': None, 'descricao': None, 'ordem': len(self.veiculos)}
+
+    def custo(self, tipo_veiculo, distancia):
+        """Custo do veículo para a distância (None se nenhuma faixa cobre a distância)"""
+        faixas = self.faixas.get(tipo_veiculo)
+        if not faixas:
+            return None
+        limites, minimos, valores = faixas
+        posicao = bisect_left(limites, distancia)
+        if posicao == len(limites) or (posicao > 0 and distancia <= minimos[posicao]):
+            return None
+        valor_fixo, valor_km = valores[posicao]
+        return valor_fixo + valor_km * distancia
+
+    def custos(self, distancia):
+        """Custo de cada veículo com faixa para a distância, na ordem de exibição"""
+        custos = {}
+        for tipo_veiculo in self.veiculos:
+            custo = self.custo(tipo_veiculo, distancia)
+            if custo is not None:
+                custos[tipo_veiculo] = custo
+        return custos
+
+    def custos_lote(self, distancias, veiculos=None):
+        """
+        Custo de cada veículo para várias distâncias de uma vez (np.searchsorted)
+
+        Returns:
+            dict: {tipo: array float64}, NaN onde nenhuma faixa cobre a distância
+        """
+        distancias = np.asarray(distancias, dtype=np.float64)
+        custos = {}
+        for tipo_veiculo in (veiculos if veiculos is not None else self.veiculos):
+            faixas = self.faixas.get(tipo_veiculo)
+            if not faixas:
+                continue
+            limites, minimos, valores = (np.asarray(valor, dtype=np.float64) for valor in faixas)
+            posicoes = np.searchsorted(limites, distancias, side='left')
+            fora = posicoes == len(limites)
+            posicoes = np.minimum(posicoes, len(limites) - 1)
+            fora |= (posicoes > 0) & (distancias <= minimos[posicoes])
+            resultado = valores[posicoes, 0] + valores[posicoes, 1] * distancias
+            resultado[fora] = np.nan
+            custos[tipo_veiculo] = resultado
+        return custos
+
+    def compativeis(self, peso=0, cubagem=0):
+        """Veículos em que a carga cabe (peso em kg, cubagem em m³)"""
+        peso, cubagem = float(peso or 0), float(cubagem or 0)
+        return [
+            tipo for tipo, veiculo in self.veiculos.items()
+            if (veiculo['peso_max'] is None or peso <= veiculo['peso_max']) and
+               (veiculo['volume_max'] is None or cubagem <= veiculo['volume_max'])
+        ]
+
+    def __len__(self):
+        return sum(len(faixas[0]) for faixas in self.faixas.values())
+
+
+def _limite(distancia_max):
+    return float('inf') if distancia_max is None else float(distancia_max)
+
+
+def tabela_padrao(geracao=0):
+    return TabelaDedicado(linhas_padrao(), veiculos_padrao(), geracao)
+
+
+def carregar_tabela_do_banco(geracao=0):
+    """Lê as faixas e veículos ativos; sem faixas cadastradas usa a tabela padrão"""
+    from models import TarifaDedicado, VeiculoDedicado
+
+    linhas = [tarifa.to_dict() for tarifa in TarifaDedicado.query.filter_by(ativo=True).all()]
+    veiculos = [veiculo.to_dict() for veiculo in VeiculoDedicado.query.filter_by(ativo=True).all()]
+    if not linhas:
+        return tabela_padrao(geracao)
+    return TabelaDedicado(linhas, veiculos or veiculos_padrao(), geracao)
+
+
+class CacheTabelaDedicado(CacheRecarregavel):
+    """Mantém a TabelaDedicado do processo (mesmo funcionamento do CacheTarifas)"""
+
+    def __init__(self, carregador=carregar_tabela_do_banco, ttl=300, janela_obsoleto=30):
+        super().__init__(carregador, 'DEDICADO', 'tabela do dedicado', ttl, janela_obsoleto)
+
+    def _descrever(self, tabela):
+        return f"{len(tabela)} faixas de {len(tabela.veiculos)} veículos carregadas"
+
+    def estatisticas(self):
+        tabela = self._valor
+        estatisticas = super().estatisticas()
+        estatisticas.update({
+            'faixas': len(tabela) if tabela else 0,
+            'veiculos': len(tabela.veiculos) if tabela else 0
+        })
+        return estatisticas
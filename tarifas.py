@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache em memória da base_unificada (tarifas de frete fracionado)
+
+Cada processo mantém uma fotografia (snapshot) da tabela base_unificada,
+carregada uma única vez e reutilizada por todas as cotações. A fotografia
+carrega um número de geração que muda sempre que a base é invalidada
+(edição, inclusão, exclusão ou importação pelo painel admin).
+
+Junto com o DataFrame, o snapshot guarda uma representação colunar
+(TabelaTarifas) com os preços já convertidos para float, de modo que o
+cálculo nunca precise converter texto durante a cotação, e um índice por
+localidade (IndiceLocalidades) que substitui as buscas com str.contains.
+"""
+import re
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from cache_recarregavel import CacheRecarregavel
+
+# Colunas de preço da base (nome no DataFrame -> nome do array na tabela)
+COLUNAS_FAIXAS = ['VALOR MÍNIMO ATÉ 10', '20', '30', '50', '70', '100', '150', '200', '300', '500', 'Acima 500']
+# Limite superior (kg) de cada coluna de COLUNAS_FAIXAS, exceto "Acima 500"
+FAIXAS_PESO = [10, 20, 30, 50, 70, 100, 150, 200, 300, 500]
+COLUNAS_ADICIONAIS = {
+    'Pedagio (100 Kg)': 'pedagio_100kg',
+    'Gris Min': 'gris_min',
+    'Gris Exc': 'gris_exc',
+    'Seguro': 'seguro',
+    'PESO MÁXIMO TRANSPORTADO': 'peso_maximo',
+    'EXCEDENTE': 'excedente'
+}
+COLUNAS_TEXTO = {
+    'Tipo': 'tipo',
+    'Fornecedor': 'fornecedor',
+    'Base Origem': 'base_origem',
+    'Origem': 'origem',
+    'Base Destino': 'base_destino',
+    'Destino': 'destino'
+}
+
+
+def converter_coluna_preco(serie):
+    """
+    Converte uma coluna de preços em texto para float64
+
+    Segue a mesma regra de BaseUnificada._parse_valor: remove "R$" e
+    espaços e troca vírgula por ponto.
+
+    Args:
+        serie (Series): Coluna da base (texto, número ou None)
+
+    Returns:
+        tuple: (array float64 com NaN para vazios/inválidos,
+                array bool indicando valores preenchidos porém inválidos)
+    """
+    texto = serie.astype('string').str.replace('R$', '', regex=False)
+    texto = texto.str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+    valores = pd.to_numeric(texto, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    preenchido = texto.fillna('').str.len().to_numpy() > 0
+    invalidos = preenchido & np.isnan(valores)
+    return valores, invalidos
+
+
+class TabelaTarifas:
+    """
+    Representação colunar da base_unificada
+
+    Cada linha da base é identificada pela sua posição (linha_id), a mesma
+    do DataFrame do snapshot. Os preços ficam em arrays float64 com NaN para
+    valores ausentes ou inválidos.
+
+    Attributes:
+        faixas (ndarray): Matriz (linhas x 11) com mínimo até 10kg, faixas
+            20..500 e "Acima 500", na ordem de COLUNAS_FAIXAS
+        pedagio_100kg, gris_min, gris_exc, seguro, peso_maximo, excedente (ndarray):
+            Custos adicionais por linha
+        tipo, fornecedor, origem, destino, base_origem, base_destino (ndarray):
+            Colunas de texto (dtype object)
+        linhas_invalidas (list): Dicionários {'linha_id', 'fornecedor', 'coluna', 'valor'}
+            para cada preço que não pôde ser convertido
+    """
+
+    def __init__(self, df):
+        self.total = len(df)
+        self.linhas_invalidas = []
+
+        colunas_faixa = []
+        for coluna in COLUNAS_FAIXAS:
+            colunas_faixa.append(self._converter(df, coluna))
+        self.faixas = np.column_stack(colunas_faixa) if self.total else np.empty((0, len(COLUNAS_FAIXAS)))
+
+        for coluna, atributo in COLUNAS_ADICIONAIS.items():
+            setattr(self, atributo, self._converter(df, coluna))
+
+        for coluna, atributo in COLUNAS_TEXTO.items():
+            if coluna in df.columns:
+                valores = df[coluna].to_numpy(dtype=object)
+            else:
+                valores = np.full(self.total, None, dtype=object)
+            setattr(self, atributo, valores)
+
+        if self.linhas_invalidas:
+            print(f"[TARIFAS] ⚠️ {len(self.linhas_invalidas)} valores de preço inválidos na base (tratados como ausentes)")
+
+    def _converter(self, df, coluna):
+        if coluna not in df.columns:
+            return np.full(self.total, np.nan)
+
+        valores, invalidos = converter_coluna_preco(df[coluna])
+        for linha_id in np.flatnonzero(invalidos):
+            self.linhas_invalidas.append({
+                'linha_id': int(linha_id),
+                'fornecedor': df['Fornecedor'].iat[linha_id] if 'Fornecedor' in df.columns else None,
+                'coluna': coluna,
+                'valor': df[coluna].iat[linha_id]
+            })
+        return valores
+
+    def __len__(self):
+        return self.total
+
+    def coluna_faixa(self, nome):
+        """Retorna o array de uma coluna de faixa pelo nome usado na base (ex: '50')"""
+        return self.faixas[:, COLUNAS_FAIXAS.index(str(nome))]
+
+    def valores_linha(self, linha_id):
+        """Retorna os preços convertidos de uma linha como dicionário (NaN = ausente)"""
+        valores = {coluna: float(self.faixas[linha_id, i]) for i, coluna in enumerate(COLUNAS_FAIXAS)}
+        for coluna, atributo in COLUNAS_ADICIONAIS.items():
+            valores[coluna] = float(getattr(self, atributo)[linha_id])
+        return valores
+
+
+def calcular_fretes_base(tabela, linhas, pesos, faixas=None, usar_valor_minimo=True, usar_acima_500=True):
+    """
+    Calcula o frete base por faixa de peso para várias linhas e pesos de uma vez
+
+    Mesma regra da transferência padrão do código original:
+      1) peso até 10kg com valor mínimo > 0 -> valor mínimo
+      2) primeira faixa >= peso com valor > 0 -> peso * valor da faixa
+         (faixas sem valor são puladas em direção às faixas maiores)
+      3) "Acima 500" > 0 -> peso * valor
+      4) valor mínimo > 0 -> valor mínimo
+      5) 0.0
+
+    Args:
+        tabela (TabelaTarifas): Tabela do snapshot
+        linhas (array): linha_id das linhas candidatas
+        pesos (float ou array): Peso(s) de cálculo em kg
+        faixas (list): Faixas consideradas (padrão: 20..500); valores que não
+            existem na base são ignorados
+        usar_valor_minimo (bool): Aplica a regra 1
+        usar_acima_500 (bool): Aplica a regra 3
+
+    Returns:
+        ndarray: Frete base com forma (linhas,) para peso escalar ou
+            (linhas, pesos) para vários pesos
+    """
+    linhas = np.asarray(linhas, dtype=np.int64)
+    escalar = np.ndim(pesos) == 0
+    pesos = np.atleast_1d(np.asarray(pesos, dtype='float64'))
+
+    if faixas is None:
+        colunas = list(range(1, len(FAIXAS_PESO)))
+    else:
+        colunas = sorted({FAIXAS_PESO.index(int(float(f))) for f in faixas
+                          if float(f) in FAIXAS_PESO and float(f) > FAIXAS_PESO[0]},
+                         key=lambda c: FAIXAS_PESO[c])
+    limites = np.array([FAIXAS_PESO[c] for c in colunas], dtype='float64')
+
+    dados = tabela.faixas[linhas]
+    minimo = dados[:, 0]
+    acima = dados[:, len(FAIXAS_PESO)]
+    valores_faixa = dados[:, colunas]
+    validos = valores_faixa > 0  # NaN compara como False
+
+    # proxima[r, j] = primeira faixa >= j com valor válido (len(colunas) se nenhuma)
+    total_faixas = len(colunas)
+    proxima = np.full((len(linhas), total_faixas + 1), total_faixas, dtype=np.int64)
+    for j in range(total_faixas - 1, -1, -1):
+        proxima[:, j] = np.where(validos[:, j], j, proxima[:, j + 1])
+
+    inicio = np.searchsorted(limites, pesos, side='left')
+    faixa_escolhida = proxima[:, inicio]
+    tem_faixa = faixa_escolhida < total_faixas
+    indice_seguro = np.minimum(faixa_escolhida, max(total_faixas - 1, 0))
+    if total_faixas:
+        valor_faixa = np.take_along_axis(valores_faixa, indice_seguro, axis=1)
+    else:
+        valor_faixa = np.zeros_like(faixa_escolhida, dtype='float64')
+
+    minimo_valido = (minimo > 0)[:, None]
+    acima_valido = (acima > 0)[:, None] & usar_acima_500
+    minimo_col = np.nan_to_num(minimo)[:, None]
+
+    resultado = np.where(tem_faixa, pesos[None, :] * valor_faixa,
+                np.where(acima_valido, pesos[None, :] * np.nan_to_num(acima)[:, None],
+                np.where(minimo_valido, minimo_col, 0.0)))
+
+    if usar_valor_minimo:
+        ate_10 = (pesos <= FAIXAS_PESO[0])[None, :] & minimo_valido
+        resultado = np.where(ate_10, minimo_col, resultado)
+
+    return resultado[:, 0] if escalar else resultado
+
+def calcular_adicionais(pesos, valor_nf, gris_exc, gris_min, pedagio_100kg, seguro):
+    """
+    Calcula GRIS, pedágio e seguro para vários candidatos de uma vez
+
+    Parâmetros ausentes (NaN) desligam o custo correspondente, como os campos
+    vazios da base no código original:
+      - GRIS: max(valor_nf * Gris Exc / 100, Gris Min), se houver NF e Gris Exc
+      - Pedágio: (peso / 100) * Pedagio (100 Kg)
+      - Seguro: valor_nf * Seguro / 100, se houver NF
+
+    Args:
+        pesos (float ou array): Peso(s) de cálculo em kg
+        valor_nf (float): Valor da nota fiscal (None/0 = sem NF)
+        gris_exc, gris_min, pedagio_100kg, seguro (float ou array): Parâmetros
+            por candidato (escalares são aplicados a todos)
+
+    Returns:
+        dict: Arrays 'gris', 'pedagio' e 'seguro' no formato dos parâmetros
+    """
+    pesos = np.asarray(pesos, dtype='float64')
+    gris_exc = np.asarray(gris_exc, dtype='float64')
+    seguro = np.asarray(seguro, dtype='float64')
+    pedagio_100kg = np.asarray(pedagio_100kg, dtype='float64')
+    nf = float(valor_nf or 0)
+
+    if nf:
+        gris = np.where(np.isnan(gris_exc), 0.0,
+                        np.maximum(nf * np.nan_to_num(gris_exc) / 100,
+                                   np.nan_to_num(np.asarray(gris_min, dtype='float64'))))
+        valor_seguro = nf * (np.nan_to_num(seguro) / 100)
+    else:
+        gris = np.zeros(np.broadcast(gris_exc, gris_min).shape)
+        valor_seguro = np.zeros(seguro.shape)
+
+    pedagio = (pesos / 100) * np.nan_to_num(pedagio_100kg)
+
+    return {'gris': gris, 'pedagio': pedagio, 'seguro': valor_seguro}
+
+
+def calcular_custos_linhas(tabela, linhas, peso, valor_nf, **opcoes_faixa):
+    """
+    Monta a composição de custo (frete base + adicionais) das linhas candidatas
+
+    Args:
+        tabela (TabelaTarifas): Tabela do snapshot
+        linhas (array): linha_id das linhas candidatas
+        peso (float): Peso de cálculo em kg
+        valor_nf (float): Valor da nota fiscal
+        **opcoes_faixa: Repassadas para calcular_fretes_base
+
+    Returns:
+        dict: Arrays alinhados com `linhas`: 'linhas', 'custo_base', 'gris',
+            'pedagio', 'seguro', 'total' e 'peso_maximo' (NaN = sem limite)
+    """
+    linhas = np.asarray(linhas, dtype=np.int64)
+    custos = calcular_adicionais(
+        peso, valor_nf,
+        tabela.gris_exc[linhas], tabela.gris_min[linhas],
+        tabela.pedagio_100kg[linhas], tabela.seguro[linhas]
+    )
+    custos['linhas'] = linhas
+    custos['custo_base'] = calcular_fretes_base(tabela, linhas, peso, **opcoes_faixa)
+    custos['total'] = custos['custo_base'] + custos['gris'] + custos['pedagio'] + custos['seguro']
+    custos['peso_maximo'] = tabela.peso_maximo[linhas]
+    return custos
+
+
+def custos_por_linha(custos):
+    """
+    Converte os arrays de calcular_custos_linhas em {linha_id: composição}
+
+    Apenas linhas com frete base positivo entram no resultado.
+    """
+    resultado = {}
+    for i in np.flatnonzero(custos['custo_base'] > 0):
+        peso_maximo = custos['peso_maximo'][i]
+        resultado[int(custos['linhas'][i])] = {
+            'custo_base': float(custos['custo_base'][i]),
+            'gris': float(custos['gris'][i]),
+            'pedagio': float(custos['pedagio'][i]),
+            'seguro': float(custos['seguro'][i]),
+            'total': float(custos['total'][i]),
+            'peso_maximo': None if np.isnan(peso_maximo) else float(peso_maximo)
+        }
+    return resultado
+
+# Colunas de localidade indexadas
+COLUNAS_LOCALIDADE = ['Origem', 'Destino', 'Base Origem', 'Base Destino']
+
+UFS_BRASIL = {
+    'AC', 'AL', 'AP', 'AM', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MT', 'MS', 'MG', 'PA',
+    'PB', 'PR', 'PE', 'PI', 'RJ', 'RN', 'RS', 'RO', 'RR', 'SC', 'SP', 'SE', 'TO'
+}
+
+_RE_UF_SUFIXO = re.compile(r'^(.*?)\s*(?:/|-|\(|,)\s*([A-Za-z]{2})\)?$')
+
+
+def normalizar_texto(texto):
+    """
+    Normaliza texto para comparação: sem acentos, minúsculo e com espaços únicos
+
+    Args:
+        texto (str): Texto original (ex: "  São  Paulo ")
+
+    Returns:
+        str: Texto normalizado (ex: "sao paulo") ou "" se vazio
+    """
+    if texto is None or (isinstance(texto, float) and np.isnan(texto)):
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.casefold().split())
+
+
+def chave_localidade(municipio, uf=None):
+    """
+    Gera a chave (município, UF) normalizada usada pelo índice
+
+    Aceita a UF separada ou embutida no nome ("Campinas/SP", "Campinas - SP",
+    "Campinas (SP)"). A UF vazia significa "não informada".
+
+    Returns:
+        tuple: (municipio_normalizado, uf_normalizada)
+    """
+    texto = '' if municipio is None else str(municipio).strip()
+    uf_normalizada = normalizar_texto(uf)[:2] if uf else ''
+
+    encontrado = _RE_UF_SUFIXO.match(texto)
+    if encontrado and encontrado.group(1) and encontrado.group(2).upper() in UFS_BRASIL:
+        texto = encontrado.group(1)
+        if not uf_normalizada:
+            uf_normalizada = encontrado.group(2).casefold()
+
+    return normalizar_texto(texto), uf_normalizada
+
+
+class IndiceLocalidades:
+    """
+    Índice hash das colunas de localidade da base
+
+    Para cada coluna (Origem, Destino, Base Origem, Base Destino) mantém um
+    dicionário município normalizado -> {uf -> array de linha_id}. A busca é
+    exata (sem acentos e sem diferenciar maiúsculas); a busca por trecho do
+    nome só acontece quando pedida explicitamente.
+    """
+
+    def __init__(self, df):
+        self.total = len(df)
+        self._indices = {}
+        for coluna in COLUNAS_LOCALIDADE:
+            self._indices[coluna] = self._indexar(df[coluna] if coluna in df.columns else [])
+
+        self._por_tipo = {}
+        if 'Tipo' in df.columns:
+            for linha_id, tipo in enumerate(df['Tipo'].to_numpy(dtype=object)):
+                self._por_tipo.setdefault(normalizar_texto(tipo), []).append(linha_id)
+        self._por_tipo = {tipo: np.array(ids, dtype=np.int64) for tipo, ids in self._por_tipo.items()}
+
+    def _indexar(self, valores):
+        indice = {}
+        cache_chaves = {}
+        for linha_id, valor in enumerate(valores):
+            if valor not in cache_chaves:
+                cache_chaves[valor] = chave_localidade(valor)
+            municipio, uf = cache_chaves[valor]
+            if not municipio:
+                continue
+            indice.setdefault(municipio, {}).setdefault(uf, []).append(linha_id)
+
+        return {
+            municipio: {uf: np.array(ids, dtype=np.int64) for uf, ids in por_uf.items()}
+            for municipio, por_uf in indice.items()
+        }
+
+    def buscar(self, coluna, municipio, uf=None, permitir_substring=False):
+        """
+        Retorna as linhas cuja coluna corresponde ao município (e UF)
+
+        Args:
+            coluna (str): 'Origem', 'Destino', 'Base Origem' ou 'Base Destino'
+            municipio (str): Nome do município ou código da base
+            uf (str): UF opcional; linhas sem UF cadastrada também são aceitas
+            permitir_substring (bool): Se nenhuma linha bater exatamente,
+                procura chaves que contenham o texto (comportamento antigo)
+
+        Returns:
+            ndarray: linha_id ordenados (int64)
+        """
+        chave, uf_chave = chave_localidade(municipio, uf)
+        if not chave:
+            return np.empty(0, dtype=np.int64)
+
+        indice = self._indices.get(coluna, {})
+        por_uf = indice.get(chave)
+        if por_uf is None and permitir_substring:
+            blocos = [ids for nome, por_uf_nome in indice.items() if chave in nome
+                      for uf_linha, ids in por_uf_nome.items() if not uf_chave or uf_linha in ('', uf_chave)]
+            return np.unique(np.concatenate(blocos)) if blocos else np.empty(0, dtype=np.int64)
+        if not por_uf:
+            return np.empty(0, dtype=np.int64)
+
+        if uf_chave:
+            blocos = [ids for uf_linha, ids in por_uf.items() if uf_linha in ('', uf_chave)]
+        else:
+            blocos = list(por_uf.values())
+        if not blocos:
+            return np.empty(0, dtype=np.int64)
+        return blocos[0] if len(blocos) == 1 else np.unique(np.concatenate(blocos))
+
+    def linhas_tipo(self, tipo):
+        """Retorna as linhas de um Tipo da base ('Agente', 'Transferência', ...)"""
+        return self._por_tipo.get(normalizar_texto(tipo), np.empty(0, dtype=np.int64))
+
+
+class SnapshotTarifas:
+    """
+    Fotografia somente-leitura da base_unificada
+
+    Attributes:
+        df (DataFrame): Dados da base no formato usado pelo cálculo
+        tabela (TabelaTarifas): Mesmos dados em arrays numéricos
+        indice (IndiceLocalidades): Índice por origem/destino/bases
+        geracao (int): Geração da base no momento da carga
+        carregado_em (float): Timestamp (time.time) da carga
+        duracao_carga (float): Tempo gasto na carga em segundos
+        grafo_bases (GrafoBases): Grafo de transferências entre bases,
+            montado sob demanda por rotas.grafo_do_snapshot
+    """
+
+    def __init__(self, df, geracao, carregado_em, duracao_carga=0.0):
+        self.df = df
+        self.tabela = TabelaTarifas(df) if df is not None else None
+        self.indice = IndiceLocalidades(df) if df is not None else None
+        self.grafo_bases = None
+        self.geracao = geracao
+        self.carregado_em = carregado_em
+        self.duracao_carga = duracao_carga
+
+    def __len__(self):
+        return len(self.df) if self.df is not None else 0
+
+    def __repr__(self):
+        return f'<SnapshotTarifas geracao={self.geracao} registros={len(self)}>'
+
+
+class CacheTarifas(CacheRecarregavel):
+    """
+    Mantém o snapshot de tarifas do processo e controla sua invalidação
+
+    Args:
+        carregador (callable): Função sem argumentos que retorna o DataFrame
+            da base (ou None em caso de erro)
+        ttl (float): Idade máxima do snapshot em segundos (0 = sem expiração)
+        janela_obsoleto (float): Por quanto tempo o snapshot anterior ainda é
+            servido enquanto uma thread recarrega a base
+    """
+
+    def __init__(self, carregador, ttl=300, janela_obsoleto=30):
+        super().__init__(self._carregar_snapshot, 'TARIFAS', 'base de tarifas', ttl, janela_obsoleto)
+        self._carregador_base = carregador
+
+    def _carregar_snapshot(self, geracao):
+        inicio = time.time()
+        df = self._carregador_base()
+        if df is None:
+            return None
+        snapshot = SnapshotTarifas(df, geracao, time.time())
+        snapshot.duracao_carga = time.time() - inicio
+        return snapshot
+
+    def _descrever(self, snapshot):
+        return f"Snapshot carregado: {len(snapshot)} registros em {snapshot.duracao_carga:.2f}s"
+
+    def estatisticas(self):
+        """Retorna informações do cache para diagnóstico"""
+        snapshot = self._valor
+        estatisticas = super().estatisticas()
+        estatisticas.update({
+            'registros': len(snapshot) if snapshot else 0,
+            'valores_invalidos': len(snapshot.tabela.linhas_invalidas) if snapshot and snapshot.tabela else 0,
+            'duracao_carga': round(snapshot.duracao_carga, 3) if snapshot else None
+        })
+        return estatisticas
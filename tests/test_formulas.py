@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fórmulas do setup inicial: validação e mesmo resultado do exec original
+
+Executar: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formulas import (
+    FORMULAS_ORIGINAIS, FormulaInvalida, avaliar_expressao, detectar_modo, executar_bloco, validar_formula
+)
+
+# Linhas da base como chegam às fórmulas (valores texto, números e ausentes)
+LINHAS_BASE = [
+    {'VALOR MÍNIMO ATÉ 10': '45.5', '20': '3.1', '30': '2.9', '50': '2.5', '70': '2.2', '100': '1.9',
+     '150': '1.7', '200': '1.5', '300': '1.3', '500': '1.1'},
+    {'VALOR MÍNIMO ATÉ 10': 0, '20': 0, '30': 0, '50': 4.0, '100': 3.5, '150': 0, '200': 0, '300': 280.0, '500': 0},
+    {'10': '12', '200': '310.0'},
+    {},
+]
+PESOS = [1, 10, 10.5, 25, 60, 99.9, 180, 450, 800]
+CUSTOS_ROTA = {'custo_coleta_total': 80.0, 'custo_transferencia_total': 350.25, 'custo_entrega_total': 95.5}
+
+
+def executar_original(fonte, variaveis):
+    """Execução anterior à validação: exec com os builtins completos"""
+    escopo = {'resultado': 0}
+    escopo.update(variaveis)
+    exec(fonte.strip(), {}, escopo)
+    return escopo.get('resultado', 0)
+
+
+class TestFormulasOriginais(unittest.TestCase):
+
+    def test_validam(self):
+        for formula in FORMULAS_ORIGINAIS:
+            with self.subTest(formula=formula['nome']):
+                validar_formula(formula['formula'], detectar_modo(formula['formula']))
+
+    def test_mesmo_resultado_do_exec(self):
+        for formula in FORMULAS_ORIGINAIS:
+            for linha_base in LINHAS_BASE:
+                for peso in PESOS:
+                    variaveis = dict(CUSTOS_ROTA, peso_usado=peso, peso_cubado=peso, valor_nf=1000, linha_base=linha_base)
+                    with self.subTest(formula=formula['nome'], linha_base=linha_base, peso=peso):
+                        esperado = executar_original(formula['formula'], variaveis)
+                        obtido = executar_bloco(formula['formula'], variaveis, chave=('teste', formula['nome']))
+                        self.assertEqual(obtido, esperado)
+
+
+class TestLacos(unittest.TestCase):
+
+    def test_laco_sobre_chamada_recusado(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula("for x in range(10):\n    resultado = x", 'exec')
+
+    def test_alvo_composto_recusado(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula("for a, b in [(1, 2)]:\n    resultado = a", 'exec')
+
+    def test_while_recusado(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula("while True:\n    pass", 'exec')
+
+
+class TestLimites(unittest.TestCase):
+
+    def test_potencia_encadeada_recusada(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula('9**9**9', 'eval')
+
+    def test_expoente_constante_grande_recusado(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula('peso_usado ** 1000', 'eval')
+
+    def test_repeticao_de_lista_recusada(self):
+        for fonte in ('[0]*10**10', "'a' * peso_usado", "resultado = 1\nresultado *= [0]"):
+            with self.subTest(fonte=fonte):
+                with self.assertRaises(FormulaInvalida):
+                    validar_formula(fonte, detectar_modo(fonte))
+
+    def test_formatacao_de_texto_recusada(self):
+        with self.assertRaises(FormulaInvalida):
+            validar_formula("'%0999999999d' % 1", 'eval')
+
+    def test_limites_na_execucao(self):
+        casos = [
+            ('base ** expoente', {'base': 9, 'expoente': 9 ** 9}),
+            ('((base ** 9) ** 9) ** 9', {'base': 9 ** 9}),
+            ('lista * n', {'lista': [0], 'n': 10 ** 10}),
+            ('texto % 1', {'texto': '%0999999999d'}),
+        ]
+        for fonte, variaveis in casos:
+            with self.subTest(fonte=fonte):
+                with self.assertRaises(FormulaInvalida):
+                    avaliar_expressao(fonte, variaveis, chave=('teste', fonte))
+
+    def test_repeticao_em_atribuicao_limitada(self):
+        with self.assertRaises(FormulaInvalida):
+            executar_bloco("resultado = (0,)\nresultado *= n", {'n': 10 ** 10}, chave=('teste', 'repeticao'))
+
+    def test_concatenacao_em_laco_limitada(self):
+        fonte = "x = [0]\nfor i in [" + ', '.join(['0'] * 40) + "]:\n    x = x + x\nresultado = 1"
+        with self.assertRaises(FormulaInvalida):
+            executar_bloco(fonte, {}, chave=('teste', 'concatenacao'))
+
+    def test_aritmetica_comum_inalterada(self):
+        variaveis = {'peso_usado': 37.5, 'valor_kg': 2.25, 'taxa': 0.01, 'meses': 12, 'pedagio': 4}
+        fonte = 'round(peso_usado * valor_kg * (1 + taxa) ** meses + pedagio % 3, 2)'
+        self.assertEqual(avaliar_expressao(fonte, variaveis), eval(fonte, {}, dict(variaveis)))
+        bloco = "resultado = peso_usado\nresultado *= valor_kg\nresultado **= 2\nresultado += pedagio\nresultado %= 1000"
+        self.assertEqual(executar_bloco(bloco, variaveis), executar_original(bloco, variaveis))
+
+
+if __name__ == '__main__':
+    unittest.main()
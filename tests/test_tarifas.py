@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Frete base vetorizado (calcular_fretes_base) contra as regras linha a linha do código original
+
+Executar: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from tarifas import TabelaTarifas, calcular_fretes_base
+
+CAMINHO_BASE = os.path.join(RAIZ, 'data', 'Base_Unificada.csv')
+TOTAL_AMOSTRA = 3000
+
+# Limites das faixas e valores logo acima/abaixo deles
+PESOS = [0.5, 10, 10.01, 15, 20, 20.5, 49.9, 70, 100.1, 180, 300, 500, 750]
+
+
+def transferencia_padrao_original(linha, peso_cubado):
+    """Regra de calcular_transferencia_padrao antes da versão vetorizada"""
+    peso_calculo = float(peso_cubado)
+
+    valor_minimo = linha.get('VALOR MÍNIMO ATÉ 10')
+    if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
+        return float(valor_minimo)
+
+    for faixa in [20, 30, 50, 70, 100, 150, 200, 300, 500]:
+        if peso_calculo <= float(faixa):
+            valor_faixa = linha.get(str(faixa), 0)
+            if valor_faixa and float(valor_faixa) > 0:
+                return peso_calculo * float(valor_faixa)
+
+    for col_acima in ['Acima 500', 'Acima 1000', 'Acima 2000']:
+        valor_acima = linha.get(col_acima)
+        if valor_acima and float(valor_acima) > 0:
+            return peso_calculo * float(valor_acima)
+
+    if valor_minimo and float(valor_minimo) > 0:
+        return float(valor_minimo)
+
+    return 0.0
+
+
+def tabela_faixas_original(linha_base, peso_cubado, config):
+    """Regra de calcular_com_tabela_faixas antes da versão vetorizada (sem "Acima 500")"""
+    peso_calculo = float(peso_cubado)
+
+    if config.get('usar_valor_minimo', True):
+        valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
+        if peso_calculo <= 10 and valor_minimo and float(valor_minimo) > 0:
+            return float(valor_minimo)
+
+    for faixa in config.get('faixas', [20, 30, 50, 70, 100, 150, 200, 300, 500]):
+        if peso_calculo <= float(faixa):
+            valor_faixa = linha_base.get(str(faixa), 0)
+            if valor_faixa and float(valor_faixa) > 0:
+                return peso_calculo * float(valor_faixa)
+
+    valor_minimo = linha_base.get('VALOR MÍNIMO ATÉ 10')
+    if valor_minimo and float(valor_minimo) > 0:
+        return float(valor_minimo)
+
+    return 0.0
+
+
+class TestFretesBase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_csv(CAMINHO_BASE, sep=';', dtype=str)
+        cls.tabela = TabelaTarifas(df)
+        rng = np.random.default_rng(2024)
+        cls.linhas = np.sort(rng.choice(len(df), size=min(TOTAL_AMOSTRA, len(df)), replace=False))
+
+    def comparar(self, obtido, regra):
+        divergencias = []
+        for i, linha_id in enumerate(self.linhas):
+            linha = self.tabela.valores_linha(linha_id)
+            for j, peso in enumerate(PESOS):
+                esperado = regra(linha, peso)
+                if not np.isclose(obtido[i, j], esperado, rtol=1e-12, atol=1e-9):
+                    divergencias.append((int(linha_id), peso, float(obtido[i, j]), esperado))
+        self.assertEqual(divergencias[:10], [], f"{len(divergencias)} divergências (linha_id, peso, obtido, esperado)")
+
+    def test_transferencia_padrao(self):
+        obtido = calcular_fretes_base(self.tabela, self.linhas, PESOS)
+        self.assertEqual(obtido.shape, (len(self.linhas), len(PESOS)))
+        self.comparar(obtido, transferencia_padrao_original)
+
+    def test_faixas_configuradas(self):
+        config = {'faixas': [30, 70, 150, 300, 500], 'usar_valor_minimo': False}
+        obtido = calcular_fretes_base(self.tabela, self.linhas, PESOS, faixas=config['faixas'],
+                                      usar_valor_minimo=False, usar_acima_500=False)
+        self.comparar(obtido, lambda linha, peso: tabela_faixas_original(linha, peso, config))
+
+    def test_faixas_vazias_puladas(self):
+        df = pd.DataFrame([
+            {'VALOR MÍNIMO ATÉ 10': '40', '20': '0', '30': '', '50': '2,5', '500': '1.2', 'Acima 500': '0'},
+            {'VALOR MÍNIMO ATÉ 10': '', '100': '3', 'Acima 500': '0.9'},
+            {'VALOR MÍNIMO ATÉ 10': '55'},
+            {},
+        ])
+        tabela = TabelaTarifas(df)
+        obtido = calcular_fretes_base(tabela, np.arange(len(df)), PESOS)
+        for linha_id in range(len(df)):
+            linha = tabela.valores_linha(linha_id)
+            for j, peso in enumerate(PESOS):
+                with self.subTest(linha_id=linha_id, peso=peso):
+                    self.assertAlmostEqual(obtido[linha_id, j], transferencia_padrao_original(linha, peso))
+
+    def test_peso_escalar(self):
+        obtido = calcular_fretes_base(self.tabela, self.linhas[:50], 37.5)
+        self.assertEqual(obtido.shape, (50,))
+        for i, linha_id in enumerate(self.linhas[:50]):
+            self.assertAlmostEqual(obtido[i], transferencia_padrao_original(self.tabela.valores_linha(linha_id), 37.5))
+
+
+if __name__ == '__main__':
+    unittest.main()